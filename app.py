@@ -13,7 +13,6 @@ from modules.utils.qr_generate import generate_qr_code
 from modules.translation.deepl_api import DeepLAPI
 from modules.whisper.whisper_parameter import *
 from modules.normalization.sip3_api import SIP3API
-from modules.whisper.whisper_online import current_result
 
 # os.environ["CUDA_VISIBLE_DEVICES"] = "0"
 
@@ -226,7 +225,7 @@ class App:
                             video_display = gr.Video(label="Video Display", width=360, height=640)
                             input_file.upload(fn=process_and_display_video, inputs=input_file, outputs=video_display)
                             realtime_transcription = gr.Textbox(label="Real-time Transcription",
-                                value=current_result(),
+                                value=self.whisper_inf.current_transcript,
                                 every=1,
                                 # info="当前时间",
                             )
@@ -330,11 +329,16 @@ class App:
                     #     )
                     with gr.Row():
                         mic_input = gr.Microphone(label="Record with Mic", type="filepath", interactive=True, streaming=False)
-                        # realtime_transcription = gr.Textbox(label="Real-time Transcription",
-                        #     # value=current_result(),
-                        #     every=1,
-                        #     # info="当前时间",
-                        # )
+                    # streaming mode: every update carries only the new samples, see MicStream.
+                    # Hidden for the implementations without online inference.
+                    with gr.Row(visible=self.whisper_inf.supports_online_inference):
+                        mic_stream_input = gr.Audio(sources=["microphone"], label="Stream with Mic", type="numpy", streaming=True)
+                        mic_stream_state = gr.State(None)
+                        tb_mic_stream_latest = gr.Textbox(label="Latest Committed Text")
+                        mic_realtime_transcription = gr.Textbox(label="Real-time Transcription",
+                            value=self.whisper_inf.current_transcript,
+                            every=1,
+                        )
                     whisper_params, dd_file_format, cb_timestamp = self.create_whisper_parameters()
                     
                     with gr.Row():
@@ -384,6 +388,14 @@ class App:
                     btn_openfolder.click(fn=lambda: self.open_folder("outputs"), inputs=None, outputs=None) 
                     # btn_openfolder_standardized.click(fn=lambda: self.open_folder("outputs"), inputs=None, outputs=None)
 
+                    # streaming mic: one online iteration per update, flushed when the recording stops
+                    mic_stream_input.stream(fn=self.whisper_inf.transcribe_mic_streaming,
+                                            inputs=[mic_stream_input, mic_stream_state] + whisper_params.as_list(),
+                                            outputs=[mic_stream_state, tb_mic_stream_latest])
+                    mic_stream_input.stop_recording(fn=self.whisper_inf.finish_mic_streaming,
+                                                    inputs=[mic_stream_state],
+                                                    outputs=[mic_stream_state, tb_mic_stream_latest])
+
                     # srt2table button
                     btn_parse_file_to_table.click(parse_and_summarize, inputs=[files_subtitles], outputs=[tb_table])
                                         
@@ -463,6 +475,9 @@ class App:
                 #                          inputs=None,
                 #                          outputs=None)
 
+            # drop the real-time transcript of a user who left
+            self.app.unload(self.whisper_inf.release_transcript)
+
         # Launch the app with optional gradio settings
         launch_args = {}
         if self.args.share:
@@ -519,6 +534,21 @@ parser.add_argument('--diarization_model_dir', type=str, default=os.path.join("m
 parser.add_argument('--nllb_model_dir', type=str, default=os.path.join("models", "NLLB"),
                     help='Directory path of the Facebook NLLB model')
 parser.add_argument('--output_dir', type=str, default=os.path.join("outputs"), help='Directory path of the outputs')
+parser.add_argument('--parallel_workers', type=int, default=1,
+                    help='Worker processes with a CPU model each that transcribe the files of a folder in parallel')
+parser.add_argument('--model_pool_size_mb', type=float, default=0,
+                    help='Memory for the loaded Whisper models, in RAM or VRAM depending on the device. Recently used '
+                         'models stay loaded while they fit in it. Only the current model is kept if 0')
+parser.add_argument('--adaptive_chunk', action='store_true',
+                    help='Adapt the chunk size of online inference to --target_latency from the measured decoding time, '
+                         'instead of a fixed minimum chunk size')
+parser.add_argument('--target_latency', type=float, default=2.0,
+                    help='Target latency of --adaptive_chunk in seconds: chunk size + decoding time of an iteration')
+parser.add_argument('--transcription_cache_dir', type=str, default="",
+                    help='Directory where the transcriptions are cached by audio content and decoding parameters. '
+                         'The transcripts are stored there as plain data. Disabled by default')
+parser.add_argument('--transcription_cache_size_mb', type=float, default=1024,
+                    help='Size of the transcription cache, the least recently used transcriptions are deleted beyond it')
 _args = parser.parse_args()
 
 theme = gr.themes.Base(
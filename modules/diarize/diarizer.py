@@ -1,11 +1,12 @@
 import os
 import torch
-from typing import List
+from typing import List, Union
 import time
 import logging
 
 from modules.diarize.diarize_pipeline import DiarizationPipeline, assign_word_speakers
 from modules.diarize.audio_loader import load_audio
+from modules.utils.audio_manager import DecodedAudio
 
 
 class Diarizer:
@@ -20,7 +21,7 @@ class Diarizer:
         self.pipe = None
 
     def run(self,
-            audio: str,
+            audio: Union[str, DecodedAudio],
             transcribed_result: List[dict],
             use_auth_token: str,
             device: str,
@@ -32,8 +33,8 @@ class Diarizer:
 
         Parameters
         ----------
-        audio: Union[str, BinaryIO, np.ndarray]
-            Audio input. This can be file path or binary type.
+        audio: Union[str, DecodedAudio]
+            Audio input. This can be file path, or the audio decoded by WhisperBase.run().
         transcribed_result: List[dict]
             transcribed result through whisper.
         use_auth_token: str
@@ -58,7 +59,10 @@ class Diarizer:
                 use_auth_token=use_auth_token,
             )
 
-        audio = load_audio(audio)
+        if isinstance(audio, DecodedAudio):
+            audio = audio.samples
+        else:
+            audio = load_audio(audio)
 
         diarization_segments = self.pipe(
             audio=audio,
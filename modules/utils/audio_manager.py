@@ -0,0 +1,62 @@
+import hashlib
+from dataclasses import dataclass, field
+from typing import BinaryIO, Optional, Union
+
+import numpy as np
+
+SAMPLING_RATE = 16000
+
+
+@dataclass
+class DecodedAudio:
+    """
+    Audio of one transcription, decoded once to 16 kHz mono float32.
+
+    WhisperBase.run() creates it and hands the same object to the VAD, the transcription and
+    the diarization, so the file is decoded a single time however many stages use it.
+    """
+    samples: np.ndarray
+    source: Optional[str] = None # path of the decoded file, if it was decoded from one
+    sampling_rate: int = SAMPLING_RATE
+    _content_hash: Optional[str] = field(default=None, repr=False, compare=False)
+
+    @classmethod
+    def load(cls, audio: Union[str, BinaryIO, np.ndarray, "DecodedAudio"]) -> "DecodedAudio":
+        """
+        Decodes the audio, or wraps it if it is already decoded.
+
+        Parameters
+        ----------
+        audio: Union[str, BinaryIO, np.ndarray, DecodedAudio]
+            Audio path or file binary, 16 kHz mono numpy array, or an already decoded audio.
+
+        Returns
+        ----------
+        DecodedAudio
+        """
+        if isinstance(audio, cls):
+            return audio
+        if isinstance(audio, np.ndarray):
+            return cls(samples=np.ascontiguousarray(audio, dtype=np.float32))
+        import faster_whisper
+        samples = faster_whisper.decode_audio(audio, sampling_rate=SAMPLING_RATE)
+        return cls(samples=samples, source=audio if isinstance(audio, str) else None)
+
+    @property
+    def duration(self) -> float:
+        """duration in seconds"""
+        return len(self.samples) / self.sampling_rate
+
+    @property
+    def content_hash(self) -> str:
+        """SHA-256 of the decoded samples, computed on first use"""
+        if self._content_hash is None:
+            self._content_hash = hashlib.sha256(self.samples.tobytes()).hexdigest()
+        return self._content_hash
+
+    def read(self, start: float, end: float) -> np.ndarray:
+        """samples from start to end seconds, like AudioChunkReader.read"""
+        return self.samples[int(start*self.sampling_rate):int(end*self.sampling_rate)]
+
+    def __len__(self):
+        return len(self.samples)
@@ -1,10 +1,12 @@
 from faster_whisper.vad import VadOptions, get_vad_model
 import numpy as np
-from typing import BinaryIO, Union, List, Optional
+from typing import BinaryIO, Union, List, Optional, Tuple
 import warnings
 import faster_whisper
 import gradio as gr
 
+from modules.utils.audio_manager import DecodedAudio
+
 
 class SileroVAD:
     def __init__(self):
@@ -13,16 +15,16 @@ class SileroVAD:
         self.model = None
 
     def run(self,
-            audio: Union[str, BinaryIO, np.ndarray],
+            audio: Union[str, BinaryIO, np.ndarray, DecodedAudio],
             vad_parameters: VadOptions,
-            progress: gr.Progress = gr.Progress()):
+            progress: gr.Progress = gr.Progress()) -> Tuple[np.ndarray, List[dict]]:
         """
         Run VAD
 
         Parameters
         ----------
-        audio: Union[str, BinaryIO, np.ndarray]
-            Audio path or file binary or Audio numpy array
+        audio: Union[str, BinaryIO, np.ndarray, DecodedAudio]
+            Audio path or file binary or Audio numpy array, or the audio decoded by WhisperBase.run()
         vad_parameters:
             Options for VAD processing.
         progress: gr.Progress
@@ -32,11 +34,15 @@ class SileroVAD:
         ----------
         audio: np.ndarray
             Pre-processed audio with VAD
+        speech_chunks: List[dict]
+            Start and end samples of the speech chunks in the original audio, for restore_speech_timestamps()
         """
 
         sampling_rate = self.sampling_rate
 
-        if not isinstance(audio, np.ndarray):
+        if isinstance(audio, DecodedAudio):
+            audio = audio.samples
+        elif not isinstance(audio, np.ndarray):
             audio = faster_whisper.decode_audio(audio, sampling_rate=sampling_rate)
 
         duration = audio.shape[0] / sampling_rate
@@ -53,8 +59,9 @@ class SileroVAD:
         )
         audio = self.collect_chunks(audio, speech_chunks)
         duration_after_vad = audio.shape[0] / sampling_rate
+        print(f"VAD kept {duration_after_vad:.2f} s of speech out of {duration:.2f} s")
 
-        return audio
+        return audio, speech_chunks
 
     def get_speech_timestamps(
         self,
@@ -208,6 +215,28 @@ class SileroVAD:
     def update_model(self):
         self.model = get_vad_model()
 
+    def streaming(self, vad_options: Optional[VadOptions] = None) -> 'StreamingSileroVAD':
+        """
+        Creates a streaming VAD state that shares the model of this SileroVAD.
+
+        Parameters
+        ----------
+        vad_options: VadOptions
+            Options for VAD processing. threshold, min_silence_duration_ms and speech_pad_ms are used.
+
+        Returns
+        ----------
+        StreamingSileroVAD
+        """
+        if self.model is None:
+            self.update_model()
+        return StreamingSileroVAD(
+            model=self.model,
+            vad_options=vad_options,
+            sampling_rate=self.sampling_rate,
+            window_size_samples=self.window_size_samples
+        )
+
     @staticmethod
     def collect_chunks(audio: np.ndarray, chunks: List[dict]) -> np.ndarray:
         """Collects and concatenates audio chunks."""
@@ -216,6 +245,47 @@ class SileroVAD:
 
         return np.concatenate([audio[chunk["start"]: chunk["end"]] for chunk in chunks])
 
+    @staticmethod
+    def restore_speech_timestamps(segments: List[dict],
+                                  speech_chunks: List[dict],
+                                  sampling_rate: int = 16000) -> List[dict]:
+        """
+        Maps the timestamps of segments transcribed from the audio of collect_chunks() back to
+        the original audio. The words of the segments are mapped too, if they have timestamps.
+
+        Parameters
+        ----------
+        segments: List[dict]
+            Segments with start and end in seconds of the collected audio. They are updated in place.
+        speech_chunks: List[dict]
+            Speech chunks that the audio was collected from, in samples.
+        sampling_rate: int
+            Sampling rate of the chunks.
+
+        Returns
+        ----------
+        segments: List[dict]
+            The same segments, with the timestamps of the original audio
+        """
+        if not speech_chunks:
+            return segments
+        starts = np.array([chunk["start"] for chunk in speech_chunks]) / sampling_rate
+        lengths = np.array([chunk["end"] - chunk["start"] for chunk in speech_chunks]) / sampling_rate
+        offsets = np.cumsum(lengths) - lengths # start of every chunk in the collected audio
+
+        def original_time(time, side):
+            # a time on the boundary of two chunks is the start of the later one, or the end of the earlier one
+            i = min(max(int(np.searchsorted(offsets, time, side=side)) - 1, 0), len(offsets) - 1)
+            return float(starts[i] + min(max(time - offsets[i], 0.0), lengths[i]))
+
+        for segment in segments:
+            for item in [segment] + list(segment.get("words") or []):
+                if item.get("start") is not None:
+                    item["start"] = original_time(item["start"], "right")
+                if item.get("end") is not None:
+                    item["end"] = original_time(item["end"], "left")
+        return segments
+
     @staticmethod
     def format_timestamp(
         seconds: float,
@@ -239,3 +309,76 @@ class SileroVAD:
             f"{hours_marker}{minutes:02d}:{seconds:02d}{decimal_marker}{milliseconds:03d}"
         )
 
+
+
+class StreamingSileroVAD:
+    """
+    Silero VAD over a stream of audio chunks. The model state, the samples of an incomplete
+    window and the speech/silence status are kept between the calls, so every chunk is
+    processed only once.
+    """
+    def __init__(self,
+                 model,
+                 vad_options: Optional[VadOptions] = None,
+                 sampling_rate: int = 16000,
+                 window_size_samples: int = 512):
+        if vad_options is None:
+            vad_options = VadOptions()
+        self.model = model
+        self.sampling_rate = sampling_rate
+        self.window_size_samples = window_size_samples
+        self.threshold = vad_options.threshold
+        self.neg_threshold = vad_options.threshold - 0.15
+        self.min_silence_samples = sampling_rate * vad_options.min_silence_duration_ms / 1000
+        self.speech_pad_samples = int(sampling_rate * vad_options.speech_pad_ms / 1000)
+        self.reset()
+
+    def reset(self):
+        self.state, self.context = self.model.get_initial_states(batch_size=1)
+        self.remainder = np.zeros(0, dtype=np.float32)
+        self.current_sample = 0
+        self.triggered = False
+        self.temp_end = 0
+
+    def __call__(self, audio: np.ndarray) -> List[dict]:
+        """
+        Feeds the next chunk of the stream.
+
+        Parameters
+        ----------
+        audio: np.ndarray
+            Next audio chunk, 16 kHz float32.
+
+        Returns
+        ----------
+        List of {"start": sample} and {"end": sample} events, in samples from the beginning of the stream.
+        The start of speech is reported as soon as it is detected, its end after min_silence_duration_ms of silence.
+        """
+        window = self.window_size_samples
+        audio = np.concatenate([self.remainder, np.asarray(audio, dtype=np.float32)])
+        n_windows = len(audio) // window
+        self.remainder = audio[n_windows * window:]
+
+        events = []
+        for i in range(n_windows):
+            chunk = audio[i * window:(i + 1) * window]
+            speech_prob, self.state, self.context = self.model(chunk, self.state, self.context, self.sampling_rate)
+            speech_prob = np.asarray(speech_prob).item()
+            self.current_sample += window
+
+            if speech_prob >= self.threshold and self.temp_end:
+                self.temp_end = 0
+
+            if speech_prob >= self.threshold and not self.triggered:
+                self.triggered = True
+                events.append({"start": max(0, self.current_sample - window - self.speech_pad_samples)})
+                continue
+
+            if speech_prob < self.neg_threshold and self.triggered:
+                if not self.temp_end:
+                    self.temp_end = self.current_sample
+                if self.current_sample - self.temp_end >= self.min_silence_samples:
+                    events.append({"end": self.temp_end + self.speech_pad_samples})
+                    self.temp_end = 0
+                    self.triggered = False
+        return events
@@ -0,0 +1,183 @@
+from math import gcd
+
+import numpy as np
+
+SAMPLING_RATE = 16000
+
+
+class StreamingResampler:
+    """Polyphase resampler of a stream of float32 chunks.
+
+    The rate changes by up/down = target_rate/orig_rate (reduced by their gcd,
+    e.g. 160/441 for 44.1 kHz -> 16 kHz). Output sample n lies at input position
+    n*down/up; it's the dot product of the `taps` input samples around it with
+    one of the `up` phases of a Kaiser-windowed sinc low-pass filter, cut below
+    the lower of the two Nyquist frequencies. All the output samples of a chunk
+    are computed at once with numpy, and the input samples that the next output
+    samples still need are kept, so the output doesn't depend on how the stream
+    is split into chunks.
+    """
+
+    def __init__(self, orig_rate, target_rate=SAMPLING_RATE, taps=32, rolloff=0.94, beta=8.6):
+        """taps: input samples per output sample (even), more is a sharper filter
+        rolloff: cutoff as a fraction of the lower Nyquist frequency
+        beta: shape of the Kaiser window
+        """
+        g = gcd(int(orig_rate), int(target_rate))
+        self.orig_rate = orig_rate
+        self.target_rate = target_rate
+        self.up = int(target_rate) // g
+        self.down = int(orig_rate) // g
+        self.taps = taps
+        self.filters = self.design(self.up, self.down, taps, rolloff, beta)
+        self.reset()
+
+    @staticmethod
+    def design(up, down, taps, rolloff, beta):
+        # filters[p, j] weights input sample base - taps/2 + 1 + j for output samples at base + p/up
+        cutoff = min(1.0, up/down) * rolloff
+        # distance from the output sample to each input sample, in input samples
+        t = np.arange(up)[:, None]/up + taps//2 - 1 - np.arange(taps)[None, :]
+        window = np.i0(beta * np.sqrt(np.clip(1 - (t/(taps/2))**2, 0, None))) / np.i0(beta)
+        filters = cutoff * np.sinc(cutoff * t) * window
+        filters /= filters.sum(axis=1, keepdims=True)
+        return filters.astype(np.float32)
+
+    def reset(self):
+        # the stream starts with taps/2-1 zeros before the first sample, so the first output is centered on it
+        self._history = np.zeros(self.taps//2 - 1, dtype=np.float32)
+        self._history_start = -(self.taps//2 - 1) # position of self._history[0] in the input stream
+        self._n = 0 # the next output sample
+        self._received = 0 # input samples
+
+    def process(self, audio):
+        """resamples the next chunk of the stream. Returns the output samples that are complete."""
+        if self.up == self.down:
+            return np.asarray(audio, dtype=np.float32)
+        audio = np.asarray(audio, dtype=np.float32)
+        self._received += len(audio)
+        self._history = np.concatenate((self._history, audio))
+        available = self._history_start + len(self._history) # input samples received
+        # output n needs input up to (n*down)//up + taps/2
+        last = ((available - self.taps//2) * self.up - 1) // self.down
+        n = np.arange(self._n, max(last, self._n - 1) + 1, dtype=np.int64)
+        if len(n):
+            pos = n * self.down
+            starts = pos // self.up - self.taps//2 + 1 - self._history_start
+            windows = np.lib.stride_tricks.sliding_window_view(self._history, self.taps)[starts]
+            out = np.einsum("ij,ij->i", windows, self.filters[pos % self.up])
+            self._n = int(n[-1]) + 1
+        else:
+            out = np.zeros(0, dtype=np.float32)
+        keep_from = (self._n * self.down) // self.up - self.taps//2 + 1
+        drop = min(max(keep_from - self._history_start, 0), len(self._history))
+        self._history = self._history[drop:]
+        self._history_start += drop
+        return out
+
+    def flush(self):
+        """the output samples of the end of the stream, computed with zeros after the last input sample"""
+        received = self._received
+        out = self.process(np.zeros(self.taps//2, dtype=np.float32))
+        total = (received * self.up + self.down - 1) // self.down # outputs of the stream
+        return out[:max(len(out) - (self._n - total), 0)]
+
+
+class PCM16Decoder:
+    """Converts a stream of raw little-endian PCM16 packets to float32 samples.
+
+    Packets are decoded with np.frombuffer straight into a reusable float32 buffer,
+    without soundfile/librosa. A socket doesn't keep samples whole, so an odd byte
+    at the end of a packet is kept and joined with the first byte of the next one.
+
+    Audio of another format, announced by the client when the connection starts
+    (see frame_packet), is downmixed to mono and converted to 16 kHz by a
+    StreamingResampler on the way in, so its packets can be split anywhere too.
+    """
+
+    SCALE = np.float32(1/32768)
+
+    def __init__(self, capacity=16000*5, sampling_rate=SAMPLING_RATE, channels=1):
+        self._buffer = np.empty(max(int(capacity), 1), dtype=np.float32)
+        self._size = 0
+        self._partial = b"" # the first byte of a sample split between two packets
+        self.sampling_rate = sampling_rate
+        self.channels = channels
+        self._frame = np.zeros(0, dtype=np.float32) # samples of a frame split between two packets, for several channels
+        self.resampler = StreamingResampler(sampling_rate) if sampling_rate != SAMPLING_RATE else None
+
+    def __len__(self):
+        """number of decoded samples that were not taken yet"""
+        return self._size
+
+    def feed(self, raw_bytes):
+        """decodes a packet and appends its samples to the buffer"""
+        data = memoryview(raw_bytes).cast("B")
+        if not len(data):
+            return
+        if self._partial:
+            sample = int.from_bytes(self._partial + bytes(data[:1]), "little", signed=True) * self.SCALE
+            self._partial = b""
+            data = data[1:]
+            if self.channels == 1 and self.resampler is None:
+                self._reserve(1)
+                self._buffer[self._size] = sample
+                self._size += 1
+            else:
+                self._append(np.array([sample], dtype=np.float32))
+        if len(data) % 2:
+            self._partial = bytes(data[-1:])
+            data = data[:-1]
+        n = len(data) // 2
+        if n == 0:
+            return
+        if self.channels == 1 and self.resampler is None:
+            self._reserve(n)
+            np.multiply(np.frombuffer(data, dtype="<i2"), self.SCALE, out=self._buffer[self._size:self._size+n], casting="unsafe")
+            self._size += n
+            return
+        self._append(np.frombuffer(data, dtype="<i2") * self.SCALE)
+
+    def _append(self, samples):
+        # downmixes and resamples decoded samples, then appends them
+        if self.channels > 1:
+            samples = np.concatenate((self._frame, samples))
+            whole = len(samples) - len(samples) % self.channels
+            self._frame = samples[whole:]
+            samples = samples[:whole].reshape(-1, self.channels).mean(axis=1, dtype=np.float32)
+        if self.resampler is not None:
+            samples = self.resampler.process(samples)
+        self._reserve(len(samples))
+        self._buffer[self._size:self._size+len(samples)] = samples
+        self._size += len(samples)
+
+    def take(self):
+        """returns the decoded samples and empties the buffer.
+        The result is a view of the reusable buffer, valid until the next feed()."""
+        out = self._buffer[:self._size]
+        self._size = 0
+        return out
+
+    def flush(self):
+        """decodes the end of the stream: the resampler's last samples"""
+        if self.resampler is not None:
+            samples = self.resampler.flush()
+            self._reserve(len(samples))
+            self._buffer[self._size:self._size+len(samples)] = samples
+            self._size += len(samples)
+
+    def reset(self):
+        self._size = 0
+        self._partial = b""
+        self._frame = np.zeros(0, dtype=np.float32)
+        if self.resampler is not None:
+            self.resampler.reset()
+
+    def _reserve(self, n):
+        if self._size + n > len(self._buffer):
+            capacity = len(self._buffer)
+            while self._size + n > capacity:
+                capacity *= 2
+            buffer = np.empty(capacity, dtype=np.float32)
+            buffer[:self._size] = self._buffer[:self._size]
+            self._buffer = buffer
@@ -0,0 +1,84 @@
+import sys
+
+# greedy decoding, used while a session is over its latency budget
+CHEAP_ARGS = {"beam_size": 1, "best_of": 1, "temperature": 0.0}
+
+
+class LatencyBudget:
+    """Latency budget of one streaming session.
+
+    The backlog is the age of the oldest audio that hasn't been decoded yet. The
+    session is degraded step by step while the backlog grows:
+
+      - coalesce: above coalesce_ratio x budget, all the audio that has arrived is
+        decoded in one iteration instead of min_chunk pieces,
+      - cheap: above the budget, decoding switches to greedy search (CHEAP_ARGS),
+        and to cheap_asr (e.g. a smaller model) if it's given,
+      - shed: above shed_ratio x budget, the oldest audio is dropped, so that only
+        budget seconds are left to decode.
+
+    The level goes down again only when the backlog is below recover_ratio x the
+    threshold of the current level, so it doesn't flap. Every change of level and
+    every shed piece of audio is logged.
+    """
+
+    NORMAL, COALESCE, CHEAP, SHED = range(4)
+    LEVEL_NAMES = ("normal", "coalesce", "cheap", "shed")
+
+    def __init__(self, budget_sec=3.0, cheap_asr=None, cheap_args=CHEAP_ARGS,
+                 coalesce_ratio=0.5, shed_ratio=2.0, recover_ratio=0.5, name=""):
+        self.budget_sec = budget_sec
+        self.cheap_asr = cheap_asr
+        self.cheap_args = cheap_args
+        self.thresholds = (0.0, coalesce_ratio*budget_sec, budget_sec, shed_ratio*budget_sec)
+        self.recover_ratio = recover_ratio
+        self.name = name
+        self.level = self.NORMAL
+        self.iterations = [0]*len(self.LEVEL_NAMES) # iterations at every level
+        self.shed_seconds = 0.0
+        self.changes = 0
+
+    def update(self, backlog):
+        """backlog: age of the oldest undecoded audio in seconds.
+        Returns: the level for the next iteration"""
+        level = max(i for i, t in enumerate(self.thresholds) if i == 0 or backlog > t)
+        if level < self.level and backlog > self.recover_ratio*self.thresholds[self.level]:
+            level = self.level
+        if level != self.level:
+            self.changes += 1
+            print(f"[{self.name}] latency budget {self.budget_sec:.1f} s: {self.LEVEL_NAMES[self.level]} -> {self.LEVEL_NAMES[level]}, "
+                  f"backlog {backlog:.2f} s", file=sys.stderr)
+        self.level = level
+        self.iterations[level] += 1
+        return level
+
+    @property
+    def coalesce(self):
+        return self.level >= self.COALESCE
+
+    def transcribe_args(self, args):
+        return dict(args, **self.cheap_args) if self.level >= self.CHEAP else args
+
+    def asr(self, asr):
+        """the model to decode with at the current level, asr is the normal one"""
+        return self.cheap_asr if self.level >= self.CHEAP and self.cheap_asr is not None else asr
+
+    def shed(self, audio, sampling_rate):
+        """drops the oldest audio at the shed level.
+        Returns: (the audio to decode, seconds dropped from its beginning)"""
+        keep = int(self.budget_sec*sampling_rate)
+        if self.level < self.SHED or len(audio) <= keep:
+            return audio, 0.0
+        dropped = (len(audio) - keep) / sampling_rate
+        self.shed_seconds += dropped
+        print(f"[{self.name}] latency budget {self.budget_sec:.1f} s: shedding {dropped:.2f} s of audio", file=sys.stderr)
+        return audio[-keep:], dropped
+
+    def report(self):
+        return dict(
+            budget=self.budget_sec,
+            level=self.LEVEL_NAMES[self.level],
+            iterations=dict(zip(self.LEVEL_NAMES, self.iterations)),
+            level_changes=self.changes,
+            shed_seconds=self.shed_seconds,
+        )
@@ -0,0 +1,108 @@
+import bisect
+from types import SimpleNamespace
+
+import numpy as np
+
+SAMPLING_RATE = 16000
+CHUNK_LENGTH = 30 # seconds, the input window of Whisper
+
+
+class BatchedTranscriber:
+    """Transcribes the audio buffers of several streaming sessions in one batched pass.
+
+    The buffers are laid out one after another in a single array and given to
+    faster-whisper's BatchedInferencePipeline as clip timestamps, so every buffer
+    becomes one item of the same encoder/decoder batch. The segments are then split
+    by clip and shifted back to the time of their own buffer. Segments in the
+    padding after the last clip belong to no buffer and are dropped.
+
+    The pipeline decodes the whole batch with one set of options, so the buffers
+    are batched by their prompt (the committed text before the buffer, see
+    OnlineASRProcessor.prompt): sessions with the same prompt, e.g. the ones that
+    haven't committed anything yet, share a batch. A session whose prompt no other
+    one has, a buffer longer than the Whisper window, or a faster-whisper without
+    the batched pipeline, fall back to one `model.transcribe` call per buffer.
+    """
+
+    def __init__(self, model, batch_size=8):
+        self.model = model
+        self.batch_size = batch_size
+        try:
+            from faster_whisper import BatchedInferencePipeline
+            self.pipeline = BatchedInferencePipeline(model=model)
+        except ImportError:
+            print("faster_whisper.BatchedInferencePipeline is not available, sessions are decoded one by one")
+            self.pipeline = None
+
+    def transcribe_batch(self, audios, args, prompts=None):
+        """audios: list of float32 arrays at 16 kHz
+        args: keyword arguments of the transcribe call, shared by the whole batch
+        prompts: initial prompts, one per audio
+        Returns: a list of segment lists, one per audio, as `model.transcribe` would return them
+        """
+        prompts = [prompt or None for prompt in prompts] if prompts else [None]*len(audios)
+        results = [None]*len(audios)
+        batches = {} # prompt -> indices of the audios that fit in one window
+        for i, a in enumerate(audios):
+            if 0 < len(a) <= CHUNK_LENGTH*SAMPLING_RATE:
+                batches.setdefault(prompts[i], []).append(i)
+        for prompt, batch in batches.items():
+            if self.pipeline is None or len(batch) < 2:
+                continue
+            try:
+                for i, segments in zip(batch, self.transcribe_clips([audios[i] for i in batch], args, prompt)):
+                    results[i] = segments
+            except TypeError as e:
+                print(f"Batched decoding is not supported by this faster-whisper, decoding one by one: {e}")
+                self.pipeline = None
+
+        for i, audio in enumerate(audios):
+            if results[i] is None:
+                if len(audio):
+                    segments, _ = self.model.transcribe(audio, initial_prompt=prompts[i], **args)
+                    results[i] = list(segments)
+                else:
+                    results[i] = []
+        return results
+
+    def transcribe_clips(self, audios, args, prompt=None):
+        starts = np.cumsum([0] + [len(a) for a in audios])
+        audio = np.concatenate(audios)
+        # the pipeline decodes short inputs as one chunk and ignores the clips, so pad to a full window
+        if len(audio) <= CHUNK_LENGTH*SAMPLING_RATE:
+            audio = np.pad(audio, (0, CHUNK_LENGTH*SAMPLING_RATE - len(audio) + 1))
+        clips = [{"start": int(starts[i]), "end": int(starts[i+1])} for i in range(len(audios))]
+
+        args = dict(args)
+        args.pop("vad_filter", None)
+        segments, _ = self.pipeline.transcribe(
+            audio,
+            vad_filter=False,
+            clip_timestamps=clips,
+            batch_size=min(self.batch_size, len(audios)),
+            initial_prompt=prompt,
+            **args
+        )
+
+        clip_starts = [s / SAMPLING_RATE for s in starts[:-1]]
+        clips_end = starts[-1] / SAMPLING_RATE
+        results = [[] for _ in audios]
+        for segment in segments:
+            if segment.start >= clips_end:
+                continue # in the padding
+            i = max(bisect.bisect_right(clip_starts, segment.start + 1e-3) - 1, 0)
+            results[i].append(shift_segment(segment, -clip_starts[i]))
+        return results
+
+
+def shift_segment(segment, offset):
+    # only the fields used by OnlineASRProcessor (see whisper_online.ts_words and segments_end_ts)
+    words = [SimpleNamespace(start=w.start + offset, end=w.end + offset, word=w.word, probability=w.probability)
+             for w in (segment.words or [])]
+    return SimpleNamespace(
+        start=segment.start + offset,
+        end=segment.end + offset,
+        text=segment.text,
+        no_speech_prob=segment.no_speech_prob,
+        words=words,
+    )
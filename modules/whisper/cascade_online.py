@@ -0,0 +1,189 @@
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from modules.whisper.online_buffers import AudioRingBuffer
+
+
+class CascadeOnlineASRProcessor:
+    """Two-tier streaming: a small model for the partials, a large one for the final text.
+
+    The `draft` processor (an OnlineASRProcessor, or a VADOnlineASRProcessor, with
+    a tiny/base model) runs the usual streaming iterations. What it commits is
+    not final yet: it's shown as part of the partial text. Every `min_final_sec`
+    seconds of committed draft text, the audio under it is re-decoded by
+    `final_asr` (e.g. large-v3) in a background worker, and the result is
+    returned by process_iter as the committed text that replaces the draft.
+
+    The draft keeps the display close to real time however slow the large model
+    is, and the large model decodes every second of audio once, in utterances
+    long enough to have context, instead of on every iteration.
+
+    So the committed output lags behind the draft by the re-decoding of an
+    utterance, and its text can differ from what was shown as partial. When
+    the large model fails or returns no text, the draft is committed instead.
+    Sessions of this mode can't be checkpointed with session_store, the
+    re-decodings in flight would be lost.
+    """
+
+    SAMPLING_RATE = 16000
+
+    def __init__(self, draft, final_asr, final_args, min_final_sec=3.0, executor=None):
+        """draft: OnlineASRProcessor of the small model
+        final_asr: faster_whisper.WhisperModel of the large model
+        final_args: keyword arguments of final_asr.transcribe
+        min_final_sec: committed draft audio re-decoded at once, in seconds
+        executor: executor of the re-decoding, shared by the sessions of a server so the large model
+        decodes one utterance at a time. A single worker thread of its own if None.
+        """
+        self.draft = draft
+        self.final_asr = final_asr
+        self.final_args = dict(final_args, word_timestamps=False)
+        self.min_final_sec = min_final_sec
+        self.executor = executor if executor is not None else ThreadPoolExecutor(max_workers=1, thread_name_prefix="cascade")
+        self.final_results = []
+        self.redecoded = 0
+        self.fallbacks = 0 # utterances where the large model failed or returned no text, and the draft was kept
+        self.init()
+
+    def init(self, offset=None):
+        """run this when starting or restarting processing"""
+        self.draft.init(offset)
+        self.audio = AudioRingBuffer(capacity=self.SAMPLING_RATE*int(self.min_final_sec*4))
+        self.audio_offset = 0 if offset is None else offset # time of the first sample of self.audio
+        self.drafts = [] # committed draft outputs that are not re-decoded yet
+        self.futures = deque() # re-decodings in flight, (draft output, future), in the order of the audio
+        self.context = "" # the committed text before the drafts, the prompt of the re-decoding
+
+    @property
+    def asr(self):
+        return self.draft.asr
+
+    @asr.setter
+    def asr(self, asr):
+        self.draft.asr = asr
+
+    @property
+    def audio_buffer(self):
+        return self.draft.audio_buffer
+
+    @property
+    def transcript_buffer(self):
+        return self.draft.transcript_buffer
+
+    @property
+    def commited(self):
+        return self.draft.commited
+
+    @property
+    def commit_stats(self):
+        return self.draft.commit_stats
+
+    @property
+    def has_new_speech(self):
+        return self.draft.has_new_speech
+
+    def insert_audio_chunk(self, audio):
+        self.audio.append(audio)
+        self.draft.insert_audio_chunk(audio)
+        self.drop_audio()
+
+    def drop_audio(self):
+        # without drafts waiting, the audio before the buffer of the draft processor is never re-decoded:
+        # it's silence between utterances, or text that the draft won't commit anymore
+        if self.drafts:
+            return
+        n = min(max(int(round((self.draft.buffer_time_offset - self.audio_offset)*self.SAMPLING_RATE)), 0), len(self.audio))
+        self.audio.trim_front(n)
+        self.audio_offset += n/self.SAMPLING_RATE
+
+    def process_iter(self, args):
+        """Runs a draft iteration, and queues its committed text for re-decoding.
+        Returns: the final text re-decoded since the last call, in the format of OnlineASRProcessor.process_iter"""
+        return self.commit_draft(self.draft.process_iter(args))
+
+    def prompt(self):
+        return self.draft.prompt()
+
+    def commit_iter(self, res):
+        """commits a transcription of self.audio_buffer made by the caller, see OnlineASRProcessor.commit_iter"""
+        return self.commit_draft(self.draft.commit_iter(res))
+
+    def ready_output(self, args):
+        o = self.draft.ready_output(args)
+        return None if o is None else self.commit_draft(o)
+
+    def commit_draft(self, o, final=False):
+        if o[2]:
+            self.drafts.append(o)
+        if self.drafts and (final or self.drafts[-1][1] - self.drafts[0][0] >= self.min_final_sec):
+            self.redecode_drafts()
+        self.drop_audio()
+        return self.pop_finals(wait=final)
+
+    def redecode_drafts(self):
+        # queues the audio from the end of the previous re-decoded utterance to the end of the drafts
+        end = self.drafts[-1][1]
+        n = min(max(int(round((end - self.audio_offset)*self.SAMPLING_RATE)), 0), len(self.audio))
+        audio = self.audio.view()[:n].copy()
+        draft = self.to_flush(self.drafts)
+        self.futures.append((draft, self.executor.submit(self.redecode, audio, draft, self.context[-200:])))
+        self.context += draft[2]
+        self.audio.trim_front(n)
+        self.audio_offset += n/self.SAMPLING_RATE
+        self.drafts = []
+
+    def redecode(self, audio, draft, prompt):
+        # runs in the worker: the final text of the utterance that the draft output covers
+        segments, _ = self.final_asr.transcribe(audio, initial_prompt=prompt or None, **self.final_args)
+        text = "".join(s.text for s in segments)
+        self.redecoded += 1
+        if not text.strip():
+            self.fallbacks += 1
+            print(f"cascade: no text from the final model, keeping the draft {draft}", file=sys.stderr)
+            return draft
+        print(f"cascade: draft {draft[2]!r} -> final {text!r}", file=sys.stderr)
+        return (draft[0], draft[1], text)
+
+    def pop_finals(self, wait=False):
+        # the re-decoded utterances that are done, in order. With wait, all of them.
+        finals = []
+        while self.futures and (wait or self.futures[0][1].done()):
+            draft, future = self.futures.popleft()
+            try:
+                finals.append(future.result())
+            except Exception as e:
+                self.fallbacks += 1
+                print(f"cascade: re-decoding failed ({e!r}), keeping the draft {draft}", file=sys.stderr)
+                finals.append(draft)
+        return self.to_flush(finals)
+
+    def partial(self):
+        """The draft text that is not final yet, followed by the uncommitted tail of the draft.
+        Returns: the same format as self.process_iter()"""
+        # an utterance that is still being re-decoded, or whose re-decoding failed, is shown by its draft
+        pending = [future.result() if future.done() and future.exception() is None else draft
+                   for draft, future in self.futures]
+        return self.to_flush(pending + self.drafts + [self.draft.partial()])
+
+    def to_flush(self, outputs):
+        outputs = [o for o in outputs if o[2]]
+        if not outputs:
+            return (None, None, "")
+        return (outputs[0][0], outputs[-1][1], self.asr.sep.join(o[2] for o in outputs))
+
+    def skip(self, seconds):
+        """Skips the next `seconds` of the stream, see OnlineASRProcessor.skip"""
+        o = self.commit_draft(self.draft.skip(seconds), final=True)
+        self.audio_offset += len(self.audio)/self.SAMPLING_RATE + seconds
+        self.audio.clear()
+        return o
+
+    def finish(self):
+        """Flush the incomplete text when the whole processing ends. Waits for the re-decoding.
+        Returns: the same format as self.process_iter()
+        """
+        return self.commit_draft(self.draft.finish(), final=True)
+
+    def report(self):
+        return dict(redecoded=self.redecoded, fallbacks=self.fallbacks, in_flight=len(self.futures))
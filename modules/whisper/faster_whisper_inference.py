@@ -1,11 +1,14 @@
 import os
+import sys
+import json
 import time
 import numpy as np
 import torch
-from typing import BinaryIO, Union, Tuple, List
+from typing import BinaryIO, Union, Tuple, List, Optional
 import faster_whisper
 from faster_whisper.vad import VadOptions
 import ast
+from concurrent.futures import ThreadPoolExecutor
 import ctranslate2
 import whisper
 import gradio as gr
@@ -13,7 +16,12 @@ from argparse import Namespace
 
 from modules.whisper.whisper_parameter import *
 from modules.whisper.whisper_base import WhisperBase
+from modules.whisper.transcript_store import SessionTranscript
+from modules.utils.audio_manager import DecodedAudio
 from modules.whisper.whisper_online import *
+from modules.whisper.vad_online import VADOnlineASRProcessor
+from modules.whisper.cascade_online import CascadeOnlineASRProcessor
+from modules.whisper.model_pool import estimate_model_bytes
 
 class FasterWhisperInference(WhisperBase):
     def __init__(self,
@@ -31,23 +39,38 @@ class FasterWhisperInference(WhisperBase):
         self.available_models = self.model_paths.keys()
         self.available_compute_types = ctranslate2.get_supported_compute_types(
             "cuda") if self.device == "cuda" else ctranslate2.get_supported_compute_types("cpu")
+        # CTranslate2 threads and concurrent transcriptions of a model, 0 is the CTranslate2 default
+        self.cpu_threads = 0
+        self.num_workers = 1
+        # small model of the cascade streaming mode, see default_args.cascade_model
+        self.draft_model = None
+        self.current_draft_model_size = None
+        # re-decodes the committed text of all the cascade sessions, one utterance at a time
+        self.cascade_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cascade")
+        # online inference adapts its chunk size to this latency if set, see default_args.adaptive_chunk
+        adaptive_chunk = getattr(args, "adaptive_chunk", default_args_instance.adaptive_chunk)
+        self.target_latency = getattr(args, "target_latency", default_args_instance.target_latency) if adaptive_chunk else None
+        self.chunk_metrics = None # AdaptiveChunkController.metrics() of the last online inference
 
     def transcribe(self,
-                   audio: Union[str, BinaryIO, np.ndarray],
+                   audio: Union[str, BinaryIO, np.ndarray, DecodedAudio],
                    progress: gr.Progress,
                    *whisper_params,
+                   transcript: Optional[SessionTranscript] = None,
                    ) -> Tuple[List[dict], float]:
         """
         transcribe method for faster-whisper.
 
         Parameters
         ----------
-        audio: Union[str, BinaryIO, np.ndarray]
-            Audio path or file binary or Audio numpy array
+        audio: Union[str, BinaryIO, np.ndarray, DecodedAudio]
+            Audio path or file binary or Audio numpy array, or the audio decoded by WhisperBase.run()
         progress: gr.Progress
             Indicator to show progress directly in gradio.
         *whisper_params: tuple
             Parameters related with whisper. This will be dealt with "WhisperParameters" data class
+        transcript: SessionTranscript
+            Transcript of the user's session. The segments committed by online inference are appended to it.
 
         Returns
         ----------
@@ -66,51 +89,27 @@ class FasterWhisperInference(WhisperBase):
         params.suppress_tokens = self.format_suppress_tokens_str(params.suppress_tokens)
         
         if params.enable_online_inference:
-            
-            self.model.sep = ""
-            online_model = OnlineASRProcessor(self.model)
-            
-            if params.enable_streaming_microphone:
-                pass
-            
-            args = {
-            "language": params.lang,
-            "task": "translate" if params.is_translate and self.current_model_size in self.translatable_models else "transcribe",
-            "beam_size": params.beam_size,
-            "log_prob_threshold": params.log_prob_threshold,
-            "no_speech_threshold": params.no_speech_threshold,
-            "best_of": params.best_of,
-            "patience": params.patience,
-            "temperature": params.temperature,
-            "compression_ratio_threshold": params.compression_ratio_threshold,
-            "length_penalty": params.length_penalty,
-            "repetition_penalty": params.repetition_penalty,
-            "no_repeat_ngram_size": params.no_repeat_ngram_size,
-            "prefix": params.prefix,
-            "suppress_blank": params.suppress_blank,
-            "suppress_tokens": params.suppress_tokens,
-            "max_initial_timestamp": params.max_initial_timestamp,
-            # "initial_prompt": params.initial_prompt if params.initial_prompt else None, # control by online_inference
-            "word_timestamps": True, #params.word_timestamps,
-            "prepend_punctuations": params.prepend_punctuations,
-            "append_punctuations": params.append_punctuations,
-            "max_new_tokens": params.max_new_tokens,
-            "chunk_length": params.chunk_length,
-            "hallucination_silence_threshold": params.hallucination_silence_threshold,
-            "hotwords": params.hotwords,
-            "language_detection_threshold": params.language_detection_threshold,
-            "language_detection_segments": params.language_detection_segments,
-            "prompt_reset_on_temperature": params.prompt_reset_on_temperature
-        }
+            online_model, args = self.create_online_processor(params, progress)
+            chunk_controller = None
+            if self.target_latency:
+                chunk_controller = AdaptiveChunkController(
+                    min_chunk=default_args_instance.min_chunk_size,
+                    target_latency=self.target_latency
+                )
 
             segments, info = online_inference(
                 audio_file=audio,
                 online_model=online_model,
                 args=args,
+                transcript=transcript,
+                chunk_controller=chunk_controller,
             )
+            if chunk_controller is not None:
+                self.chunk_metrics = chunk_controller.metrics()
+                print(json.dumps({"adaptive_chunk": self.chunk_metrics}), file=sys.stderr)
         else: 
             segments, info = self.model.transcribe(
-                audio=audio,
+                audio=audio.samples if isinstance(audio, DecodedAudio) else audio,
                 language=params.lang,
                 task="translate" if params.is_translate and self.current_model_size in self.translatable_models else "transcribe",
                 beam_size=params.beam_size,
@@ -153,15 +152,136 @@ class FasterWhisperInference(WhisperBase):
         else:
             for segment in segments:
                 progress(segment.start / info.duration, desc="Transcribing..")
-                segments_result.append({
+                segment_result = {
                     "start": segment.start,
                     "end": segment.end,
                     "text": segment.text
-                })
+                }
+                if segment.words:
+                    segment_result["words"] = [
+                        {"start": w.start, "end": w.end, "word": w.word, "probability": w.probability}
+                        for w in segment.words
+                    ]
+                segments_result.append(segment_result)
 
         elapsed_time = time.time() - start_time
         return segments_result, elapsed_time
 
+    def create_online_processor(self,
+                                params: WhisperValues,
+                                progress: gr.Progress = gr.Progress()):
+        """
+        Create the online processor of a streaming session
+
+        Parameters
+        ----------
+        params: WhisperValues
+            Parameters related with whisper, with the language code in params.lang
+        progress: gr.Progress
+            Indicator to show progress directly in gradio.
+
+        Returns
+        ----------
+        online_model: OnlineASRProcessor
+            Online processor of the session, behind a VAD controller if params.vad_filter.
+            With default_args.cascade_model, the iterations run on that model, and a
+            CascadeOnlineASRProcessor re-decodes the committed text with self.model.
+        args: dict
+            Keyword arguments of self.model.transcribe for process_iter
+        """
+        if params.model_size != self.current_model_size or self.model is None or self.current_compute_type != params.compute_type:
+            self.update_model(params.model_size, params.compute_type, progress)
+        if isinstance(params.suppress_tokens, str):
+            params.suppress_tokens = self.format_suppress_tokens_str(params.suppress_tokens)
+
+        self.model.sep = ""
+        cascade_model = default_args_instance.cascade_model
+        if cascade_model is not None:
+            self.update_draft_model(cascade_model, params.compute_type)
+        online_model = OnlineASRProcessor(
+            self.model if cascade_model is None else self.draft_model,
+            buffer_trimming_sec=default_args_instance.buffer_trimming_sec,
+            buffer_trimming=default_args_instance.buffer_trimming,
+            agreement=default_args_instance.agreement,
+            max_uncommitted_sec=default_args_instance.max_uncommitted_sec
+        )
+        if params.vad_filter:
+            # decode only the speech, and finish every utterance at the end-of-speech silence
+            vad_options = VadOptions(
+                threshold=params.threshold,
+                min_speech_duration_ms=params.min_speech_duration_ms,
+                max_speech_duration_s=params.max_speech_duration_s,
+                min_silence_duration_ms=params.min_silence_duration_ms,
+                speech_pad_ms=params.speech_pad_ms
+            )
+            online_model = VADOnlineASRProcessor(online_model, self.vad.streaming(vad_options))
+
+        args = {
+            "language": params.lang,
+            "task": "translate" if params.is_translate and self.current_model_size in self.translatable_models else "transcribe",
+            "beam_size": params.beam_size,
+            "log_prob_threshold": params.log_prob_threshold,
+            "no_speech_threshold": params.no_speech_threshold,
+            "best_of": params.best_of,
+            "patience": params.patience,
+            "temperature": params.temperature,
+            "compression_ratio_threshold": params.compression_ratio_threshold,
+            "length_penalty": params.length_penalty,
+            "repetition_penalty": params.repetition_penalty,
+            "no_repeat_ngram_size": params.no_repeat_ngram_size,
+            "prefix": params.prefix,
+            "suppress_blank": params.suppress_blank,
+            "suppress_tokens": params.suppress_tokens,
+            "max_initial_timestamp": params.max_initial_timestamp,
+            # "initial_prompt": params.initial_prompt if params.initial_prompt else None, # control by online_inference
+            "word_timestamps": True, #params.word_timestamps,
+            "prepend_punctuations": params.prepend_punctuations,
+            "append_punctuations": params.append_punctuations,
+            "max_new_tokens": params.max_new_tokens,
+            "chunk_length": params.chunk_length,
+            "hallucination_silence_threshold": params.hallucination_silence_threshold,
+            "hotwords": params.hotwords,
+            "language_detection_threshold": params.language_detection_threshold,
+            "language_detection_segments": params.language_detection_segments,
+            "prompt_reset_on_temperature": params.prompt_reset_on_temperature
+        }
+        if cascade_model is not None:
+            online_model = CascadeOnlineASRProcessor(online_model, self.model, args, executor=self.cascade_executor)
+        return online_model, args
+
+    def update_draft_model(self,
+                           model_size: str,
+                           compute_type: str):
+        """
+        Load the small model of the cascade streaming mode, if it's not loaded yet
+
+        Parameters
+        ----------
+        model_size: str
+            Size of whisper model, one of self.model_paths
+        compute_type: str
+            Compute type for transcription.
+        """
+        model_path = self.model_paths[model_size]
+        if self.draft_model is not None and self.current_draft_model_size == model_path:
+            return
+        self.current_draft_model_size = model_path
+        key = self.model_key(model_size, compute_type)
+        self.draft_model = self.model_pool.get(
+            key=key,
+            load=lambda: faster_whisper.WhisperModel(
+                device=self.device,
+                model_size_or_path=model_path,
+                download_root=self.model_dir,
+                compute_type=compute_type,
+                cpu_threads=self.cpu_threads,
+                num_workers=self.num_workers
+            ),
+            nbytes=estimate_model_bytes(model_size, compute_type, model_path)
+        )
+        self.hold_model("draft_model", key)
+        self.draft_model.sep = ""
+
     def update_model(self,
                      model_size: str,
                      compute_type: str,
@@ -183,12 +303,21 @@ class FasterWhisperInference(WhisperBase):
         progress(0, desc="Initializing Model..")
         self.current_model_size = self.model_paths[model_size]
         self.current_compute_type = compute_type
-        self.model = faster_whisper.WhisperModel(
-            device=self.device,
-            model_size_or_path=self.current_model_size,
-            download_root=self.model_dir,
-            compute_type=self.current_compute_type
+        model_path = self.current_model_size
+        key = self.model_key(model_size, compute_type)
+        self.model = self.model_pool.get(
+            key=key,
+            load=lambda: faster_whisper.WhisperModel(
+                device=self.device,
+                model_size_or_path=model_path,
+                download_root=self.model_dir,
+                compute_type=compute_type,
+                cpu_threads=self.cpu_threads,
+                num_workers=self.num_workers
+            ),
+            nbytes=estimate_model_bytes(model_size, compute_type, model_path)
         )
+        self.hold_model("model", key)
 
     def get_model_paths(self):
         """
@@ -215,6 +344,12 @@ class FasterWhisperInference(WhisperBase):
                 model_paths[model_name] = os.path.join(webui_dir, self.model_dir, model_name)
         return model_paths
 
+    def use_cpu(self, cpu_threads: int):
+        super().use_cpu(cpu_threads)
+        self.cpu_threads = cpu_threads
+        self.num_workers = 1
+        self.available_compute_types = ctranslate2.get_supported_compute_types("cpu")
+
     @staticmethod
     def get_device():
         if torch.cuda.is_available():
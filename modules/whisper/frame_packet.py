@@ -0,0 +1,223 @@
+"""Length-prefixed binary framing for the streaming servers.
+
+Unlike line_packet, audio and transcript events are multiplexed on one
+connection. A framed client starts the connection with a handshake:
+
+  - MAGIC (4 bytes) followed by the protocol version it speaks (1 byte).
+
+The server answers with MAGIC and the version it accepted, min(client, server).
+A connection that doesn't start with MAGIC is a legacy one: raw PCM16 audio in,
+line_packet lines out.
+
+After the handshake, every message is a frame:
+
+  - type (1 byte), payload length (4 bytes, big endian), payload.
+
+AUDIO frames carry raw 16 kHz mono PCM16 bytes, TRANSCRIPT frames a
+UTF-8 JSON TranscriptEvent, CONTROL frames a UTF-8 JSON object, and an
+END frame (empty payload) tells that the client has no more audio.
+
+A TranscriptEvent with committed=True is final, its text won't change. One with
+committed=False is partial: the current uncommitted hypothesis after the final
+text, which replaces the previous partial (an empty text clears it).
+
+Since version 2, the first frame of the client is a CONTROL hello,
+{"type": "hello", "session": id or null}, and the server answers with
+{"type": "session", "session": id, "resume_from": seconds}. A client that
+reconnects with the id of a session that was interrupted (see session_store)
+continues it, and sends its audio from `resume_from` seconds on. A null id
+starts a new session, and the server chooses its id. The hello may also give
+the format of the client's AUDIO frames, {"sample_rate": 48000, "channels": 2}
+(interleaved PCM16), which the server converts to 16 kHz mono as it arrives;
+16 kHz mono if it's missing. The accepted format is in the server's answer.
+"""
+import asyncio
+import json
+import socket as socket_module
+import struct
+from dataclasses import dataclass, asdict
+from typing import Optional
+
+MAGIC = b"MASR"
+VERSION = 2
+
+AUDIO = 1
+TRANSCRIPT = 2
+CONTROL = 3
+END = 4
+
+HEADER = struct.Struct(">BI")
+MAX_PAYLOAD = 16 * 1024 * 1024
+
+
+class ProtocolError(Exception):
+    pass
+
+
+@dataclass
+class TranscriptEvent:
+    start: float
+    end: float
+    text: str
+    speaker: Optional[str] = None
+    committed: bool = True
+
+    def to_payload(self) -> bytes:
+        return json.dumps(asdict(self), ensure_ascii=False).encode("utf-8")
+
+    @classmethod
+    def from_payload(cls, payload: bytes) -> 'TranscriptEvent':
+        return cls(**json.loads(payload.decode("utf-8")))
+
+
+def encode_frame(frame_type, payload=b""):
+    if len(payload) > MAX_PAYLOAD:
+        raise ProtocolError(f"Payload of {len(payload)} bytes is too large")
+    return HEADER.pack(frame_type, len(payload)) + payload
+
+
+def encode_control(message: dict) -> bytes:
+    return encode_frame(CONTROL, json.dumps(message, ensure_ascii=False).encode("utf-8"))
+
+
+def decode_control(payload: bytes) -> dict:
+    return json.loads(payload.decode("utf-8"))
+
+
+DEFAULT_FORMAT = {"sample_rate": 16000, "channels": 1}
+
+
+def hello(session_id=None, audio_format=None):
+    message = {"type": "hello", "session": session_id}
+    if audio_format is not None:
+        message["format"] = audio_format
+    return encode_control(message)
+
+
+def session_message(session_id, resume_from=0.0, audio_format=DEFAULT_FORMAT):
+    return encode_control({"type": "session", "session": session_id, "resume_from": resume_from, "format": audio_format})
+
+
+def parse_hello(frame):
+    """Returns the hello message of the frame (type, payload), {"type": "hello", "session": id or None, ...}"""
+    if frame is None or frame[0] != CONTROL:
+        raise ProtocolError("Expected a hello CONTROL frame")
+    message = decode_control(frame[1])
+    if message.get("type") != "hello":
+        raise ProtocolError(f"Expected a hello CONTROL frame, got {message}")
+    return message
+
+
+def audio_format(message):
+    """The audio format of a hello message, {"sample_rate": ..., "channels": ...}"""
+    audio_format = dict(DEFAULT_FORMAT, **message.get("format", {}))
+    sample_rate, channels = audio_format["sample_rate"], audio_format["channels"]
+    if not isinstance(sample_rate, int) or not 8000 <= sample_rate <= 192000:
+        raise ProtocolError(f"Unsupported sample rate {sample_rate!r}")
+    if not isinstance(channels, int) or not 1 <= channels <= 8:
+        raise ProtocolError(f"Unsupported number of channels {channels!r}")
+    return {"sample_rate": sample_rate, "channels": channels}
+
+
+def handshake(version=VERSION):
+    return MAGIC + bytes([version])
+
+
+def accept_version(client_version):
+    if client_version < 1:
+        raise ProtocolError(f"Unsupported protocol version {client_version}")
+    return min(client_version, VERSION)
+
+
+class FrameDecoder:
+    """Incremental frame parser. Bytes are appended to one bytearray and consumed
+    from a read offset, so splitting a stream into frames is linear in its size."""
+
+    def __init__(self):
+        self._data = bytearray()
+        self._offset = 0
+
+    def feed(self, data):
+        """appends received bytes and returns the complete frames as [(type, payload), ...]"""
+        self._data += data
+        frames = []
+        while len(self._data) - self._offset >= HEADER.size:
+            frame_type, length = HEADER.unpack_from(self._data, self._offset)
+            if length > MAX_PAYLOAD:
+                raise ProtocolError(f"Frame of {length} bytes is too large")
+            start = self._offset + HEADER.size
+            if len(self._data) - start < length:
+                break
+            frames.append((frame_type, bytes(self._data[start:start+length])))
+            self._offset = start + length
+        if self._offset > 65536 and self._offset * 2 > len(self._data):
+            del self._data[:self._offset]
+            self._offset = 0
+        return frames
+
+
+def send_frame(socket, frame_type, payload=b""):
+    socket.sendall(encode_frame(frame_type, payload))
+
+
+def send_event(socket, event: TranscriptEvent):
+    send_frame(socket, TRANSCRIPT, event.to_payload())
+
+
+def receive_exactly(socket, n):
+    data = bytearray()
+    while len(data) < n:
+        packet = socket.recv(n - len(data))
+        if not packet:  # Connection has been closed.
+            return None
+        data += packet
+    return bytes(data)
+
+
+def receive_frame(socket):
+    """Receives one frame. Returns (type, payload), or None if the connection has been closed."""
+    header = receive_exactly(socket, HEADER.size)
+    if header is None:
+        return None
+    frame_type, length = HEADER.unpack(header)
+    if length > MAX_PAYLOAD:
+        raise ProtocolError(f"Frame of {length} bytes is too large")
+    payload = receive_exactly(socket, length) if length else b""
+    if payload is None:
+        return None
+    return frame_type, payload
+
+
+def negotiate_server(socket):
+    """Detects the protocol of a new connection on the server side.
+    Returns the accepted version of the framed protocol, or None for a legacy client.
+    The handshake is only consumed if it is there, so legacy audio stays in the socket."""
+    head = socket.recv(len(MAGIC) + 1, socket_module.MSG_PEEK | socket_module.MSG_WAITALL)
+    if len(head) < len(MAGIC) + 1 or head[:len(MAGIC)] != MAGIC:
+        return None
+    receive_exactly(socket, len(head))
+    version = accept_version(head[len(MAGIC)])
+    socket.sendall(handshake(version))
+    return version
+
+
+def negotiate_client(socket, version=VERSION):
+    """Client side of the handshake. Returns the version accepted by the server."""
+    socket.sendall(handshake(version))
+    head = receive_exactly(socket, len(MAGIC) + 1)
+    if head is None or head[:len(MAGIC)] != MAGIC:
+        raise ProtocolError("Server doesn't speak the framed protocol")
+    return head[len(MAGIC)]
+
+
+async def read_frame(reader):
+    """asyncio version of receive_frame"""
+    try:
+        header = await reader.readexactly(HEADER.size)
+        frame_type, length = HEADER.unpack(header)
+        if length > MAX_PAYLOAD:
+            raise ProtocolError(f"Frame of {length} bytes is too large")
+        payload = await reader.readexactly(length) if length else b""
+    except asyncio.IncompleteReadError:
+        return None
+    return frame_type, payload
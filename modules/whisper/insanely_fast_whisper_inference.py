@@ -1,7 +1,7 @@
 import os
 import time
 import numpy as np
-from typing import BinaryIO, Union, Tuple, List
+from typing import BinaryIO, Union, Tuple, List, Optional
 import torch
 from transformers import pipeline
 from transformers.utils import is_flash_attn_2_available
@@ -13,6 +13,9 @@ from argparse import Namespace
 
 from modules.whisper.whisper_parameter import *
 from modules.whisper.whisper_base import WhisperBase
+from modules.whisper.transcript_store import SessionTranscript
+from modules.utils.audio_manager import DecodedAudio
+from modules.whisper.model_pool import estimate_model_bytes
 
 
 class InsanelyFastWhisperInference(WhisperBase):
@@ -32,21 +35,24 @@ class InsanelyFastWhisperInference(WhisperBase):
         self.available_compute_types = ["float16"]
 
     def transcribe(self,
-                   audio: Union[str, np.ndarray, torch.Tensor],
+                   audio: Union[str, np.ndarray, torch.Tensor, DecodedAudio],
                    progress: gr.Progress,
                    *whisper_params,
+                   transcript: Optional[SessionTranscript] = None,
                    ) -> Tuple[List[dict], float]:
         """
         transcribe method for faster-whisper.
 
         Parameters
         ----------
-        audio: Union[str, BinaryIO, np.ndarray]
-            Audio path or file binary or Audio numpy array
+        audio: Union[str, BinaryIO, np.ndarray, DecodedAudio]
+            Audio path or file binary or Audio numpy array, or the audio decoded by WhisperBase.run()
         progress: gr.Progress
             Indicator to show progress directly in gradio.
         *whisper_params: tuple
             Parameters related with whisper. This will be dealt with "WhisperParameters" data class
+        transcript: SessionTranscript
+            Transcript of the user's session. The segments committed by online inference are appended to it.
 
         Returns
         ----------
@@ -61,6 +67,9 @@ class InsanelyFastWhisperInference(WhisperBase):
         if params.model_size != self.current_model_size or self.model is None or self.current_compute_type != params.compute_type:
             self.update_model(params.model_size, params.compute_type, progress)
 
+        if isinstance(audio, DecodedAudio):
+            audio = {"raw": audio.samples, "sampling_rate": audio.sampling_rate}
+
         progress(0, desc="Transcribing...Progress is not shown in insanely-fast-whisper.")
         with Progress(
                 TextColumn("[progress.description]{task.description}"),
@@ -118,13 +127,19 @@ class InsanelyFastWhisperInference(WhisperBase):
 
         self.current_compute_type = compute_type
         self.current_model_size = model_size
-        self.model = pipeline(
-            "automatic-speech-recognition",
-            model=os.path.join(self.model_dir, model_size),
-            torch_dtype=self.current_compute_type,
-            device=self.device,
-            model_kwargs={"attn_implementation": "flash_attention_2"} if is_flash_attn_2_available() else {"attn_implementation": "sdpa"},
+        key = self.model_key(model_size, compute_type)
+        self.model = self.model_pool.get(
+            key=key,
+            load=lambda: pipeline(
+                "automatic-speech-recognition",
+                model=model_path,
+                torch_dtype=compute_type,
+                device=self.device,
+                model_kwargs={"attn_implementation": "flash_attention_2"} if is_flash_attn_2_available() else {"attn_implementation": "sdpa"},
+            ),
+            nbytes=estimate_model_bytes(model_size, compute_type, model_path)
         )
+        self.hold_model("model", key)
 
     @staticmethod
     def format_result(
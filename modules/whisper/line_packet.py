@@ -31,7 +31,7 @@ def send_one_line(socket, text, pad_zeros=False):
         socket: a socket object.
         text: string containing a line of text for transmission.
     """
-    text.replace('\0', '\n')
+    text = text.replace('\0', '\n')
     lines = text.splitlines()
     first_line = '' if len(lines) == 0 else lines[0]
     # TODO Is there a better way of handling bad input than 'replace'?
@@ -64,7 +64,8 @@ def receive_one_line(socket):
         A string representing a single line with a terminating newline or
         None if the connection has been closed.
     """
-    data = b''
+    # bytearray, so that appending packets is not quadratic
+    data = bytearray()
     while True:
         packet = socket.recv(PACKET_SIZE)
         if not packet:  # Connection has been closed.
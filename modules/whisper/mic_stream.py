@@ -0,0 +1,76 @@
+import numpy as np
+
+from modules.whisper.online_buffers import AudioRingBuffer
+from modules.whisper.audio_ingest import StreamingResampler
+
+
+class MicStream:
+    """State of one streaming microphone session, kept in gr.State.
+
+    Every update of the streaming microphone carries only the samples recorded
+    since the previous one. They are collected until min_chunk seconds are
+    available and then given to the session's online processor, so an update
+    costs one online iteration however long the session has been running.
+    """
+
+    SAMPLING_RATE = 16000
+
+    def __init__(self, online, transcribe_args, transcript=None, min_chunk=1.0):
+        """online: OnlineASRProcessor (or VADOnlineASRProcessor) of the session
+        transcribe_args: keyword arguments of the model's transcribe
+        transcript: SessionTranscript that the committed segments are appended to
+        min_chunk: seconds of new audio that trigger an online iteration
+        """
+        self.online = online
+        self.transcribe_args = transcribe_args
+        self.transcript = transcript
+        self.min_chunk = min_chunk
+        self.pending = AudioRingBuffer(capacity=int(self.SAMPLING_RATE*min_chunk*2))
+        # the microphone's rate is known with its first update. The resampler keeps its state between the
+        # updates, so the chunk boundaries don't click like with a resampling of every chunk on its own.
+        self.resampler = None
+        # releases the models that the session uses, set by WhisperBase.hold_session_models
+        self.models_held = None
+
+    def to_float32(self, sampling_rate, audio):
+        """mono float32 samples at 16 kHz from the (sampling rate, samples) of gr.Audio(type="numpy")"""
+        audio = np.asarray(audio)
+        if audio.ndim > 1:
+            audio = audio.mean(axis=1)
+        if np.issubdtype(audio.dtype, np.integer):
+            audio = audio.astype(np.float32) / np.iinfo(audio.dtype).max
+        audio = audio.astype(np.float32, copy=False)
+        if sampling_rate == self.SAMPLING_RATE:
+            return audio
+        if self.resampler is None or self.resampler.orig_rate != sampling_rate:
+            self.resampler = StreamingResampler(sampling_rate, self.SAMPLING_RATE)
+        return self.resampler.process(audio)
+
+    def feed(self, sampling_rate, audio):
+        """adds the new samples of the microphone.
+        Returns: the outputs committed by this update, [(start, end, "text"), ...]"""
+        self.pending.append(self.to_float32(sampling_rate, audio))
+        if len(self.pending) < self.min_chunk*self.SAMPLING_RATE:
+            return []
+        self.online.insert_audio_chunk(self.pending.view())
+        self.pending.clear()
+        return self.commit(self.online.process_iter(self.transcribe_args))
+
+    def finish(self):
+        """processes the rest of the audio when the recording stops and flushes the uncommitted text"""
+        outputs = []
+        if self.resampler is not None:
+            self.pending.append(self.resampler.flush())
+        if len(self.pending):
+            self.online.insert_audio_chunk(self.pending.view())
+            self.pending.clear()
+            outputs += self.commit(self.online.process_iter(self.transcribe_args))
+        return outputs + self.commit(self.online.finish())
+
+    def commit(self, o):
+        if not o[2]:
+            return []
+        self.online.final_results.append(o)
+        if self.transcript is not None:
+            self.transcript.append(*o)
+        return [o]
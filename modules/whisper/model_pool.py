@@ -0,0 +1,140 @@
+"""Pool of loaded Whisper models shared by the requests of an app.
+
+update_model of the implementations takes its model from the pool, by
+(implementation, model size, compute type). Models stay loaded after a switch
+while they fit in the memory budget, so switching back to a recently used
+model is instant, and two users with different settings don't reload the
+model for each other. When a model doesn't fit, the least recently used ones
+that no request holds are dropped first. A request holds the key of its
+model for as long as it runs (WhisperBase.run), so its model is never
+dropped under it. If everything else is held, the model is loaded over the
+budget rather than waiting. The implementation holds the keys of the models
+that it references as its current ones, and so does a streaming session for
+as long as it lives, so a model is only counted as freed once nothing uses it.
+
+The memory of a model is estimated from its number of parameters and the
+bytes per weight of the compute type, or from the size of its files for
+fine-tuned models.
+"""
+import gc
+import os
+import sys
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+# parameters of the Whisper models, checked in order against the start of the model name
+MODEL_PARAMS = [
+    ("distil-large", 756e6),
+    ("distil-medium", 394e6),
+    ("distil-small", 166e6),
+    ("tiny", 39e6),
+    ("base", 74e6),
+    ("small", 244e6),
+    ("medium", 769e6),
+    ("large-v3-turbo", 809e6),
+    ("turbo", 809e6),
+    ("large", 1550e6),
+]
+
+BYTES_PER_WEIGHT = {
+    "float32": 4, "float16": 2, "bfloat16": 2, "int16": 2,
+    "int8": 1, "int8_float32": 1, "int8_float16": 1, "int8_bfloat16": 1,
+}
+
+
+def estimate_model_bytes(model_size, compute_type, model_path=None):
+    """estimated memory of the model in bytes"""
+    bytes_per_weight = BYTES_PER_WEIGHT.get(compute_type, 4)
+    name = os.path.basename(str(model_size).rstrip("/\\")).lower()
+    for prefix, params in MODEL_PARAMS:
+        if name.startswith(prefix):
+            return int(params * bytes_per_weight)
+    if model_path is not None and os.path.isdir(model_path):
+        return sum(entry.stat().st_size for entry in os.scandir(model_path) if entry.is_file())
+    return int(dict(MODEL_PARAMS)["large"] * bytes_per_weight)
+
+
+class ModelPool:
+    """Loaded models by key, at most budget_bytes of them that are not held"""
+
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.models = OrderedDict() # key -> (model, bytes), least recently used first
+        self.holds = Counter() # key -> running requests, sessions and implementations that use the model
+        self.loading = set()
+        self.condition = threading.Condition()
+
+    @property
+    def used_bytes(self):
+        return sum(nbytes for _, nbytes in self.models.values())
+
+    def acquire(self, *keys):
+        """keeps the models of keys from being dropped until they are released, loaded or not yet"""
+        with self.condition:
+            for key in keys:
+                self.holds[key] += 1
+
+    def release(self, *keys):
+        """releases keys held by acquire(), and drops the models that don't fit in the budget anymore"""
+        with self.condition:
+            for key in keys:
+                self.holds[key] -= 1
+                if self.holds[key] <= 0:
+                    del self.holds[key]
+            self.make_room(0)
+
+    @contextmanager
+    def hold(self, key):
+        """keeps the model of key from being dropped while the block runs"""
+        self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release(key)
+
+    def get(self, key, load, nbytes):
+        """
+        Returns the model of key, loaded by load() if it's not in the pool.
+        Requests for a model that is being loaded wait for it instead of loading it again.
+        """
+        with self.condition:
+            while key in self.loading:
+                self.condition.wait()
+            if key in self.models:
+                self.models.move_to_end(key)
+                return self.models[key][0]
+            self.loading.add(key)
+            self.make_room(nbytes)
+        try:
+            print(f"Loading model {key}, {nbytes / 2**20:.0f} MB", file=sys.stderr)
+            model = load()
+        finally:
+            with self.condition:
+                self.loading.discard(key)
+                self.condition.notify_all()
+        with self.condition:
+            self.models[key] = (model, nbytes)
+        return model
+
+    def make_room(self, nbytes):
+        # drops the least recently used models that are not held until nbytes fit in the budget
+        dropped = False
+        for key in list(self.models):
+            if self.used_bytes + nbytes <= self.budget_bytes:
+                break
+            if self.holds[key] > 0:
+                continue
+            print(f"Dropping model {key} from the model pool", file=sys.stderr)
+            del self.models[key]
+            dropped = True
+        if nbytes and self.budget_bytes and self.used_bytes + nbytes > self.budget_bytes:
+            print(f"Model pool over its budget: {(self.used_bytes + nbytes) / 2**20:.0f} MB "
+                  f"of {self.budget_bytes / 2**20:.0f} MB, the other models are in use", file=sys.stderr)
+        if dropped:
+            gc.collect()
+
+    def clear(self):
+        with self.condition:
+            self.models.clear()
+        gc.collect()
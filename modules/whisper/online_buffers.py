@@ -0,0 +1,133 @@
+import numpy as np
+
+
+class AudioRingBuffer:
+    """Growable float32 buffer for the streaming audio of OnlineASRProcessor.
+
+    Samples live in one preallocated array between a read index (`start`) and a
+    write index (`end`). Appending writes at `end` and trimming from the front only
+    moves `start`, so both are O(1) (appends are amortized O(1): when the tail is
+    full, the live samples are moved back to the front, and the storage is doubled
+    only when more than half of it is in use). Live samples are never wrapped
+    around, so `view()` always returns a contiguous array that can be handed to
+    `asr.transcribe` without copying.
+    """
+
+    def __init__(self, capacity=16000*30, dtype=np.float32):
+        self._data = np.empty(max(int(capacity), 1), dtype=dtype)
+        self._start = 0
+        self._end = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    @property
+    def capacity(self):
+        return len(self._data)
+
+    def append(self, audio):
+        """copies `audio` to the end of the buffer"""
+        audio = np.asarray(audio, dtype=self._data.dtype).reshape(-1)
+        n = len(audio)
+        if n == 0:
+            return
+        if self._end + n > len(self._data):
+            self._make_room(n)
+        self._data[self._end:self._end+n] = audio
+        self._end += n
+
+    def trim_front(self, n):
+        """drops the first `n` samples"""
+        n = min(max(int(n), 0), len(self))
+        self._start += n
+        if self._start == self._end:
+            self._start = self._end = 0
+
+    def view(self):
+        """contiguous view of the live samples (no copy). It is valid until the next append
+        and must not be modified by the caller."""
+        return self._data[self._start:self._end]
+
+    def clear(self):
+        self._start = self._end = 0
+
+    def _make_room(self, n):
+        size = len(self)
+        capacity = len(self._data)
+        if size + n > capacity // 2:
+            while size + n > capacity // 2:
+                capacity *= 2
+            data = np.empty(capacity, dtype=self._data.dtype)
+        else:
+            data = self._data
+        # np.copyto handles the overlapping move when the storage is reused
+        np.copyto(data[:size], self._data[self._start:self._end])
+        self._data = data
+        self._start = 0
+        self._end = size
+
+
+class WordDeque:
+    """Deque of timestamped words stored as parallel arrays.
+
+    `starts` and `ends` hold the word timestamps and `ids` the token id of each
+    word (see HypothesisBuffer.token_ids), so comparing hypotheses is a vectorized
+    comparison of integer arrays instead of joining strings. Popping from the front
+    only moves the head index and is O(1).
+    """
+
+    def __init__(self, capacity=64):
+        capacity = max(int(capacity), 1)
+        self._starts = np.empty(capacity, dtype=np.float64)
+        self._ends = np.empty(capacity, dtype=np.float64)
+        self._ids = np.empty(capacity, dtype=np.int32)
+        self._head = 0
+        self._tail = 0
+
+    def __len__(self):
+        return self._tail - self._head
+
+    @property
+    def starts(self):
+        return self._starts[self._head:self._tail]
+
+    @property
+    def ends(self):
+        return self._ends[self._head:self._tail]
+
+    @property
+    def ids(self):
+        return self._ids[self._head:self._tail]
+
+    def extend(self, starts, ends, ids):
+        n = len(ids)
+        if n == 0:
+            return
+        if self._tail + n > len(self._ids):
+            self._make_room(n)
+        self._starts[self._tail:self._tail+n] = starts
+        self._ends[self._tail:self._tail+n] = ends
+        self._ids[self._tail:self._tail+n] = ids
+        self._tail += n
+
+    def popleft(self, n=1):
+        """drops the first `n` words"""
+        self._head += min(max(int(n), 0), len(self))
+        if self._head == self._tail:
+            self._head = self._tail = 0
+
+    def clear(self):
+        self._head = self._tail = 0
+
+    def _make_room(self, n):
+        size = len(self)
+        capacity = len(self._ids)
+        while size + n > capacity // 2:
+            capacity *= 2
+        for name in ("_starts", "_ends", "_ids"):
+            old = getattr(self, name)
+            new = old if capacity == len(old) else np.empty(capacity, dtype=old.dtype)
+            np.copyto(new[:size], old[self._head:self._tail])
+            setattr(self, name, new)
+        self._head = 0
+        self._tail = size
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""Load generator for the streaming servers.
+
+For every level of --concurrency, that many clients stream the given recordings
+(round-robin over the files) to a running server at real-time speed over the
+socket protocol, and one JSON line is written with:
+
+  - the commit latency of the committed text, i.e. the time from sending the
+    end of its audio to receiving it, as mean and p50/p90/p95/p99/max,
+  - the dropped connections: clients that failed to connect, lost the
+    connection or didn't get the end of their transcript in time,
+  - the CPU use and the resident memory of the server process (--server_pid),
+    sampled with psutil if it's installed, from /proc otherwise.
+
+A level is `sustained` if no connection dropped and the p95 commit latency is
+below --max_p95, so the highest sustained level is the number of concurrent
+streams that the server can take.
+
+    python -m modules.whisper.online_loadtest cs.wav test01.wav --port 43007 \
+        --concurrency 1 2 4 8 --server_pid 12345 --output load.jsonl
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from modules.whisper.whisper_online_client import load_pcm16, stream_audio
+
+
+class ProcessMonitor:
+    """Samples the CPU time and the resident memory of a process every `interval` seconds"""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        try:
+            import psutil
+            self.process = psutil.Process(pid)
+        except ImportError:
+            self.process = None
+        self.cpu_percents = []
+        self.rss = []
+
+    def sample(self):
+        """Returns (CPU seconds used by the process so far, resident memory in bytes)"""
+        if self.process is not None:
+            times = self.process.cpu_times()
+            return times.user + times.system, self.process.memory_info().rss
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK") # utime + stime
+        rss = 0
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) * 1024
+        return cpu, rss
+
+    async def run(self):
+        # samples until cancelled
+        last_cpu, _ = self.sample()
+        last_time = time.perf_counter()
+        while True:
+            await asyncio.sleep(self.interval)
+            cpu, rss = self.sample()
+            now = time.perf_counter()
+            self.cpu_percents.append(100 * (cpu - last_cpu) / (now - last_time))
+            self.rss.append(rss)
+            last_cpu, last_time = cpu, now
+
+    def report(self):
+        if not self.rss:
+            return {}
+        return dict(
+            server_mean_cpu_percent=float(np.mean(self.cpu_percents)),
+            server_max_cpu_percent=float(np.max(self.cpu_percents)),
+            server_mean_rss_mb=float(np.mean(self.rss)) / 2**20,
+            server_peak_rss_mb=float(np.max(self.rss)) / 2**20,
+        )
+
+
+async def run_client(host, port, pcm, audio_format, client_id, framed, speed, timeout):
+    """Streams one recording. Returns (commit latencies in seconds, None) or (None, the reason of the drop)"""
+    try:
+        events = await asyncio.wait_for(
+            stream_audio(host, port, pcm, client_id=client_id, speed=speed, framed=framed, audio_format=audio_format),
+            timeout,
+        )
+    except asyncio.TimeoutError:
+        return None, "timeout"
+    except Exception as e:
+        return None, type(e).__name__
+    # the audio that ends at `end` was sent end/speed seconds after the start of the stream
+    return [now - event.end/speed for now, event in events if event.committed and event.text], None
+
+
+async def run_level(host, port, clips, concurrency, framed=False, speed=1.0, stagger=0.2, server_pid=None, grace=30.0):
+    monitor = ProcessMonitor(server_pid) if server_pid is not None else None
+    sampler = asyncio.create_task(monitor.run()) if monitor is not None else None
+    tasks = []
+    for i in range(concurrency):
+        pcm, audio_format, duration = clips[i % len(clips)]
+        timeout = duration/speed + grace
+        tasks.append(asyncio.create_task(run_client(host, port, pcm, audio_format, i, framed, speed, timeout)))
+        await asyncio.sleep(stagger)
+    results = await asyncio.gather(*tasks)
+    if sampler is not None:
+        sampler.cancel()
+        await asyncio.gather(sampler, return_exceptions=True)
+
+    latencies = [latency for client, _ in results if client is not None for latency in client]
+    drops = [reason for _, reason in results if reason is not None]
+    report = dict(
+        concurrency=concurrency,
+        clients=len(results),
+        dropped_connections=len(drops),
+        drop_reasons={reason: drops.count(reason) for reason in set(drops)},
+        clients_without_output=sum(1 for client, _ in results if client is not None and not client),
+        committed_outputs=len(latencies),
+    )
+    if latencies:
+        report.update(
+            mean_commit_latency=float(np.mean(latencies)),
+            **{f"p{q}_commit_latency": float(np.percentile(latencies, q)) for q in (50, 90, 95, 99)},
+            max_commit_latency=float(np.max(latencies)),
+        )
+    if monitor is not None:
+        report.update(monitor.report())
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('audio', nargs='+', help='Recordings that the clients stream, e.g. cs.wav test01.wav')
+    parser.add_argument('--host', type=str, default='localhost')
+    parser.add_argument('--port', type=int, default=43007)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8], help='Numbers of concurrent clients to test')
+    parser.add_argument('--framed', action='store_true', help='Use the framed protocol instead of the legacy one')
+    parser.add_argument('--native', action='store_true', help='Send the recordings at their own sample rate and channels (framed protocol)')
+    parser.add_argument('--speed', type=float, default=1.0, help='Playback speed relative to real time')
+    parser.add_argument('--stagger', type=float, default=0.2, help='Delay between starting the clients of a level in seconds')
+    parser.add_argument('--pause', type=float, default=5.0, help='Pause between the levels in seconds, so that the server drains')
+    parser.add_argument('--grace', type=float, default=30.0, help='Time a client waits for its transcript after the end of its audio')
+    parser.add_argument('--server_pid', type=int, default=None, help='PID of the server, to report its CPU and memory use')
+    parser.add_argument('--max_p95', type=float, default=3.0, help='p95 commit latency in seconds that a sustained level must stay below')
+    parser.add_argument('--stop_on_failure', action='store_true', help="Don't test the higher levels once a level isn't sustained")
+    parser.add_argument('--output', type=str, default=None, help='JSON lines report. Printed to stdout if not set')
+    args = parser.parse_args()
+
+    clips = []
+    for audio_file in args.audio:
+        pcm, audio_format = load_pcm16(audio_file, args.native)
+        duration = len(pcm) / (2*audio_format["channels"]*audio_format["sample_rate"])
+        clips.append((pcm, audio_format, duration))
+
+    out = open(args.output, "a", encoding="utf-8") if args.output else sys.stdout
+    devnull = open(os.devnull, "w")
+    try:
+        for i, concurrency in enumerate(args.concurrency):
+            if i:
+                time.sleep(args.pause)
+            # the clients print every transcript they get
+            with contextlib.redirect_stdout(devnull):
+                report = asyncio.run(run_level(
+                    args.host, args.port, clips, concurrency, framed=args.framed or args.native, speed=args.speed,
+                    stagger=args.stagger, server_pid=args.server_pid, grace=args.grace,
+                ))
+            p95 = report.get("p95_commit_latency")
+            report["sustained"] = report["dropped_connections"] == 0 and p95 is not None and p95 <= args.max_p95
+            out.write(json.dumps(report, ensure_ascii=False) + "\n")
+            out.flush()
+            summary = [f"{concurrency} clients", f"{report['dropped_connections']} dropped"]
+            for key, fmt in (("p95_commit_latency", "p95 commit latency {:.2f} s"), ("server_mean_cpu_percent", "CPU {:.0f}%"),
+                             ("server_peak_rss_mb", "peak RSS {:.0f} MB")):
+                if report.get(key) is not None:
+                    summary.append(fmt.format(report[key]))
+            print(", ".join(summary) + ("" if report["sustained"] else ", NOT sustained"), file=sys.stderr)
+            if args.stop_on_failure and not report["sustained"]:
+                break
+    finally:
+        devnull.close()
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Replays recordings through OnlineASRProcessor as fast as possible.
+
+Every file is streamed with online_inference(replay=True): chunks are fed
+back-to-back on a simulated clock, so the chunking and the emission times are
+the same as in real time, but a recording takes only its decoding time. For
+every file and every combination of --min_chunk_size, --buffer_trimming_sec and --buffer_trimming
+one JSON line is written with the real time factor, the mean and p95 commit
+latency, the word-level stability of the uncommited tail, and the commit delay
+and revision rate of the committed words for --agreement/--max_uncommitted_sec
+(see HypothesisBuffer). With
+--target_latency, the chunk size is adapted by AdaptiveChunkController and the
+chosen sizes are reported too.
+
+    python -m modules.whisper.online_replay recordings/ --model large-v3 \
+        --min_chunk_size 0.5 1.0 2.0 --buffer_trimming_sec 10 15 --output sweep.jsonl
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import sys
+
+from modules.whisper.whisper_online import OnlineASRProcessor, AdaptiveChunkController, ReplayStats, online_inference, default_args_instance
+
+
+def replay_file(asr, audio_file, transcribe_args, min_chunk_size, buffer_trimming_sec, target_latency=None, buffer_trimming="segment",
+                agreement=2, max_uncommitted_sec=None):
+    online_model = OnlineASRProcessor(
+        asr,
+        buffer_trimming_sec=buffer_trimming_sec,
+        buffer_trimming=buffer_trimming,
+        agreement=agreement,
+        max_uncommitted_sec=max_uncommitted_sec,
+    )
+    stats = ReplayStats()
+    controller = AdaptiveChunkController(min_chunk_size, target_latency) if target_latency else None
+    online_inference(audio_file, online_model, transcribe_args, replay=True, min_chunk=min_chunk_size, stats=stats, chunk_controller=controller)
+    return stats.report(
+        **online_model.commit_stats.report(),
+        file=audio_file,
+        min_chunk_size=min_chunk_size,
+        buffer_trimming_sec=buffer_trimming_sec,
+        buffer_trimming=buffer_trimming,
+        agreement=agreement,
+        max_uncommitted_sec=max_uncommitted_sec,
+        adaptive_chunk=controller.metrics() if controller is not None else None,
+    )
+
+
+def collect_files(paths):
+    from modules.utils.files_manager import get_media_files
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(get_media_files(path, include_sub_directory=True)))
+        else:
+            files.append(path)
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='+', help='Audio files or folders of audio files')
+    parser.add_argument('--model', type=str, default='large-v3', help='faster-whisper model size or path')
+    parser.add_argument('--model_dir', type=str, default=None, help='Download root of the faster-whisper models')
+    parser.add_argument('--device', type=str, default='auto')
+    parser.add_argument('--compute_type', type=str, default='default')
+    parser.add_argument('--lang', type=str, default=None, help='Source language code, e.g. ja. Detected if not set')
+    parser.add_argument('--beam_size', type=int, default=5)
+    parser.add_argument('--min_chunk_size', type=float, nargs='+', default=[default_args_instance.min_chunk_size])
+    parser.add_argument('--buffer_trimming_sec', type=float, nargs='+', default=[default_args_instance.buffer_trimming_sec])
+    parser.add_argument('--buffer_trimming', type=str, nargs='+', default=[default_args_instance.buffer_trimming], choices=['segment', 'sentence'])
+    parser.add_argument('--agreement', type=int, nargs='+', default=[default_args_instance.agreement],
+                        help='Number of consecutive hypotheses that must agree to commit a word (LocalAgreement-n)')
+    parser.add_argument('--max_uncommitted_sec', type=float, nargs='+', default=[default_args_instance.max_uncommitted_sec],
+                        help='Commit words older than this without agreement. Disabled if not set')
+    parser.add_argument('--target_latency', type=float, nargs='+', default=[None],
+                        help='Adapt the chunk size to these target latencies, starting from --min_chunk_size. Fixed chunks if not set')
+    parser.add_argument('--output', type=str, default=None, help='JSON lines report. Printed to stdout if not set')
+    parser.add_argument('--verbose', action='store_true', help='Show the log of the online processor')
+    args = parser.parse_args()
+
+    import faster_whisper
+    asr = faster_whisper.WhisperModel(args.model, device=args.device, compute_type=args.compute_type, download_root=args.model_dir)
+    asr.sep = ""
+    transcribe_args = {
+        "language": args.lang,
+        "task": "transcribe",
+        "beam_size": args.beam_size,
+        "word_timestamps": True,
+        "condition_on_previous_text": True,
+    }
+
+    out = open(args.output, "a", encoding="utf-8") if args.output else sys.stdout
+    devnull = open(os.devnull, "w")
+    try:
+        for audio_file in collect_files(args.paths):
+            for min_chunk_size, buffer_trimming_sec, target_latency, buffer_trimming, agreement, max_uncommitted_sec in itertools.product(
+                    args.min_chunk_size, args.buffer_trimming_sec, args.target_latency, args.buffer_trimming,
+                    args.agreement, args.max_uncommitted_sec):
+                log = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull)
+                with log:
+                    report = replay_file(
+                        asr, audio_file, transcribe_args, min_chunk_size, buffer_trimming_sec, target_latency, buffer_trimming,
+                        agreement, max_uncommitted_sec,
+                    )
+                out.write(json.dumps(report, ensure_ascii=False) + "\n")
+                out.flush()
+    finally:
+        devnull.close()
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Parallel transcription of many files, the batch mode of WhisperBase.transcribe_file.
+
+Every worker process holds its own instance of the inference class with the
+models on the CPU. The cores are split between the workers: a worker uses
+cpu_count // workers threads and decodes one file at a time (num_workers=1 of
+faster-whisper). The longest files are submitted first, so a long recording
+doesn't start last and keep a single worker busy while the others are idle.
+The results are yielded in the order in which they complete.
+
+The pool stays up between batches (WhisperBase.transcription_workers), so the
+workers only start and load their models once. It's rebuilt when the number of
+workers changes or a worker died. A worker switches models by itself, with
+update_model, when a batch asks for another one.
+"""
+import multiprocessing
+import os
+from argparse import Namespace
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import astuple
+
+import librosa
+
+from modules.utils.audio_manager import DecodedAudio
+from modules.whisper.whisper_parameter import WhisperParameters
+
+_inference = None # the WhisperBase of a worker process
+
+
+def no_progress(*args, **kwargs):
+    pass
+
+
+def init_worker(inference_class, model_dir, output_dir, args, cpu_threads):
+    global _inference
+    _inference = inference_class(
+        model_dir=model_dir,
+        output_dir=output_dir,
+        args=args
+    )
+    _inference.use_cpu(cpu_threads)
+
+
+def worker_args(inference):
+    """the arguments that the instances of the workers are created with, like the one of the app"""
+    cache = inference.cache
+    return Namespace(
+        diarization_model_dir=inference.diarizer.model_dir,
+        transcription_cache_dir=cache.directory if cache is not None else None,
+        transcription_cache_size_mb=cache.max_bytes / 2**20 if cache is not None else 0,
+        model_pool_size_mb=0, # a worker uses a single model
+    )
+
+
+def transcribe_in_worker(path, whisper_params):
+    # runs in a worker: the result of WhisperBase.run() and the duration of the file
+    params = WhisperParameters.as_value(*whisper_params)
+    if params.compute_type not in _inference.available_compute_types:
+        params.compute_type = "float32"
+    audio = DecodedAudio.load(path)
+    segments, elapsed_time = _inference.run(audio, no_progress, *astuple(params))
+    return segments, elapsed_time, audio.duration
+
+
+def estimated_duration(path):
+    """duration of the file in seconds without decoding it, 0 if it can't be read so that it's submitted last"""
+    try:
+        return librosa.get_duration(path=path)
+    except Exception:
+        return 0.0
+
+
+def cpu_threads_per_worker(workers, cpu_count=None):
+    cpu_count = cpu_count or os.cpu_count() or 1
+    return max(1, cpu_count // workers)
+
+
+class TranscriptionWorkers:
+    """Worker processes that transcribe files for an inference instance, kept between batches"""
+
+    def __init__(self, inference, workers):
+        self.workers = workers
+        self.cpu_threads = cpu_threads_per_worker(workers)
+        self.broken = False
+        print(f"Starting {workers} worker processes of {self.cpu_threads} CPU threads")
+        # spawn: the parent has torch and CTranslate2 thread pools that a forked child would inherit in a broken state
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(type(inference), inference.model_dir, inference.output_dir, worker_args(inference),
+                      self.cpu_threads),
+        )
+
+    def transcribe(self, paths, whisper_params):
+        paths = sorted(paths, key=estimated_duration, reverse=True)
+        futures = {self.executor.submit(transcribe_in_worker, path, tuple(whisper_params)): path for path in paths}
+        try:
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    segments, elapsed_time, duration = future.result()
+                except BrokenProcessPool as e:
+                    self.broken = True
+                    yield path, e, 0.0, 0.0
+                    continue
+                except Exception as e:
+                    yield path, e, 0.0, 0.0
+                    continue
+                yield path, segments, elapsed_time, duration
+        finally:
+            # the batch was abandoned: don't keep the workers busy with it
+            for future in futures:
+                future.cancel()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def transcribe_parallel(inference, paths, whisper_params, workers):
+    """
+    Transcribes the files in the worker processes of the inference instance, started on first use.
+
+    Parameters
+    ----------
+    inference: WhisperBase
+        Instance whose class, model_dir, output_dir and diarization model directory the workers use
+    paths: list
+        Paths of the files to transcribe
+    whisper_params: tuple
+        Parameters related with whisper. This will be dealt with "WhisperParameters" data class
+    workers: int
+        Number of worker processes
+
+    Returns
+    ----------
+    Generator of (path, segments_result, elapsed_time, duration) in the order of completion.
+    A file whose transcription failed is yielded with the exception as segments_result.
+    """
+    pool = inference.transcription_workers
+    if pool is None or pool.workers != workers or pool.broken:
+        if pool is not None:
+            pool.shutdown()
+        pool = inference.transcription_workers = TranscriptionWorkers(inference, workers)
+    print(f"Transcribing {len(paths)} files in {pool.workers} worker processes")
+    yield from pool.transcribe(paths, whisper_params)
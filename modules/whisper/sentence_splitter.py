@@ -0,0 +1,48 @@
+import re
+
+# a sentence runs to the first terminator: Japanese/full-width punctuation, or
+# ASCII "." "?" "!" followed by whitespace or the end of the text. Closing quotes
+# and brackets after the terminator belong to the sentence. The text after the
+# last terminator is returned as the last (incomplete) sentence.
+CLOSING = r'[」』）)\]"\'’”]*'
+SENTENCE = re.compile(
+    r'\S.*?(?:[。．！？｡]+' + CLOSING + r'|[.?!]+' + CLOSING + r'(?=\s|$)|$)',
+    re.S,
+)
+
+# a period after these doesn't end the sentence
+ABBREVIATIONS = {"mr.", "mrs.", "ms.", "dr.", "prof.", "st.", "vs.", "etc.", "e.g.", "i.e.", "no.", "fig.", "approx."}
+
+
+class RegexSentenceSplitter:
+    """Rule based Japanese/English sentence splitter.
+
+    It has the split method of MosesTokenizer that OnlineASRProcessor expects, but
+    it's a single regular expression pass, cheap enough to run on every
+    iteration. Any object with such a split method can be used instead.
+    """
+
+    def __init__(self, abbreviations=ABBREVIATIONS):
+        self.abbreviations = abbreviations
+
+    def split(self, text):
+        """returns the sentences of text, stripped"""
+        sentences = []
+        merge = False
+        for m in SENTENCE.finditer(text):
+            sentence = m.group(0).strip()
+            if not sentence:
+                continue
+            if merge:
+                sentences[-1] += " " + sentence
+            else:
+                sentences.append(sentence)
+            last_word = sentence.rsplit(None, 1)[-1].lower()
+            merge = last_word in self.abbreviations
+        return sentences
+
+
+def create_tokenizer(lang=None):
+    """Sentence splitter for the language code lang, e.g. "ja" or "en".
+    The regular expression handles both Japanese and English punctuation, so it's used for every language."""
+    return RegexSentenceSplitter()
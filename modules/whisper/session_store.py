@@ -0,0 +1,108 @@
+"""On-disk checkpoints of streaming sessions.
+
+When the connection of a session with an id drops before the client has sent
+END, the server saves the state of its online processor: the committed words,
+the uncommitted hypotheses, the offset of the audio buffer, the audio buffer
+itself (with the audio that a VAD controller hasn't passed on yet), and how
+much audio the client had sent. A client that reconnects with
+the same id gets its session back and is told where to resume the stream, so no
+audio is sent or decoded twice.
+
+A checkpoint is one `<session id>.npz` file: the trailing audio as PCM16 (the
+format it was received in, so the conversion is lossless) and the rest,
+including the committed outputs that couldn't be sent anymore, as one JSON
+document. It's written to a temporary file first and renamed, so a crash
+never leaves a half written checkpoint.
+"""
+import json
+import os
+import re
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+
+SESSION_ID = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+def valid_session_id(session_id):
+    return isinstance(session_id, str) and SESSION_ID.fullmatch(session_id) is not None
+
+
+@dataclass
+class SessionCheckpoint:
+    session_id: str
+    stream_sec: float # audio received from the client, in seconds since the start of the stream
+    state: dict # OnlineASRProcessor.state() (or VADOnlineASRProcessor.state())
+    audio: np.ndarray # float32 audio of the processor, state_audio()
+    last_end: Optional[float] = None # end of the last sent output in milliseconds, keeps the intervals from overlapping
+    unsent: list = field(default_factory=list) # committed outputs that the client didn't get, [(start, end, "text"), ...]
+    saved_at: float = 0.0
+
+    def restore(self, online_asr_proc):
+        online_asr_proc.load_state(self.state, self.audio)
+
+
+class SessionStore:
+    """Checkpoints of the streaming sessions in `directory`, by session id"""
+
+    def __init__(self, directory, max_age_sec=24*3600):
+        """max_age_sec: checkpoints older than this are ignored and deleted"""
+        self.directory = directory
+        self.max_age_sec = max_age_sec
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, session_id):
+        if not valid_session_id(session_id):
+            raise ValueError(f"Invalid session id {session_id!r}")
+        return os.path.join(self.directory, session_id + ".npz")
+
+    def save(self, session_id, online_asr_proc, stream_sec, last_end=None, unsent=()):
+        """writes the checkpoint of the session, replacing the previous one"""
+        audio = online_asr_proc.state_audio()
+        pcm = np.clip(np.rint(audio*32768), -32768, 32767).astype("<i2")
+        meta = dict(
+            session_id=session_id,
+            stream_sec=stream_sec,
+            last_end=last_end,
+            unsent=[o for o in unsent if o[2]],
+            saved_at=time.time(),
+            state=online_asr_proc.state(),
+        )
+        path = self.path(session_id)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, audio=pcm, meta=np.frombuffer(json.dumps(meta, ensure_ascii=False).encode("utf-8"), dtype=np.uint8))
+        os.replace(tmp, path)
+        print(f"[{session_id}] checkpoint saved: {stream_sec:.2f} s received, {len(pcm)/16000:.2f} s of audio, "
+              f"{os.path.getsize(path)} bytes", file=sys.stderr)
+
+    def load(self, session_id):
+        """Returns the SessionCheckpoint of the session, or None if there is no (recent enough) one"""
+        path = self.path(session_id)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            meta = json.loads(data["meta"].tobytes().decode("utf-8"))
+            audio = data["audio"].astype(np.float32) / 32768
+        if time.time() - meta["saved_at"] > self.max_age_sec:
+            print(f"[{session_id}] checkpoint expired", file=sys.stderr)
+            self.delete(session_id)
+            return None
+        return SessionCheckpoint(
+            session_id=meta["session_id"],
+            stream_sec=meta["stream_sec"],
+            state=meta["state"],
+            audio=audio,
+            last_end=meta["last_end"],
+            unsent=[tuple(o) for o in meta["unsent"]],
+            saved_at=meta["saved_at"],
+        )
+
+    def delete(self, session_id):
+        try:
+            os.remove(self.path(session_id))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,76 @@
+import threading
+
+from modules.utils.subtitle_manager import timeformat_srt, timeformat_vtt
+
+
+class SessionTranscript:
+    """Committed segments of one streaming session, with their SRT/VTT rendering.
+
+    Every appended segment is rendered to its SRT and VTT cue once. The full
+    texts are cached and only the cues added since the last call are joined to
+    them, so polling the transcript costs O(new segments) of formatting.
+    """
+
+    def __init__(self):
+        self.segments = []
+        self._cues = {"srt": [], "vtt": []}
+        self._text = {"srt": "", "vtt": "WebVTT\n\n"}
+        self._rendered = {"srt": 0, "vtt": 0}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.segments)
+
+    def append(self, start, end, text):
+        text = text[1:] if text.startswith(' ') else text
+        with self._lock:
+            self.segments.append({"start": start, "end": end, "text": text})
+            i = len(self.segments)
+            self._cues["srt"].append(f"{i}\n{timeformat_srt(start)} --> {timeformat_srt(end)}\n{text}\n\n")
+            self._cues["vtt"].append(f"{i}\n{timeformat_vtt(start)} --> {timeformat_vtt(end)}\n{text}\n\n")
+
+    def cues_since(self, index, file_format="srt"):
+        """returns (the cues of the segments from `index` on, the index to pass next time)"""
+        with self._lock:
+            cues = self._cues[file_format]
+            return "".join(cues[index:]), len(cues)
+
+    def srt(self):
+        return self._render("srt")
+
+    def vtt(self):
+        return self._render("vtt")
+
+    def _render(self, file_format):
+        with self._lock:
+            cues = self._cues[file_format]
+            if self._rendered[file_format] < len(cues):
+                self._text[file_format] += "".join(cues[self._rendered[file_format]:])
+                self._rendered[file_format] = len(cues)
+            return self._text[file_format]
+
+    def clear(self):
+        with self._lock:
+            self.segments = []
+            self._cues = {"srt": [], "vtt": []}
+            self._text = {"srt": "", "vtt": "WebVTT\n\n"}
+            self._rendered = {"srt": 0, "vtt": 0}
+
+
+class TranscriptRegistry:
+    """SessionTranscript of every active session, by session id (e.g. gr.Request.session_hash)"""
+
+    def __init__(self):
+        self._transcripts = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            transcript = self._transcripts.get(session_id)
+            if transcript is None:
+                transcript = self._transcripts[session_id] = SessionTranscript()
+            return transcript
+
+    def pop(self, session_id):
+        with self._lock:
+            return self._transcripts.pop(session_id, None)
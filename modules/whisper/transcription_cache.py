@@ -0,0 +1,118 @@
+"""On-disk cache of transcription results.
+
+WhisperBase.run() looks the transcription up before running the model, so a
+recording that is transcribed again with the same decoding parameters, e.g. to
+write another subtitle format or to diarize it, doesn't run Whisper again.
+
+An entry is keyed by the content hash of the decoded audio (DecodedAudio) and
+the parameters that change the transcription: everything in WhisperValues but
+the diarization settings, plus the implementation. It's one `<key>.npz` file
+with the segment and word times as arrays, and their texts as one JSON list.
+Other fields of the segments are not kept. Reading an entry touches its
+modification time, and when the cache grows over max_bytes, the entries read
+least recently are deleted first.
+"""
+import hashlib
+import json
+import os
+import sys
+from dataclasses import asdict
+
+import numpy as np
+
+# WhisperValues fields that don't change the transcription
+NON_DECODING_PARAMS = frozenset({
+    "is_diarize", "hf_token", "diarization_device", "min_speakers", "max_speakers",
+    "enable_streaming_microphone",
+})
+
+
+def cache_key(content_hash, params, implementation):
+    """key of the transcription of the audio with the hash content_hash, with the WhisperValues params"""
+    decoding = {k: v for k, v in asdict(params).items() if k not in NON_DECODING_PARAMS}
+    document = json.dumps([content_hash, implementation, decoding], sort_keys=True, default=str)
+    return hashlib.sha256(document.encode("utf-8")).hexdigest()
+
+
+class TranscriptionCache:
+    """Transcription results in `directory`, at most max_bytes of them"""
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, key):
+        """Returns the cached segments, or None"""
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                segments = self.unpack(data)
+            os.utime(path) # most recently used
+        except (FileNotFoundError, ValueError, KeyError, OSError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"Ignoring the unreadable cache entry {path}: {e}", file=sys.stderr)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return segments
+
+    def put(self, key, segments):
+        path = self.path(key)
+        tmp = path + f".{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, **self.pack(segments))
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self):
+        """deletes the least recently used entries while the cache is larger than max_bytes"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npz"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError: # deleted by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    @staticmethod
+    def pack(segments):
+        words = [(i, w) for i, segment in enumerate(segments) for w in segment.get("words") or []]
+        texts = [segment["text"] for segment in segments] + [w.get("word", "") for _, w in words]
+        return dict(
+            times=np.array([(s["start"], s["end"]) for s in segments], dtype=np.float64).reshape(-1, 2),
+            word_times=np.array([(w["start"], w["end"]) for _, w in words], dtype=np.float64).reshape(-1, 2),
+            word_probability=np.array([w.get("probability", np.nan) for _, w in words], dtype=np.float64),
+            word_segment=np.array([i for i, _ in words], dtype=np.int32),
+            texts=np.frombuffer(json.dumps(texts, ensure_ascii=False).encode("utf-8"), dtype=np.uint8),
+        )
+
+    @staticmethod
+    def unpack(data):
+        times = data["times"]
+        texts = json.loads(data["texts"].tobytes().decode("utf-8"))
+        segments = [{"start": float(start), "end": float(end), "text": text}
+                    for (start, end), text in zip(times, texts)]
+        word_texts = texts[len(segments):]
+        for (start, end), probability, i, word in zip(data["word_times"], data["word_probability"],
+                                                      data["word_segment"], word_texts):
+            w = {"start": float(start), "end": float(end), "word": word}
+            if not np.isnan(probability):
+                w["probability"] = float(probability)
+            segments[i].setdefault("words", []).append(w)
+        return segments
@@ -0,0 +1,234 @@
+from collections import deque
+
+import numpy as np
+
+from modules.whisper.online_buffers import AudioRingBuffer
+
+
+class VADOnlineASRProcessor:
+    """Voice activity controller in front of an OnlineASRProcessor.
+
+    Every inserted chunk goes through a streaming VAD (StreamingSileroVAD of
+    modules/vad/silero_vad.py) first. Only the speech is given to the online
+    processor, and process_iter runs Whisper only if new speech has arrived
+    since the last iteration, so silent chunks cost one VAD pass and no
+    decoding. When the VAD reports the end of an utterance (a silence of
+    min_silence_duration_ms), the speech inserted since the last iteration is
+    decoded, the utterance is finished and the processor is restarted at the
+    next speech, so the audio buffer never holds long pauses. A start of speech
+    that the VAD reports before the previous utterance is finished waits for it,
+    with the events after it.
+
+    It has the interface of OnlineASRProcessor and can be used in its place.
+    """
+
+    SAMPLING_RATE = 16000
+
+    def __init__(self, online, vad, lookback_sec=1.0):
+        """online: OnlineASRProcessor
+        vad: StreamingSileroVAD, e.g. SileroVAD().streaming(vad_options)
+        lookback_sec: silence kept before the current position, the VAD may report a start of speech in it
+        """
+        self.online = online
+        self.vad = vad
+        self.lookback = int(lookback_sec*self.SAMPLING_RATE)
+        self.decoded_iterations = 0
+        self.skipped_iterations = 0
+        self.init()
+
+    def init(self, offset=None):
+        """run this when starting or restarting processing"""
+        self.online.init(offset)
+        self.vad.reset()
+        self.stream_offset = 0 if offset is None else offset # time of the first sample seen by the VAD
+        self.pending = AudioRingBuffer(capacity=2*self.lookback) # audio not given to the online processor yet
+        self.pending_offset = 0 # position of the first pending sample in the stream, in samples
+        self.voiced = False
+        self.new_speech = 0 # samples of speech inserted since the last iteration
+        self.utterance_ended = False
+        self.events = deque() # VAD events waiting for the ended utterance to be finished
+        self.finished = [] # outputs of the finished utterances, not returned yet
+
+    @property
+    def final_results(self):
+        return self.online.final_results
+
+    @property
+    def asr(self):
+        return self.online.asr
+
+    @asr.setter
+    def asr(self, asr):
+        self.online.asr = asr
+
+    @property
+    def commited(self):
+        return self.online.commited
+
+    @property
+    def transcript_buffer(self):
+        return self.online.transcript_buffer
+
+    @property
+    def commit_stats(self):
+        return self.online.commit_stats
+
+    def insert_audio_chunk(self, audio):
+        self.events.extend(self.vad(audio))
+        self.pending.append(audio)
+        self.handle_events()
+
+    def handle_events(self):
+        # the events up to the start of the next utterance, if the current one has ended
+        while self.events:
+            if "start" in self.events[0] and self.utterance_ended:
+                return # its audio stays pending until finish_utterance
+            event = self.events.popleft()
+            if "start" in event:
+                start = min(max(event["start"], self.pending_offset), self.pending_offset + len(self.pending))
+                self.drop_pending(start - self.pending_offset)
+                self.online.init(offset=self.stream_offset + start/self.SAMPLING_RATE)
+                self.voiced = True
+            elif self.voiced:
+                end = min(max(event["end"], self.pending_offset), self.pending_offset + len(self.pending))
+                self.feed_pending(end - self.pending_offset)
+                self.voiced = False
+                self.utterance_ended = True
+
+        if self.voiced:
+            self.feed_pending(len(self.pending))
+        elif len(self.pending) > self.lookback:
+            self.drop_pending(len(self.pending) - self.lookback)
+
+    def feed_pending(self, n):
+        if n > 0:
+            self.online.insert_audio_chunk(self.pending.view()[:n])
+            self.new_speech += n
+        self.drop_pending(n)
+
+    def drop_pending(self, n):
+        self.pending.trim_front(n)
+        self.pending_offset += n
+
+    def finish_utterance(self, args):
+        """decodes the speech inserted since the last iteration, finishes the current utterance
+        after a long silence and frees its audio. Then handles the VAD events that waited for it."""
+        if self.has_new_speech:
+            self.decoded_iterations += 1
+            o = self.online.process_iter(args)
+            if o[2]:
+                self.finished.append(o)
+        o = self.online.finish()
+        print(f"--- end of utterance, finished {o}")
+        if o[2]:
+            self.finished.append(o)
+        self.online.init(offset=self.stream_offset + self.pending_offset/self.SAMPLING_RATE)
+        self.utterance_ended = False
+        self.new_speech = 0
+        self.handle_events()
+
+    @property
+    def audio_buffer(self):
+        return self.online.audio_buffer
+
+    @property
+    def buffer_time_offset(self):
+        """time of the first sample that can still be decoded: the start of the audio buffer, or of the
+        pending audio when the buffer is empty between utterances"""
+        if len(self.online.audio_buffer):
+            return self.online.buffer_time_offset
+        return self.stream_offset + self.pending_offset/self.SAMPLING_RATE
+
+    @property
+    def has_new_speech(self):
+        return self.new_speech > 0
+
+    def ready_output(self, args):
+        """finishes the utterances whose end has been detected, see finish_utterance.
+        The speech of the next utterance is left to the next iteration.
+        Returns: the output of the finished utterances, or None if there is none"""
+        while self.utterance_ended:
+            self.finish_utterance(args)
+        if self.finished:
+            return self.pop_finished()
+        return None
+
+    def process_iter(self, args):
+        """Finishes the ended utterances, and runs OnlineASRProcessor.process_iter only if there is new speech.
+        Returns: a tuple (start_timestamp, end_timestamp, "text"), or (None, None, "").
+        """
+        while self.utterance_ended:
+            self.finish_utterance(args)
+        if not self.has_new_speech:
+            if self.finished:
+                return self.pop_finished()
+            self.skipped_iterations += 1
+            print(f"no new speech, skipping ({self.skipped_iterations} skipped, {self.decoded_iterations} decoded)")
+            return (None, None, "")
+        self.new_speech = 0
+        self.decoded_iterations += 1
+        return self.pop_finished(self.online.process_iter(args))
+
+    def prompt(self):
+        return self.online.prompt()
+
+    def commit_iter(self, res):
+        """commits a transcription of self.audio_buffer made by the caller, see OnlineASRProcessor.commit_iter"""
+        self.new_speech = 0
+        self.decoded_iterations += 1
+        return self.online.commit_iter(res)
+
+    def partial(self):
+        return self.online.partial()
+
+    def pop_finished(self, last=None):
+        outputs = self.finished + ([last] if last is not None and last[2] else [])
+        self.finished = []
+        return self.online.to_flush(outputs)
+
+    def skip(self, seconds):
+        """Skips the next `seconds` of the stream, see OnlineASRProcessor.skip"""
+        o = self.finish()
+        self.stream_offset += (self.pending_offset + len(self.pending))/self.SAMPLING_RATE + seconds
+        self.vad.reset()
+        self.events.clear()
+        self.pending.clear()
+        self.pending_offset = 0
+        self.online.init(offset=self.stream_offset)
+        return o
+
+    def state(self):
+        """See OnlineASRProcessor.state. The VAD itself is not saved, it starts over when the state is loaded."""
+        return dict(
+            self.online.state(),
+            stream_end=self.stream_offset + (self.pending_offset + len(self.pending))/self.SAMPLING_RATE,
+            pending_samples=len(self.pending),
+        )
+
+    def state_audio(self):
+        """the audio buffer of the online processor followed by the audio not given to it yet, see self.state()"""
+        return np.concatenate([self.online.state_audio(), self.pending.view()])
+
+    def load_state(self, state, audio):
+        """Restores the state returned by self.state(), with the audio of self.state_audio().
+        The restored utterance is decoded and finished at the next iteration, a reconnect counts as its end.
+        The audio that was not given to the online processor yet goes through the VAD again."""
+        n_pending = state.get("pending_samples", 0)
+        pending = audio[len(audio) - n_pending:]
+        audio = audio[:len(audio) - n_pending]
+        self.init(offset=state["stream_end"] - n_pending/self.SAMPLING_RATE)
+        self.online.load_state(state, audio)
+        self.utterance_ended = len(audio) > 0
+        self.new_speech = len(audio) # its uncommitted words are decoded again before it's finished
+        if n_pending:
+            self.insert_audio_chunk(pending)
+
+    def finish(self):
+        """Flush the incomplete text when the whole processing ends.
+        Returns: the same format as self.process_iter()
+        """
+        o = self.online.finish()
+        self.voiced = False
+        self.utterance_ended = False
+        self.new_speech = 0
+        return self.pop_finished(o)
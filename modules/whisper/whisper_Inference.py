@@ -1,12 +1,15 @@
 import whisper
 import gradio as gr
 import time
-from typing import BinaryIO, Union, Tuple, List
+from typing import BinaryIO, Union, Tuple, List, Optional
 import numpy as np
 import torch
 from argparse import Namespace
 
 from modules.whisper.whisper_base import WhisperBase
+from modules.whisper.transcript_store import SessionTranscript
+from modules.utils.audio_manager import DecodedAudio
+from modules.whisper.model_pool import estimate_model_bytes
 from modules.whisper.whisper_parameter import *
 
 
@@ -23,21 +26,24 @@ class WhisperInference(WhisperBase):
         )
 
     def transcribe(self,
-                   audio: Union[str, np.ndarray, torch.Tensor],
+                   audio: Union[str, np.ndarray, torch.Tensor, DecodedAudio],
                    progress: gr.Progress,
                    *whisper_params,
+                   transcript: Optional[SessionTranscript] = None,
                    ) -> Tuple[List[dict], float]:
         """
         transcribe method for faster-whisper.
 
         Parameters
         ----------
-        audio: Union[str, BinaryIO, np.ndarray]
-            Audio path or file binary or Audio numpy array
+        audio: Union[str, BinaryIO, np.ndarray, DecodedAudio]
+            Audio path or file binary or Audio numpy array, or the audio decoded by WhisperBase.run()
         progress: gr.Progress
             Indicator to show progress directly in gradio.
         *whisper_params: tuple
             Parameters related with whisper. This will be dealt with "WhisperParameters" data class
+        transcript: SessionTranscript
+            Transcript of the user's session. The segments committed by online inference are appended to it.
 
         Returns
         ----------
@@ -52,6 +58,9 @@ class WhisperInference(WhisperBase):
         if params.model_size != self.current_model_size or self.model is None or self.current_compute_type != params.compute_type:
             self.update_model(params.model_size, params.compute_type, progress)
 
+        if isinstance(audio, DecodedAudio):
+            audio = audio.samples
+
         def progress_callback(progress_value):
             progress(progress_value, desc="Transcribing..")
 
@@ -93,8 +102,15 @@ class WhisperInference(WhisperBase):
         progress(0, desc="Initializing Model..")
         self.current_compute_type = compute_type
         self.current_model_size = model_size
-        self.model = whisper.load_model(
-            name=model_size,
-            device=self.device,
-            download_root=self.model_dir
-        )
\ No newline at end of file
+        key = self.model_key(model_size, compute_type)
+        self.model = self.model_pool.get(
+            key=key,
+            load=lambda: whisper.load_model(
+                name=model_size,
+                device=self.device,
+                download_root=self.model_dir
+            ),
+            # openai-whisper keeps the weights in float32 whatever the compute type
+            nbytes=estimate_model_bytes(model_size, "float32")
+        )
+        self.hold_model("model", key)
\ No newline at end of file
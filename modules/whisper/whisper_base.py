@@ -1,10 +1,12 @@
 import os
+import time
+import weakref
 import torch
 import whisper
 import gradio as gr
 import librosa
 from abc import ABC, abstractmethod
-from typing import BinaryIO, Union, Tuple, List
+from typing import BinaryIO, Union, Tuple, List, Optional
 import numpy as np
 from datetime import datetime
 from argparse import Namespace
@@ -14,9 +16,15 @@ from dataclasses import astuple
 from modules.utils.subtitle_manager import get_srt, get_vtt, get_txt, write_file, safe_filename
 from modules.utils.youtube_manager import get_ytdata, get_ytaudio
 from modules.utils.files_manager import get_media_files, format_gradio_files
+from modules.utils.audio_manager import DecodedAudio
 from modules.whisper.whisper_parameter import *
 from modules.diarize.diarizer import Diarizer
 from modules.vad.silero_vad import SileroVAD
+from modules.whisper.transcript_store import SessionTranscript, TranscriptRegistry
+from modules.whisper.mic_stream import MicStream
+from modules.whisper.parallel_transcription import transcribe_parallel
+from modules.whisper.transcription_cache import TranscriptionCache, cache_key
+from modules.whisper.model_pool import ModelPool
 
 
 class WhisperBase(ABC):
@@ -41,12 +49,26 @@ class WhisperBase(ABC):
             model_dir=args.diarization_model_dir
         )
         self.vad = SileroVAD()
+        self.transcripts = TranscriptRegistry()
+        # worker processes of transcribe_file, see parallel_transcription.py. Sequential if 1.
+        self.parallel_workers = getattr(args, "parallel_workers", 1) or 1
+        self.transcription_workers = None # the pool of those workers, started by the first batch
+        # models loaded by update_model, kept while they fit in the budget. Only the current one if 0.
+        self.model_pool = ModelPool(budget_bytes=int(getattr(args, "model_pool_size_mb", 0) * 2**20))
+        self.held_models = {} # keys in self.model_pool of the models this instance references, by attribute
+        # results of run() by audio content and decoding parameters, disabled without a directory
+        cache_dir = getattr(args, "transcription_cache_dir", None)
+        self.cache = TranscriptionCache(
+            directory=cache_dir,
+            max_bytes=int(getattr(args, "transcription_cache_size_mb", 1024) * 2**20)
+        ) if cache_dir else None
 
     @abstractmethod
     def transcribe(self,
-                   audio: Union[str, BinaryIO, np.ndarray],
+                   audio: Union[str, BinaryIO, np.ndarray, DecodedAudio],
                    progress: gr.Progress,
                    *whisper_params,
+                   transcript: Optional[SessionTranscript] = None,
                    ):
         pass
 
@@ -58,24 +80,61 @@ class WhisperBase(ABC):
                      ):
         pass
 
+    @property
+    def supports_online_inference(self) -> bool:
+        """Whether the implementation creates online processors, for the streaming microphone"""
+        return type(self).create_online_processor is not WhisperBase.create_online_processor
+
+    def create_online_processor(self,
+                                params: WhisperValues,
+                                progress: gr.Progress = gr.Progress()):
+        """
+        Create the online processor of a streaming session. Online inference is only supported
+        by the faster-whisper implementation.
+
+        Parameters
+        ----------
+        params: WhisperValues
+            Parameters related with whisper, with the language code in params.lang
+        progress: gr.Progress
+            Indicator to show progress directly in gradio.
+
+        Returns
+        ----------
+        online_model: OnlineASRProcessor
+            Online processor of the session
+        args: dict
+            Keyword arguments of the transcribe function of the model, for process_iter
+        """
+        raise NotImplementedError(f"Online inference is not supported by {type(self).__name__}")
+
     def run(self,
-            audio: Union[str, BinaryIO, np.ndarray],
+            audio: Union[str, BinaryIO, np.ndarray, DecodedAudio],
             progress: gr.Progress,
             *whisper_params,
+            transcript: Optional[SessionTranscript] = None,
             ) -> Tuple[List[dict], float]:
         """
         Run transcription with conditional pre-processing and post-processing.
         The VAD will be performed to remove noise from the audio input in pre-processing, if enabled.
+        Only the speech it finds is transcribed, and the timestamps are mapped back to the original audio.
         The diarization will be performed in post-processing, if enabled.
+        The audio is decoded once, and the decoded audio is shared by all of them. Online inference
+        of a file path is the exception: it reads the file chunk by chunk as it streams it, see
+        whisper_online.AudioChunkReader, so the whole recording is never held in memory.
+        The transcription is cached by the content of the audio and the decoding parameters, so running
+        the same audio again, e.g. for another subtitle format or with diarization, doesn't run the model.
 
         Parameters
         ----------
-        audio: Union[str, BinaryIO, np.ndarray]
+        audio: Union[str, BinaryIO, np.ndarray, DecodedAudio]
             Audio input. This can be file path or binary type.
         progress: gr.Progress
             Indicator to show progress directly in gradio.
         *whisper_params: tuple
             Parameters related with whisper. This will be dealt with "WhisperParameters" data class
+        transcript: SessionTranscript
+            Transcript of the user's session. The segments committed by online inference are appended to it.
 
         Returns
         ----------
@@ -86,7 +145,53 @@ class WhisperBase(ABC):
         """
         params = WhisperParameters.as_value(*whisper_params)
 
-        if params.vad_filter:
+        progress(0, desc="Loading audio..")
+        if not (params.enable_online_inference and isinstance(audio, str)):
+            audio = DecodedAudio.load(audio)
+
+        # online inference streams into the transcript of the session in real time, it's never cached
+        key = None
+        result = None
+        if self.cache is not None and not params.enable_online_inference:
+            key = cache_key(audio.content_hash, params, type(self).__name__)
+            result = self.cache.get(key)
+        if result is not None:
+            print(f"Using the cached transcription {key[:12]}")
+            elapsed_time = 0.0
+        else:
+            result, elapsed_time = self.transcribe_speech(audio, progress, params, transcript)
+            if key is not None:
+                try:
+                    self.cache.put(key, result)
+                except OSError as e:
+                    print(f"Failed to cache the transcription {key[:12]}: {e}")
+
+        if params.is_diarize:
+            result, elapsed_time_diarization = self.diarizer.run(
+                audio=audio,
+                use_auth_token=params.hf_token,
+                transcribed_result=result,
+                device=self.device,
+                min_speakers=params.min_speakers,
+                max_speakers=params.max_speakers,
+            )
+            elapsed_time += elapsed_time_diarization
+        return result, elapsed_time
+
+    def transcribe_speech(self,
+                          audio: Union[str, DecodedAudio],
+                          progress: gr.Progress,
+                          params: WhisperValues,
+                          transcript: Optional[SessionTranscript] = None,
+                          ) -> Tuple[List[dict], float]:
+        """
+        Transcribe the audio, only the speech found by the VAD if params.vad_filter.
+        The timestamps are in the time of the original audio. See run().
+        """
+        # online inference filters the stream with its own VAD controller, see create_online_processor
+        speech_chunks = None
+        speech_audio = audio
+        if params.vad_filter and not params.enable_online_inference:
             vad_options = VadOptions(
                 threshold=params.threshold,
                 min_speech_duration_ms=params.min_speech_duration_ms,
@@ -94,35 +199,29 @@ class WhisperBase(ABC):
                 min_silence_duration_ms=params.min_silence_duration_ms,
                 speech_pad_ms=params.speech_pad_ms
             )
-            self.vad.run(
+            speech_samples, speech_chunks = self.vad.run(
                 audio=audio,
                 vad_parameters=vad_options,
                 progress=progress
             )
+            speech_audio = DecodedAudio(samples=speech_samples, source=audio.source)
 
-        if params.lang == "Automatic Detection":
-            params.lang = None
-        else:
-            language_code_dict = {value: key for key, value in whisper.tokenizer.LANGUAGES.items()}
-            params.lang = language_code_dict[params.lang]
+        params.lang = self.language_code(params.lang)
 
-        result, elapsed_time = self.transcribe(
-            audio,
-            progress,
-            *astuple(params)
-        )
-        
-        
-        if params.is_diarize:
-            result, elapsed_time_diarization = self.diarizer.run(
-                audio=audio,
-                use_auth_token=params.hf_token,
-                transcribed_result=result,
-                device=self.device,
-                min_speakers=params.min_speakers,
-                max_speakers=params.max_speakers,
-            )
-            elapsed_time += elapsed_time_diarization
+        if speech_chunks is not None and not speech_chunks:
+            print("VAD found no speech, skipping the transcription")
+            result, elapsed_time = [], 0.0
+        else:
+            with self.model_pool.hold(self.model_key(params.model_size, params.compute_type)):
+                result, elapsed_time = self.transcribe(
+                    speech_audio,
+                    progress,
+                    *astuple(params),
+                    transcript=transcript
+                )
+        if speech_chunks:
+            # back to the time of the original audio, for the subtitles and the diarization
+            result = self.vad.restore_speech_timestamps(result, speech_chunks, self.vad.sampling_rate)
         return result, elapsed_time
 
     def transcribe_file(self,
@@ -130,6 +229,7 @@ class WhisperBase(ABC):
                         input_folder_path: str,
                         file_format: str,
                         add_timestamp: bool,
+                        request: gr.Request = None,
                         progress=gr.Progress(),
                         *whisper_params,
                         ) -> list:
@@ -147,6 +247,8 @@ class WhisperBase(ABC):
             Subtitle File format to write from gr.Dropdown(). Supported format: [SRT, WebVTT, txt]
         add_timestamp: bool
             Boolean value from gr.Checkbox() that determines whether to add a timestamp at the end of the subtitle filename.
+        request: gr.Request
+            Request injected by gradio. Its session identifies the real-time transcript of the user.
         progress: gr.Progress
             Indicator to show progress directly in gradio.
         *whisper_params: tuple
@@ -164,15 +266,27 @@ class WhisperBase(ABC):
                 files = get_media_files(input_folder_path)
                 files = format_gradio_files(files)
 
+            transcript = None
+            if request is not None:
+                transcript = self.transcripts.get(request.session_hash)
+                transcript.clear()
+
             files_info = {}
-            for file in files:
-                transcribed_segments, time_for_task = self.run(
-                    file.name,
+            failed_files = {}
+            start_time = time.time()
+            total_duration = 0.0
+            for file_path, transcribed_segments, time_for_task, duration in self.transcribe_files(
+                    [file.name for file in files],
                     progress,
                     *whisper_params,
-                )
-                
-                file_name, file_ext = os.path.splitext(os.path.basename(file.name))
+                    transcript=transcript,
+            ):
+                if isinstance(transcribed_segments, Exception):
+                    print(f"Error transcribing file {file_path}: {transcribed_segments}")
+                    failed_files[file_path] = transcribed_segments
+                    continue
+                total_duration += duration
+                file_name, file_ext = os.path.splitext(os.path.basename(file_path))
                 file_name = safe_filename(file_name)
                 subtitle, file_path = self.generate_and_write_file(
                     file_name=file_name,
@@ -184,14 +298,21 @@ class WhisperBase(ABC):
                 files_info[file_name] = {"subtitle": subtitle, "time_for_task": time_for_task, "path": file_path}
 
             total_result = ''
-            total_time = 0
             for file_name, info in files_info.items():
                 total_result += '------------------------------------\n'
                 total_result += f'{file_name}\n\n'
                 total_result += f'{info["subtitle"]}'
-                total_time += info["time_for_task"]
 
-            result_str = f"Done in {self.format_time(total_time)}! Subtitle is in the outputs folder.\n\n{total_result}"
+            total_time = time.time() - start_time
+            throughput = f"{total_duration/3600:.2f} hours of audio, {total_duration/max(total_time, 1e-9):.1f} audio hours per wall hour"
+            print(f"Transcribed {len(files_info)} files in {self.format_time(total_time)}: {throughput}")
+            result_str = f"Done in {self.format_time(total_time)} ({throughput})! Subtitle is in the outputs folder.\n\n"
+            if failed_files:
+                result_str += f"{len(failed_files)} of {len(failed_files) + len(files_info)} files failed:\n"
+                for path, error in failed_files.items():
+                    result_str += f"{os.path.basename(path)}: {error}\n"
+                result_str += "\n"
+            result_str += total_result
             result_file_path = [info['path'] for info in files_info.values()]
 
             return [result_str, result_file_path]
@@ -203,6 +324,90 @@ class WhisperBase(ABC):
             if not files:
                 self.remove_input_files([file.name for file in files])
 
+    def transcribe_files(self,
+                         paths: List[str],
+                         progress: gr.Progress,
+                         *whisper_params,
+                         transcript: Optional[SessionTranscript] = None,
+                         ):
+        """
+        Transcribe the files with self.run(), in self.parallel_workers worker processes if there are more than one.
+        Online inference always runs in this process, one file after another.
+
+        Parameters
+        ----------
+        paths: List[str]
+            Paths of the files to transcribe
+        progress: gr.Progress
+            Indicator to show progress directly in gradio.
+        *whisper_params: tuple
+            Parameters related with whisper. This will be dealt with "WhisperParameters" data class
+        transcript: SessionTranscript
+            Transcript of the user's session. The segments committed by online inference are appended to it.
+
+        Returns
+        ----------
+        Generator of (path, segments_result, elapsed_time, duration of the audio), in the order of completion.
+        A file whose transcription failed is yielded with the exception as segments_result.
+        """
+        params = WhisperParameters.as_value(*whisper_params)
+        if self.parallel_workers > 1 and len(paths) > 1 and not params.enable_online_inference:
+            for i, (path, segments, elapsed_time, duration) in enumerate(
+                    transcribe_parallel(self, paths, whisper_params, self.parallel_workers)):
+                progress((i + 1) / len(paths), desc=f"Transcribed {i + 1}/{len(paths)} files..")
+                yield path, segments, elapsed_time, duration
+            return
+
+        for path in paths:
+            try:
+                if params.enable_online_inference:
+                    # streamed from the file, see run()
+                    audio = path
+                    duration = librosa.get_duration(path=path)
+                else:
+                    audio = DecodedAudio.load(path)
+                    duration = audio.duration
+                segments, elapsed_time = self.run(audio, progress, *whisper_params, transcript=transcript)
+            except Exception as e:
+                yield path, e, 0.0, 0.0
+                continue
+            yield path, segments, elapsed_time, duration
+
+    def model_key(self, model_size: str, compute_type: str) -> tuple:
+        """Key of the model in self.model_pool"""
+        return type(self).__name__, model_size, compute_type
+
+    def hold_model(self, attribute: str, key: tuple):
+        """
+        Hold the key of the model that this instance now references as `attribute` (e.g. "model"),
+        and release the model that it referenced before, so the pool doesn't count a model as freed
+        while the instance still uses it.
+        """
+        previous = self.held_models.get(attribute)
+        if previous == key:
+            return
+        self.model_pool.acquire(key)
+        self.held_models[attribute] = key
+        if previous is not None:
+            self.model_pool.release(previous)
+
+    def hold_session_models(self, stream: MicStream):
+        """Hold the current models for as long as the streaming session references them"""
+        keys = list(self.held_models.values())
+        self.model_pool.acquire(*keys)
+        # released by finish_mic_streaming, or when gradio drops the state of an abandoned session
+        stream.models_held = weakref.finalize(stream, self.model_pool.release, *keys)
+
+    def use_cpu(self, cpu_threads: int):
+        """
+        Run the models of this instance on the CPU with cpu_threads threads,
+        e.g. in a worker process of parallel_transcription.py
+        """
+        self.device = "cpu"
+        self.available_compute_types = ["float32"]
+        self.current_compute_type = "float32"
+        torch.set_num_threads(cpu_threads)
+
     def transcribe_mic(self,
                        mic_audio: str,
                        file_format: str,
@@ -258,81 +463,86 @@ class WhisperBase(ABC):
             self.remove_input_files([mic_audio])
             
     def transcribe_mic_streaming(self,
-                       mic_audio: str,
-                       file_format: str,
-                       state: gr.State,
-                       progress=gr.Progress(),
-                       *whisper_params,
-                       ) -> list:
+                                 mic_chunk: Optional[tuple],
+                                 stream: Optional[MicStream],
+                                 request: gr.Request = None,
+                                 *whisper_params,
+                                 ) -> list:
         """
-        Write subtitle file from microphone
+        Transcribe the new audio of a streaming microphone with online inference
 
         Parameters
         ----------
-        mic_audio: str
-            Audio file path from gr.Microphone()
-        file_format: str
-            Subtitle File format to write from gr.Dropdown(). Supported format: [SRT, WebVTT, txt]
-        progress: gr.Progress
-            Indicator to show progress directly in gradio.
+        mic_chunk: tuple
+            (sampling rate, samples) recorded since the previous update, from gr.Audio(streaming=True, type="numpy")
+        stream: MicStream
+            State of the session from gr.State(). It's created by the first update.
+        request: gr.Request
+            Request injected by gradio. Its session identifies the real-time transcript of the user.
         *whisper_params: tuple
             Parameters related with whisper. This will be dealt with "WhisperParameters" data class
 
         Returns
         ----------
+        stream:
+            State of the session to return to gr.State()
         result_str:
-            Result of transcription to return to gr.Textbox()
-        result_file_path:
-            Output file path to return to gr.Files()
+            Text committed by this update to return to gr.Textbox()
         """
+        if mic_chunk is None:
+            return [stream, ""]
         try:
-            progress(0, desc="Loading Audio..")
-            print(f'Current state: {state}')
-            print(f'Current mic_audio: {mic_audio}')
-            try:
-                print(os.path.getsize(mic_audio)) 
-                sr, y = librosa.load(mic_audio, sr=16000, dtype=np.float32)
-                print(f'Current sr: {sr}')
-                print(f'duration: {len(y)/sr}')
-            except Exception as e:
-                print(f"Error loading audio: {e}")
-            
-            # Convert to mono if stereo
-            if y.ndim > 1:
-                y = y.mean(axis=1)
-                
-            y = y.astype(np.float32)
-            y /= np.max(np.abs(y))            
-            
-            if state is not None:
-                stream = np.concatenate([stream, y])
-            else:
-                stream = y
-                
-            transcribed_segments, time_for_task = self.run(
-                stream,
-                progress,
-                *whisper_params,
-            )
-            progress(1, desc="Completed!")
+            if stream is None:
+                params = WhisperParameters.as_value(*whisper_params)
+                params.lang = self.language_code(params.lang)
+                online_model, args = self.create_online_processor(params)
+                transcript = self.transcripts.get(request.session_hash) if request is not None else None
+                if transcript is not None:
+                    transcript.clear()
+                stream = MicStream(online_model, args, transcript=transcript)
+                self.hold_session_models(stream)
+
+            sampling_rate, audio = mic_chunk
+            outputs = stream.feed(sampling_rate, audio)
+            return [stream, "".join(o[2] for o in outputs)]
+        except NotImplementedError as e:
+            # every later update would fail the same way, show it instead of an empty transcript
+            raise gr.Error(f"Streaming from the microphone is not available: {e}. "
+                           f"Start the app with --whisper_type faster-whisper to use it.")
+        except Exception as e:
+            print(f"Error transcribing microphone stream: {e}")
+            return [stream, ""]
 
-            print(transcribed_segments)
-            
-            subtitle, result_file_path = self.generate_and_write_file(
-                file_name="Mic",
-                transcribed_segments=transcribed_segments,
-                add_timestamp=True,
-                file_format=file_format,
-                output_dir=self.output_dir
-            )
+    def finish_mic_streaming(self,
+                             stream: Optional[MicStream],
+                             ) -> list:
+        """
+        Flush the uncommitted text when the streaming recording stops
 
-            result_str = f"Done in {self.format_time(time_for_task)}! Subtitle file is in the outputs folder.\n\n{subtitle}"
-            return [stream, result_str]
+        Parameters
+        ----------
+        stream: MicStream
+            State of the session from gr.State()
+
+        Returns
+        ----------
+        stream:
+            None, the next recording starts a new session
+        result_str:
+            Text committed at the end to return to gr.Textbox()
+        """
+        if stream is None:
+            return [None, ""]
+        try:
+            outputs = stream.finish()
+            return [None, "".join(o[2] for o in outputs)]
         except Exception as e:
-            print(f"Error transcribing file: {e}")
+            print(f"Error finishing microphone stream: {e}")
+            return [None, ""]
         finally:
+            if stream.models_held is not None:
+                stream.models_held()
             self.release_cuda_memory()
-            self.remove_input_files([mic_audio])
 
     def transcribe_youtube(self,
                            youtube_link: str,
@@ -404,6 +614,28 @@ class WhisperBase(ABC):
             except Exception as cleanup_error:
                 pass
 
+    def current_transcript(self, request: gr.Request = None) -> str:
+        """
+        SRT of the segments committed so far by online inference in the user's session.
+        Gradio polls it to show the real-time transcription.
+        """
+        if request is None:
+            return ""
+        return self.transcripts.get(request.session_hash).srt()
+
+    def release_transcript(self, request: gr.Request = None):
+        """Drops the real-time transcript of a session when the user leaves."""
+        if request is not None:
+            self.transcripts.pop(request.session_hash)
+
+    @staticmethod
+    def language_code(lang: str) -> Optional[str]:
+        """Whisper language code of the language name from the UI, None for automatic detection."""
+        if lang == "Automatic Detection":
+            return None
+        language_code_dict = {value: key for key, value in whisper.tokenizer.LANGUAGES.items()}
+        return language_code_dict[lang]
+
     @staticmethod
     def generate_and_write_file(file_name: str,
                                 transcribed_segments: list,
@@ -1,35 +1,18 @@
 import sys
 import time 
+import threading
 import numpy as np
-from functools import lru_cache
+from collections import OrderedDict
 import librosa
+import soundfile as sf
+import audioread
 from dataclasses import dataclass
+from typing import Optional
 
-# FIXME:FOR TESTING
-final_result = []
-
-
-def timeformat_srt(time):
-    hours = time // 3600
-    minutes = (time - hours * 3600) // 60
-    seconds = time - hours * 3600 - minutes * 60
-    milliseconds = (time - int(time)) * 1000
-    return f"{int(hours):02d}:{int(minutes):02d}:{int(seconds):02d},{int(milliseconds):03d}"
-
-def current_result():
-    def inner():
-        output = ""
-        for i, segment in enumerate(final_result):
-            try:
-                output += f"{i + 1}\n"
-                output += f"{timeformat_srt(segment['start'])} --> {timeformat_srt(segment['end'])}\n"
-                if segment['text'].startswith(' '):
-                    segment['text'] = segment['text'][1:]
-                output += f"{segment['text']}\n\n"
-            except Exception as e:
-                print(f"Error in current_result: {current_result}")
-        return output
-    return inner
+from modules.whisper.online_buffers import AudioRingBuffer, WordDeque
+from modules.whisper.sentence_splitter import create_tokenizer
+from modules.utils.audio_manager import DecodedAudio
+from modules.whisper.audio_ingest import StreamingResampler
 
 # TODO: we need a better way to handle the default args
 @dataclass
@@ -37,6 +20,12 @@ class default_args:
     start_at: float = 0.0 # Start processing at this time in seconds. Default is 0.
     min_chunk_size: float = 1.0 # Minimum audio chunk size in seconds. It waits up to this time to do processing. If the processing takes shorter time, it waits, otherwise it processes the whole segment that was received by this time.
     buffer_trimming_sec: float = 15.0 # help='Buffer trimming threshold in seconds. If the buffer is longer than this, it is trimmed. Default is 15 seconds.'
+    buffer_trimming: str = "segment" # "segment" or "sentence": where the buffer is trimmed, at the end of a completed Whisper segment or of a committed sentence.
+    agreement: int = 2 # LocalAgreement-n: number of consecutive hypotheses that must agree on a word to commit it.
+    max_uncommitted_sec: Optional[float] = None # Words that end this long before the end of the audio buffer are committed without agreement. Disabled if None.
+    target_latency: float = 2.0 # Latency in seconds that AdaptiveChunkController aims for: chunk size + decoding time of the iteration.
+    adaptive_chunk: bool = False # Adapt the chunk size of the online inference of the app to target_latency. min_chunk_size is fixed if False.
+    cascade_model: Optional[str] = None # Small model (e.g. "base") that drives the streaming iterations, while the committed text is re-decoded by the main model. Disabled if None.
     sampling_rate: int = 16000
     
 default_args_instance = default_args()
@@ -72,33 +61,215 @@ def output_transcript(o, start, now=None):
         pass
         
 
-def online_inference(audio_file, online_model, args):
-    
-    # sampling rate for the audio file
-    SAMPLING_RATE = default_args_instance.sampling_rate
+class WallClock:
+    """Real time clock of online_inference, it waits for the audio to "arrive"."""
+
+    def __init__(self, start_at=0.0):
+        self.start_time = time.time() - start_at
+
+    def now(self):
+        return time.time() - self.start_time
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def elapse(self, seconds):
+        # time spent computing has already passed
+        pass
+
+
+class SimulatedClock:
+    """Virtual clock of the replay mode of online_inference.
+    Waiting returns at once and only the measured computation time advances the clock, so a
+    recording is processed as fast as possible, but with the same chunks and emission times
+    as in real time."""
+
+    def __init__(self, start_at=0.0):
+        self.t = start_at
+
+    def now(self):
+        return self.t
+
+    def sleep(self, seconds):
+        self.t += seconds
+
+    def elapse(self, seconds):
+        self.t += seconds
+
+
+class ReplayStats:
+    """Collects the latency and stability metrics of one online_inference run"""
+
+    def __init__(self):
+        self.commit_latencies = [] # emission time - end of the commited text, in seconds
+        self.compute_time = 0.0
+        self.duration = 0.0
+        self.tail_words = 0 # uncommited words shown after each iteration
+        self.revised_words = 0 # of them, the words that changed in the next iteration
+        self.last_tail = []
+
+    def record_iteration(self, emission_time, output, commited, tail, compute_time):
+        """output: the result of process_iter, emitted at emission_time
+        commited, tail: the words commited in this iteration and the uncommited rest"""
+        self.compute_time += compute_time
+        if output[0] is not None:
+            self.commit_latencies.append(emission_time - output[1])
+        # a word of the previous tail is stable if it is at the same place in the new hypothesis
+        hypothesis = [w for _,_,w in commited] + [w for _,_,w in tail]
+        for i, w in enumerate(self.last_tail):
+            if i >= len(hypothesis) or hypothesis[i] != w:
+                self.revised_words += len(self.last_tail) - i
+                break
+        self.tail_words += len(self.last_tail)
+        self.last_tail = [w for _,_,w in tail]
+
+    def report(self, **extra):
+        latencies = np.array(self.commit_latencies)
+        return dict(
+            extra,
+            duration=self.duration,
+            rtf=self.compute_time / self.duration if self.duration else None,
+            commits=len(latencies),
+            mean_latency=float(latencies.mean()) if len(latencies) else None,
+            p95_latency=float(np.percentile(latencies, 95)) if len(latencies) else None,
+            stability=1 - self.revised_words / self.tail_words if self.tail_words else None,
+        )
+
+
+class PartialEmitter:
+    """Decides which partial hypotheses of one stream are sent to the client.
+
+    A partial is the uncommitted tail after an iteration (OnlineASRProcessor.partial),
+    and it replaces the previously sent one. It's sent only if its text has changed,
+    and at most once per min_interval seconds. After a commit it's always sent, even
+    if empty, because the client's partial may contain the text that has just been
+    committed.
+    """
+
+    def __init__(self, min_interval=0.3):
+        self.min_interval = min_interval
+        self.last_text = ""
+        self.last_time = None
+
+    def update(self, partial, now, committed=False):
+        """partial: (start, end, "text") or (None, None, "")
+        committed: whether the iteration has committed text
+        Returns: partial if it should be sent, otherwise None
+        """
+        if not committed:
+            if partial[2] == self.last_text:
+                return None
+            if self.last_time is not None and now - self.last_time < self.min_interval:
+                return None
+        self.last_text = partial[2]
+        self.last_time = now
+        return partial
+
+
+class AdaptiveChunkController:
+    """Chooses the chunk size of the online loop from the measured decoding time.
+
+    The latency of an iteration is roughly the chunk size (waiting for the audio)
+    plus the decoding time, so the chunk is set to target_latency minus the
+    expected decoding time. Each iteration must also consume at least as much
+    audio as it takes to decode it, otherwise the backlog grows without bound:
+    the chunk is never smaller than headroom x the expected decoding time, even if
+    that exceeds the target. The expected decoding time is an EWMA of the
+    measured ones.
+    """
+
+    def __init__(self, min_chunk=1.0, target_latency=2.0, lower=0.2, upper=5.0, alpha=0.3, headroom=1.2):
+        self.min_chunk = min_chunk # current chunk size in seconds
+        self.target_latency = target_latency
+        self.lower = lower
+        self.upper = upper
+        self.alpha = alpha
+        self.headroom = headroom
+        self.decode_time = None # EWMA of the decoding time of an iteration, in seconds
+        self.decode_rtf = None # EWMA of decoding time / length of the decoded buffer
+        self.chunks = [] # chosen chunk sizes
+        self.overloaded = 0 # iterations that took longer than their chunk
+
+    def ewma(self, value, sample):
+        return sample if value is None else self.alpha*sample + (1-self.alpha)*value
+
+    def update(self, decode_time, buffer_sec):
+        """decode_time: time spent on the last iteration, buffer_sec: length of the audio buffer it decoded
+        Returns: the chunk size for the next iteration"""
+        if decode_time > self.min_chunk:
+            self.overloaded += 1
+        self.decode_time = self.ewma(self.decode_time, decode_time)
+        if buffer_sec > 0:
+            self.decode_rtf = self.ewma(self.decode_rtf, decode_time/buffer_sec)
+        chunk = max(self.target_latency - self.decode_time, self.headroom*self.decode_time)
+        self.min_chunk = min(max(chunk, self.lower), self.upper)
+        self.chunks.append(self.min_chunk)
+        return self.min_chunk
+
+    def metrics(self):
+        chunks = np.array(self.chunks)
+        return dict(
+            min_chunk=self.min_chunk,
+            target_latency=self.target_latency,
+            decode_time=self.decode_time,
+            decode_rtf=self.decode_rtf,
+            mean_chunk=float(chunks.mean()) if len(chunks) else None,
+            max_chunk=float(chunks.max()) if len(chunks) else None,
+            overloaded_iterations=self.overloaded,
+        )
+
+
+def online_inference(audio_file, online_model, args, replay=False, min_chunk=None, stats=None, transcript=None, chunk_controller=None):
+    """Simulates streaming of audio_file (a path, or a DecodedAudio that is read from memory) into online_model.
+    replay: if True, the audio is fed back-to-back on a SimulatedClock instead of in real time
+    min_chunk: minimum audio chunk size in seconds, default_args.min_chunk_size by default
+    chunk_controller: an AdaptiveChunkController that sets min_chunk after every iteration
+    stats: a ReplayStats that records the commit latencies, the real time factor and the stability
+    transcript: a SessionTranscript of the user's session that the commited segments are appended to
+    """
     
     # duration of the audio file
+    if isinstance(audio_file, DecodedAudio):
+        print("Audio duration is %2.2f seconds" % audio_file.duration)
+        return stream_audio_file(audio_file, online_model, args, audio_file.duration, replay, min_chunk, stats, transcript, chunk_controller)
+
     try:
-        duration = len(load_audio(audio_file)) / SAMPLING_RATE
+        duration = audio_reader.duration(audio_file)
         print("Audio duration is %2.2f seconds" % duration)
     except Exception as e:
         print(f"Error in loading audio file: {e}")
         return None
+
+    try:
+        return stream_audio_file(audio_file, online_model, args, duration, replay, min_chunk, stats, transcript, chunk_controller)
+    finally:
+        audio_reader.evict(audio_file)
+
+
+def stream_audio_file(audio_file, online_model, args, duration, replay, min_chunk, stats, transcript, chunk_controller):
+    # the loop of online_inference
+    # sampling rate for the audio file
+    SAMPLING_RATE = default_args_instance.sampling_rate
     
-    min_chunk = default_args_instance.min_chunk_size # Minimum audio chunk size in seconds. It waits up to this time to do processing. If the processing takes shorter time, it waits, otherwise it processes the whole segment that was received by this time.
+    if min_chunk is None:
+        min_chunk = default_args_instance.min_chunk_size # Minimum audio chunk size in seconds. It waits up to this time to do processing. If the processing takes shorter time, it waits, otherwise it processes the whole segment that was received by this time.
     
     start = default_args_instance.start_at # start time of the processing in audio file
-    start_time = time.time() - start # start time of the processing in real time
+    clock = SimulatedClock(start) if replay else WallClock(start) # time of the processing, relative to the audio
     end = 0
+    if stats is not None:
+        stats.duration = duration - start
     
     while True:        
-        now = time.time() - start_time
+        if chunk_controller is not None:
+            min_chunk = chunk_controller.min_chunk
+        now = clock.now()
         if now < end + min_chunk: # wait for the min_chunk time
-            time.sleep(min_chunk + end - now)
+            clock.sleep(min_chunk + end - now)
 
         # loading the audio chunk
         try:
-            end = time.time() - start_time
+            end = min(clock.now(), duration)
             audio_chunk = load_audio_chunk(audio_file, start, end)
             print(f"Loaded audio chunk from {start:.2f} to {end:.2f}.")
             start = end
@@ -111,154 +282,446 @@ def online_inference(audio_file, online_model, args):
 
         # processing the iteration
         try:
+            n_commited = len(online_model.commited)
+            buffer_sec = len(online_model.audio_buffer)/SAMPLING_RATE
+            compute_start = time.perf_counter()
             output = online_model.process_iter(args)
+            compute_time = time.perf_counter() - compute_start
+            clock.elapse(compute_time)
+            if chunk_controller is not None:
+                chunk_controller.update(compute_time, buffer_sec)
+                print(f"## Chunk size {chunk_controller.min_chunk:.2f} s, decoding took {compute_time:.2f} s for {buffer_sec:.2f} s of audio")
         except Exception as e:
             print(f"Error in processing iteration: {e}")
             return None
         else:
             try:
-                output_transcript(output, start_time)
+                output_transcript(output, None, clock.now())
+                if stats is not None:
+                    stats.record_iteration(clock.now(), output, online_model.commited[n_commited:], online_model.transcript_buffer.complete(), compute_time)
                 if output[2]:
                     online_model.final_results.append(output)
-                    # FIXIME
-                    temp = {
-                        "start": output[0],
-                        "end": output[1],
-                        "text": output[2]
-                    }
-                    final_result.append(temp)
+                    if transcript is not None:
+                        transcript.append(*output)
             except Exception as e:
                 print(f"Error in outputting transcript: {e}")
                 return None
 
-        now = time.time() - start_time
+        now = clock.now()
         print(f"## Last processed {end:.2f} s, now is {now:.2f}, the latency is {now - end:.2f}")
 
         if end >= duration:
             break
 
     o = online_model.finish()
-    output_transcript(o, start_time, now)
+    output_transcript(o, None, now)
 
     # result = online_model.commited.copy() 
     # result.extend(online_model.transcript_buffer.complete())
 
     if o[2]:
         online_model.final_results.extend([o])
-        
-        temp = {
-            "start": o[0],
-            "end": o[1],
-            "text": o[2]
-        }
-        final_result.append(temp)
+        if transcript is not None:
+            transcript.append(*o)
 
     return online_model.final_results, duration
 
-@lru_cache
-def load_audio(fname):
-    try:
-        a, _ = librosa.load(fname, sr=16000, dtype=np.float32)
-    except Exception as e:
-        print(f"Error in loading audio file: {e}")
-    return a
+class BlockDecoder:
+    """Decodes one file to consecutive blocks of block_samples samples at sampling_rate.
+
+    The file is resampled as one stream by a StreamingResampler, so there is no
+    discontinuity at the edges of the blocks. Formats that soundfile can seek in
+    (WAV, FLAC, OGG, ...) start at any block: the decoder seeks a little before it
+    and runs the resampler over those samples first, so the block is the same as
+    when the file is decoded from its start. Other formats (M4A, video, ...) are
+    decoded by audioread from the start of the file. The decoder keeps its
+    position, so a file read forward is decoded once, whatever its format.
+    """
+
+    def __init__(self, fname, sampling_rate, block_samples):
+        self.fname = fname
+        self.sampling_rate = sampling_rate
+        self.block_samples = block_samples
+        self.lock = threading.Lock()
+        self.file = None # soundfile.SoundFile, or the audioread file
+        self.index = None # the block that the next output samples start
+        try:
+            with sf.SoundFile(fname) as f:
+                self.seekable = f.seekable()
+                self.orig_rate = f.samplerate
+        except RuntimeError: # not a format of libsndfile
+            self.seekable = False
+            self.orig_rate = None
+
+    def start(self, index):
+        # (re)starts decoding at block index, from the start of the file if it can't seek
+        self.close()
+        if self.seekable:
+            self.file = sf.SoundFile(self.fname)
+        else:
+            self.file = audioread.audio_open(self.fname)
+            self.orig_rate = self.file.samplerate
+            self.packets = self.file.read_data()
+            self.remainder = b"" # bytes of a frame split between two packets
+            index = 0
+        self.resampler = StreamingResampler(self.orig_rate, self.sampling_rate)
+        up, down = self.resampler.up, self.resampler.down
+        first = index * self.block_samples # the first output sample of the block
+        # a multiple of down, so the output samples from there fall on those of the whole file
+        frame = max(0, ((first * down // up - self.resampler.taps) // down) * down)
+        if frame:
+            self.file.seek(frame)
+        self.skip = first - frame // down * up # output samples before the block
+        self.output = [np.zeros(0, dtype=np.float32)]
+        self.output_samples = 0
+        self.ended = False
+        self.index = index
+
+    def read_input(self):
+        # the next mono samples at the rate of the file, None at its end
+        if self.seekable:
+            data = self.file.read(self.orig_rate, dtype="float32", always_2d=True)
+            return data.mean(axis=1) if len(data) else None
+        frame_bytes = 2 * self.file.channels
+        for packet in self.packets:
+            data = self.remainder + packet
+            whole = len(data) - len(data) % frame_bytes
+            self.remainder = data[whole:]
+            if whole:
+                samples = np.frombuffer(data[:whole], dtype="<i2").astype(np.float32) / 32768
+                return samples.reshape(-1, self.file.channels).mean(axis=1)
+        return None
+
+    def decode(self, index):
+        """
+        Decodes up to block index. Returns the (index, samples) of the blocks it decoded on the way,
+        the last one is block index, empty if the file ends before it.
+        """
+        if self.index is None or index < self.index or (self.seekable and index > self.index):
+            self.start(index)
+        blocks = []
+        while self.index <= index:
+            while self.output_samples < self.skip + self.block_samples and not self.ended:
+                samples = self.read_input()
+                if samples is None:
+                    self.ended = True
+                    out = self.resampler.flush()
+                    self.close()
+                else:
+                    out = self.resampler.process(samples)
+                self.output.append(out)
+                self.output_samples += len(out)
+            output = np.concatenate(self.output)
+            block = output[self.skip:self.skip + self.block_samples]
+            rest = output[self.skip + self.block_samples:]
+            self.output = [rest]
+            self.output_samples = len(rest)
+            self.skip = 0
+            blocks.append((self.index, block))
+            self.index += 1
+        return blocks
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class AudioChunkReader:
+    """Decodes audio files lazily, by time range.
+
+    A file is decoded in blocks of block_sec seconds by a BlockDecoder when a
+    chunk in them is first read. At most max_blocks decoded blocks are kept, the
+    least recently used one is dropped first, and evict() drops the blocks and the
+    decoder of a file whose session has ended, so memory stays bounded however
+    many files are streamed.
+    """
+
+    def __init__(self, sampling_rate=16000, block_sec=30.0, max_blocks=16):
+        self.sampling_rate = sampling_rate
+        self.block_sec = block_sec
+        self.max_blocks = max_blocks
+        self.blocks = OrderedDict() # (fname, block index) -> decoded samples
+        self.decoders = {} # fname -> BlockDecoder
+        self.durations = {}
+        self.lock = threading.Lock()
+
+    def duration(self, fname):
+        """duration of the file in seconds, without decoding it"""
+        with self.lock:
+            if fname not in self.durations:
+                self.durations[fname] = librosa.get_duration(path=fname)
+            return self.durations[fname]
+
+    def cached(self, key):
+        with self.lock:
+            if key in self.blocks:
+                self.blocks.move_to_end(key)
+                return self.blocks[key]
+        return None
+
+    def block(self, fname, index):
+        key = (fname, index)
+        a = self.cached(key)
+        if a is not None:
+            return a
+        with self.lock:
+            if fname not in self.decoders:
+                self.decoders[fname] = BlockDecoder(fname, self.sampling_rate, int(self.block_sec*self.sampling_rate))
+            decoder = self.decoders[fname]
+        with decoder.lock:
+            a = self.cached(key) # decoded by another session meanwhile
+            if a is not None:
+                return a
+            blocks = decoder.decode(index)
+        with self.lock:
+            for i, samples in blocks:
+                self.blocks[(fname, i)] = samples
+                self.blocks.move_to_end((fname, i))
+            while len(self.blocks) > self.max_blocks:
+                self.blocks.popitem(last=False)
+        return blocks[-1][1]
+
+    def read(self, fname, start, end):
+        """samples of fname from start to end seconds"""
+        start_s = int(start*self.sampling_rate)
+        end_s = int(end*self.sampling_rate)
+        block_samples = int(self.block_sec*self.sampling_rate)
+        parts = []
+        for index in range(start_s // block_samples, (max(end_s, start_s+1) - 1) // block_samples + 1):
+            block = self.block(fname, index)
+            offset = index*block_samples
+            parts.append(block[max(start_s-offset, 0):max(end_s-offset, 0)])
+        if not parts:
+            return np.zeros(0, dtype=np.float32)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def evict(self, fname):
+        """drops everything decoded from fname, call it when its session ends"""
+        with self.lock:
+            for key in [key for key in self.blocks if key[0] == fname]:
+                del self.blocks[key]
+            self.durations.pop(fname, None)
+            decoder = self.decoders.pop(fname, None)
+        if decoder is not None:
+            with decoder.lock:
+                decoder.close()
+
+
+audio_reader = AudioChunkReader(sampling_rate=default_args_instance.sampling_rate)
 
 def load_audio_chunk(fname, start, end):
-    audio = load_audio(fname)
-    start_s = int(start*16000)
-    end_s = int(end*16000)
-    return audio[start_s:end_s]
+    if isinstance(fname, DecodedAudio):
+        return fname.read(start, end)
+    return audio_reader.read(fname, start, end)
 
-class HypothesisBuffer:
+class CommitStats:
+    """Commit delay and revisions of every committed word, collected by HypothesisBuffer"""
 
     def __init__(self):
-        self.commited_in_buffer = [] # 代表已确认并稳定的文本片段，图中黄色高亮部分
-        self.buffer = [] # 对应Update N-1中黑框的内容 
-        self.new = [] # 对应Update N中的黑框内容 
+        self.delays = [] # end of the audio buffer at the commit - end of the word, in seconds
+        self.revisions = [] # how many times the word at this position changed before it was committed
+        self.forced = 0 # words committed by max_uncommitted_sec instead of agreement
+
+    def record(self, delays, revisions, forced):
+        self.delays.extend(delays)
+        self.revisions.extend(revisions)
+        self.forced += forced
+
+    def report(self):
+        delays = np.array(self.delays)
+        revisions = np.array(self.revisions)
+        return dict(
+            committed_words=len(revisions),
+            mean_commit_delay=float(delays.mean()) if len(delays) else None,
+            p95_commit_delay=float(np.percentile(delays, 95)) if len(delays) else None,
+            revision_rate=float(revisions.mean()) if len(revisions) else None,
+            revised_words=int(np.count_nonzero(revisions)),
+            forced_commits=self.forced,
+        )
+
+
+class HypothesisBuffer:
+
+    def __init__(self, agreement=2, max_uncommitted_sec=None, stats=None):
+        """agreement: n of LocalAgreement-n, a word is committed when the last n hypotheses agree on it
+        max_uncommitted_sec: words that end this long before the end of the audio are committed even without agreement
+        stats: CommitStats that records the commit delay and the revisions of the committed words
+        """
+        self.agreement = agreement
+        self.max_uncommitted_sec = max_uncommitted_sec
+        self.stats = stats
+        self.commited_in_buffer = WordDeque() # 代表已确认并稳定的文本片段，图中黄色高亮部分
+        self.buffer = WordDeque() # 对应Update N-1中黑框的内容 
+        self.new = WordDeque() # 对应Update N中的黑框内容 
+        self.history = [] # the uncommitted rest of the last agreement-1 hypotheses, the latest is self.buffer
+        self.revisions = np.zeros(0, dtype=np.int32) # revisions of the words of self.buffer
 
         self.last_commited_time = 0 # 对应于图中蓝色垂直线
         self.last_commited_word = None # 对应于图中的绿色下划线的最后一个确认单词
 
+        # words are compared by their token id, the index of the word in self.vocab_words
+        self.vocab = {}
+        self.vocab_words = []
+
+    def token_ids(self, words):
+        ids = np.empty(len(words), dtype=np.int32)
+        for i, w in enumerate(words):
+            token_id = self.vocab.get(w)
+            if token_id is None:
+                token_id = self.vocab[w] = len(self.vocab_words)
+                self.vocab_words.append(w)
+            ids[i] = token_id
+        return ids
+
+    def to_words(self, words, n=None):
+        # converts the first n words of a WordDeque to [(start, end, "word"), ...]
+        n = len(words) if n is None else n
+        return [(a, b, self.vocab_words[t]) for a, b, t in zip(words.starts[:n].tolist(), words.ends[:n].tolist(), words.ids[:n].tolist())]
+
     # 将新的片段插入到缓冲区中，并检测和去除在已确认的输出与新的片段之间的重复部分。
     def insert(self, new, offset):
         # compare self.commited_in_buffer and new. 
         # It inserts only the words in new that extend the commited_in_buffer, 
         #   it means they are roughly behind last_commited_time and new in content
         # the new tail is added to self.new
-        
-        new = [(a+offset,b+offset,t) for a,b,t in new]
-        self.new = [(a,b,t) for a,b,t in new if a > self.last_commited_time-0.1]
+
+        self.new.clear()
+        if not new:
+            return
+        starts = np.fromiter((a for a,_,_ in new), dtype=np.float64, count=len(new)) + offset
+        ends = np.fromiter((b for _,b,_ in new), dtype=np.float64, count=len(new)) + offset
+        ids = self.token_ids([t for _,_,t in new])
+        keep = starts > self.last_commited_time-0.1
+        self.new.extend(starts[keep], ends[keep], ids[keep])
 
         if len(self.new) >= 1:
-            a,b,t = self.new[0]
-            if abs(a - self.last_commited_time) < 1:
-                if self.commited_in_buffer:
+            if abs(self.new.starts[0] - self.last_commited_time) < 1:
+                if len(self.commited_in_buffer):
                     # it's going to search for 1, 2, ..., 5 consecutive words (n-grams) that are identical in commited and new. If they are, they're dropped.
-                    cn = len(self.commited_in_buffer)
-                    nn = len(self.new)
-                    for i in range(1,min(min(cn,nn),5)+1):  # 5 is the maximum 
-                        c = " ".join([self.commited_in_buffer[-j][2] for j in range(1,i+1)][::-1])
-                        tail = " ".join(self.new[j-1][2] for j in range(1,i+1))
-                        if c == tail:
-                            words = []
-                            for j in range(i):
-                                words.append(repr(self.new.pop(0)))
-                            words_msg = " ".join(words)
+                    commited_ids = self.commited_in_buffer.ids
+                    new_ids = self.new.ids
+                    for i in range(1,min(len(commited_ids),len(new_ids),5)+1):  # 5 is the maximum 
+                        if np.array_equal(commited_ids[-i:], new_ids[:i]):
+                            words_msg = " ".join(repr(w) for w in self.to_words(self.new, i))
+                            self.new.popleft(i)
                             print(f"removing last {i} words: {words_msg}")
                             break
 
     # 找到连续插入中稳定且一致的部分，将这些部分标记为已确认的输出。
-    def flush(self):
-        # returns commited chunk = the longest common prefix of 2 last inserts. 
-
-        commit = []
-        while self.new:
-            na, nb, nt = self.new[0]
-
-            if len(self.buffer) == 0:
-                break
-            
-            # 比较 self.new 的第一个单词与 self.buffer 的第一个单词
-            if nt == self.buffer[0][2]:
-                commit.append((na,nb,nt))
-                self.last_commited_word = nt
-                self.last_commited_time = nb
-                self.buffer.pop(0)
-                self.new.pop(0)
-            else:
-                break
+    def flush(self, now=None):
+        # returns commited chunk = the longest common prefix of the last `agreement` inserts (LocalAgreement-n),
+        # followed by the words that end more than max_uncommitted_sec before `now`, the end of the audio buffer.
+
+        # 比较 self.new 与 self.buffer 的公共前缀
+        def common_prefix(a, b):
+            n = min(len(a), len(b))
+            mismatch = np.flatnonzero(a.ids[:n] != b.ids[:n])
+            return int(mismatch[0]) if len(mismatch) else n
+
+        k = len(self.new) if len(self.history) >= self.agreement - 1 else 0
+        for h in self.history[len(self.history) - self.agreement + 1:]:
+            k = min(k, common_prefix(self.new, h))
+
+        forced = 0
+        if self.max_uncommitted_sec is not None and now is not None:
+            recent = np.flatnonzero(self.new.ends[k:] > now - self.max_uncommitted_sec)
+            forced = int(recent[0]) if len(recent) else len(self.new) - k
+        c = k + forced
+
+        # a word is revised when the previous hypothesis had a different word at its position
+        m = common_prefix(self.new, self.buffer)
+        r = min(len(self.new), len(self.buffer))
+        revisions = np.zeros(len(self.new), dtype=np.int32)
+        revisions[:r] = self.revisions[:r]
+        revisions[m:r] += 1
+
+        commit = self.to_words(self.new, c)
+        if c:
+            self.last_commited_word = commit[-1][2]
+            self.last_commited_time = commit[-1][1]
+            if self.stats is not None:
+                delays = (now - self.new.ends[:c]).tolist() if now is not None else []
+                self.stats.record(delays, revisions[:c].tolist(), forced)
+            self.commited_in_buffer.extend(self.new.starts[:c], self.new.ends[:c], self.new.ids[:c])
+            self.new.popleft(c)
+            for h in self.history:
+                h.popleft(min(c, len(h)))
+        self.revisions = revisions[c:]
+
+        self.history.append(self.new)
         self.buffer = self.new
-        self.new = []
-        self.commited_in_buffer.extend(commit)
+        recycled = self.history.pop(0) if len(self.history) > max(self.agreement - 1, 1) else None
+        if recycled is None or recycled is self.buffer:
+            recycled = WordDeque()
+        self.new = recycled
+        self.new.clear()
         return commit
 
     def pop_commited(self, time):
-        while self.commited_in_buffer and self.commited_in_buffer[0][1] <= time:
-            self.commited_in_buffer.pop(0)
+        later = np.flatnonzero(self.commited_in_buffer.ends > time)
+        self.commited_in_buffer.popleft(later[0] if len(later) else len(self.commited_in_buffer))
 
     def complete(self):
-        return self.buffer
+        return self.to_words(self.buffer)
+
+    def state(self):
+        """the committed words still in the buffer and the uncommitted hypotheses, as word lists. See load_state."""
+        return dict(
+            commited_in_buffer=self.to_words(self.commited_in_buffer),
+            history=[self.to_words(h) for h in self.history],
+            revisions=self.revisions.tolist(),
+            last_commited_time=self.last_commited_time,
+            last_commited_word=self.last_commited_word,
+        )
+
+    def load_state(self, state):
+        """restores the state returned by self.state()"""
+        def to_deque(words):
+            d = WordDeque(capacity=max(len(words), 64))
+            d.extend([a for a,_,_ in words], [b for _,b,_ in words], self.token_ids([t for _,_,t in words]))
+            return d
+
+        self.commited_in_buffer = to_deque(state["commited_in_buffer"])
+        self.history = [to_deque(words) for words in state["history"]]
+        self.buffer = self.history[-1] if self.history else WordDeque()
+        self.new = WordDeque()
+        self.revisions = np.array(state["revisions"], dtype=np.int32)
+        self.last_commited_time = state["last_commited_time"]
+        self.last_commited_word = state["last_commited_word"]
 
 class OnlineASRProcessor:
 
     SAMPLING_RATE = 16000
 
-    def __init__(self, asr, buffer_trimming_sec=15):
+    def __init__(self, asr, buffer_trimming_sec=15, buffer_trimming="segment", tokenizer=None, agreement=2, max_uncommitted_sec=None):
         """asr: WhisperASR object
-        tokenizer: sentence tokenizer object for the target language. Must have a method *split* that behaves like the one of MosesTokenizer. It can be None, if "segment" buffer trimming option is used, then tokenizer is not used at all.
-        ("segment", 15)
-        buffer_trimming: a pair of (option, seconds), where option is either "sentence" or "segment", and seconds is a number. Buffer is trimmed if it is longer than "seconds" threshold. Default is the most recommended option.
-        logfile: where to store the log. 
+        buffer_trimming_sec: Buffer is trimmed if it is longer than this threshold in seconds.
+        buffer_trimming: "segment" or "sentence". With "sentence", the buffer is trimmed at the end of the
+        last-but-one committed sentence, and at the end of a completed segment only when it's longer than 30 s.
+        tokenizer: sentence tokenizer object for the target language. Must have a method *split* that behaves like the one of MosesTokenizer.
+        sentence_splitter.RegexSentenceSplitter by default. It's not used with "segment" buffer trimming.
+        agreement: number of consecutive hypotheses that must agree on a word to commit it (LocalAgreement-n).
+        More agreeing hypotheses mean less revised text, but a longer delay.
+        max_uncommitted_sec: if set, words that end this many seconds before the end of the buffer are committed
+        even if the hypotheses haven't agreed on them yet.
         """
         self.asr = asr
-        self.init()
         self.buffer_trimming_sec = buffer_trimming_sec
+        self.buffer_trimming = buffer_trimming
+        if tokenizer is None and buffer_trimming == "sentence":
+            tokenizer = create_tokenizer()
+        self.tokenizer = tokenizer
+        self.agreement = agreement
+        self.max_uncommitted_sec = max_uncommitted_sec
+        self.commit_stats = CommitStats() # commit delay and revisions of the committed words, kept over init()
+        self.init()
         self.final_results = []
 
     def init(self, offset=None):
         """run this when starting or restarting processing"""
-        self.audio_buffer = np.array([],dtype=np.float32)
-        self.transcript_buffer = HypothesisBuffer()
+        self.audio_buffer = AudioRingBuffer(capacity=int(self.SAMPLING_RATE*self.buffer_trimming_sec*2))
+        self.transcript_buffer = HypothesisBuffer(self.agreement, self.max_uncommitted_sec, stats=self.commit_stats)
         self.buffer_time_offset = 0
         if offset is not None:
             self.buffer_time_offset = offset
@@ -266,7 +729,7 @@ class OnlineASRProcessor:
         self.commited = []
 
     def insert_audio_chunk(self, audio):
-        self.audio_buffer = np.append(self.audio_buffer, audio)
+        self.audio_buffer.append(audio)
 
     def prompt(self):
         """
@@ -307,17 +770,26 @@ class OnlineASRProcessor:
             return (None, None, "")
 
         try:
-            res, info = self.asr.transcribe(self.audio_buffer, initial_prompt=prompt, **args)
+            res, info = self.asr.transcribe(self.audio_buffer.view(), initial_prompt=prompt, **args)
             res = list(res)
 
         except Exception as e:
             print(f"Error during transcription: {e}")
             return (None, None, "")
 
+        return self.commit_iter(res)
+
+    def commit_iter(self, res):
+        """Second half of process_iter: commits the transcription `res` of the current audio buffer.
+        It is called directly by callers that transcribe the buffer themselves, e.g. the batched
+        decoding of several sessions (see batched_decoding.BatchedTranscriber).
+        Returns: the same format as self.process_iter()
+        """
         try:
             tsw = ts_words(res)
             self.transcript_buffer.insert(tsw, self.buffer_time_offset)
-            o = self.transcript_buffer.flush() # return commited chunk
+            buffer_end = self.buffer_time_offset + len(self.audio_buffer)/self.SAMPLING_RATE
+            o = self.transcript_buffer.flush(now=buffer_end) # return commited chunk
             self.commited.extend(o)
         except Exception as e:
             print(f"Error processing transcript buffer: {e}")
@@ -333,7 +805,13 @@ class OnlineASRProcessor:
             return (None, None, "")
 
 
-        if len(self.audio_buffer)/self.SAMPLING_RATE > self.buffer_trimming_sec:
+        if self.buffer_trimming == "sentence":
+            if len(self.audio_buffer)/self.SAMPLING_RATE > self.buffer_trimming_sec:
+                self.chunk_completed_sentence()
+            s = 30 # segment trimming only when the buffer is too long for Whisper
+        else:
+            s = self.buffer_trimming_sec
+        if len(self.audio_buffer)/self.SAMPLING_RATE > s:
             self.chunk_completed_segment(res)
             print("Chunked completed segment.")
 
@@ -343,6 +821,25 @@ class OnlineASRProcessor:
             print(f"Error returning final output: {e}")
             return (None, None, "")
     
+    def chunk_completed_sentence(self):
+        """trims the buffer at the end of the last-but-one committed sentence.
+        The last one may be incomplete, it's kept in the buffer."""
+        if self.commited == []:
+            return
+        try:
+            sents = self.words_to_sentences(self.commited)
+        except Exception as e:
+            print(f"Error in splitting sentences: {e}")
+            return
+        if len(sents) < 2:
+            print(f"--- not enough sentences to chunk")
+            return
+        chunk_at = sents[-2][1]
+        if chunk_at <= self.buffer_time_offset:
+            return
+        print(f"--- sentence chunked at {chunk_at:2.2f}")
+        self.chunk_at(chunk_at)
+
     def chunk_completed_segment(self, res):
         try:
             if self.commited == []: 
@@ -393,33 +890,32 @@ class OnlineASRProcessor:
         """
         self.transcript_buffer.pop_commited(time)
         cut_seconds = time - self.buffer_time_offset
-        self.audio_buffer = self.audio_buffer[int(cut_seconds*self.SAMPLING_RATE):]
+        self.audio_buffer.trim_front(int(cut_seconds*self.SAMPLING_RATE))
         self.buffer_time_offset = time
 
     def words_to_sentences(self, words):
         """Uses self.tokenizer for sentence segmentation of words.
         Returns: [(start,end,"sentence 1"),...]
         """
-        
-        cwords = [w for w in words]
-        t = " ".join(o[2] for o in cwords)
-        s = self.tokenizer.split(t)
+        # The sentences are mapped back to the words by counting non-space characters,
+        # so it works with or without spaces between the words (asr.sep).
+        text = self.asr.sep.join(w for _,_,w in words)
+        word_ends = np.cumsum([len("".join(w.split())) for _,_,w in words])
         out = []
-        while s:
-            start = None
-            end = None
-            sent = s.pop(0).strip()
-            fsent = sent
-            while cwords:
-                b,e,w = cwords.pop(0)
-                w = w.strip()
-                if start is None and sent.startswith(w):
-                    start = b
-                elif end is None and sent == w:
-                    end = e
-                    out.append((start,end,fsent))
-                    break
-                sent = sent[len(w):].strip()
+        i = 0
+        consumed = 0
+        for sent in self.tokenizer.split(text):
+            n = len("".join(sent.split()))
+            if n == 0:
+                continue
+            first = i
+            while i < len(words) and word_ends[i] < consumed + n:
+                i += 1
+            if i >= len(words):
+                break
+            out.append((words[first][0], words[i][1], sent.strip()))
+            consumed = word_ends[i]
+            i += 1
         return out
 
     def finish(self):
@@ -433,6 +929,42 @@ class OnlineASRProcessor:
         return f
 
 
+    def partial(self):
+        """The uncommitted tail of the current hypothesis. It may still change in the next iterations.
+        Returns: the same format as self.process_iter()
+        """
+        return self.to_flush(self.transcript_buffer.complete())
+
+    def state(self):
+        """Everything needed to resume processing after self.audio_buffer, as a JSON serializable dict.
+        The audio buffer itself is not included. See load_state and session_store.SessionStore.
+        """
+        return dict(
+            buffer_time_offset=self.buffer_time_offset,
+            commited=self.commited,
+            hypothesis=self.transcript_buffer.state(),
+        )
+
+    def state_audio(self):
+        """the audio that goes with self.state(), i.e. the audio buffer"""
+        return self.audio_buffer.view()
+
+    def load_state(self, state, audio):
+        """Restores the state returned by self.state(), with the audio buffer `audio`"""
+        self.init(offset=state["buffer_time_offset"])
+        self.audio_buffer.append(audio)
+        self.commited = [tuple(w) for w in state["commited"]]
+        self.transcript_buffer.load_state(state["hypothesis"])
+
+    def skip(self, seconds):
+        """Skips the next `seconds` of the stream, e.g. when audio is shed under load.
+        The current buffer is finished first, and processing restarts after the gap.
+        Returns: the output of self.finish()
+        """
+        o = self.finish()
+        self.init(offset=self.buffer_time_offset + seconds)
+        return o
+
     def to_flush(self, sents, sep=None, offset=0, ):
         # concatenates the timestamped words or sentences into one sequence that is flushed in one line
         # sents: [(start1, end1, "sentence1"), ...] or [] if empty
@@ -0,0 +1,576 @@
+#!/usr/bin/env python3
+"""Asyncio streaming server that serves many clients with one Whisper model.
+
+Every connection is a stream of 16 kHz mono PCM16 audio, either raw (legacy
+clients) or in AUDIO frames of the framed protocol (see frame_packet). It gets
+its own OnlineASRProcessor, but all sessions share a single
+faster_whisper.WhisperModel.
+Decoding runs in a small thread pool and is scheduled round-robin: a session
+that has at least `min_chunk` seconds of new audio is queued once, and after
+its iteration it goes to the back of the queue, so a busy session can't starve
+the others. With --batch_size, the sessions that are due at the same time are
+decoded together in one batched pass. With --vad, a streaming Silero VAD
+gates every session: silent audio is not decoded at all, and an utterance is
+finished after --vad_min_silence_ms of silence. With --adaptive_chunk, the
+chunk size of every session follows its measured waiting and decoding time to
+hold --target_latency. With --latency_budget, a session whose backlog exceeds
+the budget is degraded (greedy decoding, --cheap_model, shedding the oldest
+audio) until it catches up, see backpressure.LatencyBudget. With --checkpoint_dir, a
+session whose connection drops is saved, and a client that reconnects with its
+session id continues it (see session_store). With --cascade_model, the
+iterations and partials run on that small model, and the committed text is
+re-decoded by --model in the background (see cascade_online). Committed text is sent back as
+"beg end text" lines to legacy clients, like whisper_online_server, and as
+TRANSCRIPT frames to framed ones. Framed clients also get the uncommitted tail
+as partial events (committed=False), diffed and rate-limited by PartialEmitter.
+
+    python -m modules.whisper.whisper_online_async_server --model large-v3 --port 43007
+"""
+import argparse
+import asyncio
+import itertools
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from modules.whisper.whisper_online import OnlineASRProcessor, AdaptiveChunkController, PartialEmitter, default_args_instance
+from modules.whisper.vad_online import VADOnlineASRProcessor
+from modules.whisper.cascade_online import CascadeOnlineASRProcessor
+from modules.whisper.backpressure import LatencyBudget
+from modules.whisper.session_store import SessionStore, valid_session_id
+from modules.whisper.batched_decoding import BatchedTranscriber
+from modules.whisper.audio_ingest import PCM16Decoder
+from modules.whisper import frame_packet
+from modules.whisper.frame_packet import TranscriptEvent
+
+SAMPLING_RATE = 16000
+READ_SIZE = 65536
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    return float(np.percentile(values, q))
+
+
+class StreamSession:
+    """State of one client connection"""
+
+    def __init__(self, session_id, online_asr_proc, writer, chunk_controller=None, partial_interval=0.3, latency_budget=None):
+        self.session_id = session_id
+        self.online_asr_proc = online_asr_proc
+        self.asr = online_asr_proc.asr
+        self.writer = writer
+        self.latency_budget = latency_budget # LatencyBudget of the session, None to never degrade
+        self.partials = PartialEmitter(partial_interval) # partial hypotheses go to framed clients only
+        self.chunk_controller = chunk_controller # AdaptiveChunkController of the session, None for a fixed min_chunk
+        self.protocol_version = None # version of the framed protocol, None for legacy clients
+        self.key = None # session id sent in the hello of the client, see frame_packet
+        self.checkpoints = None # SessionStore that the session is saved to if the connection drops
+        self.ended = False # the client has sent END
+        self.stream_samples = 0 # samples of the session's stream taken for processing, over all its connections
+
+        self.pending = PCM16Decoder() # audio received but not given to the processor yet
+        self.pending_since = None # arrival time of the oldest pending audio
+
+        self.queued = False
+        self.closed = False
+        self.finished = asyncio.Event()
+
+        self.last_end = None
+        self.started_at = None
+        # per-iteration timings, in seconds. The latency of an iteration is the time from the
+        # arrival of the oldest audio it processed to sending its output.
+        self.queue_waits = []
+        self.decode_times = []
+        self.latencies = []
+
+    @property
+    def resumable(self):
+        # a session that closes before its END is saved instead of finished
+        return self.checkpoints is not None and not self.ended
+
+    def checkpoint(self, unsent):
+        self.checkpoints.save(self.key, self.online_asr_proc, self.stream_samples/SAMPLING_RATE,
+                              last_end=self.last_end, unsent=unsent)
+
+    @property
+    def pending_samples(self):
+        return len(self.pending)
+
+    def add_audio(self, raw_bytes):
+        if not raw_bytes:
+            return
+        now = time.time()
+        if self.started_at is None:
+            self.started_at = now
+        if self.pending_since is None:
+            self.pending_since = now
+        self.pending.feed(raw_bytes)
+
+    def take_audio(self):
+        # copied, because the decoder reuses its buffer while the iteration runs in the executor
+        audio = self.pending.take().copy()
+        self.stream_samples += len(audio)
+        since = self.pending_since
+        self.pending_since = None
+        return audio, since
+
+    def output_interval(self, o):
+        # same as whisper_online_server.ServerProcessor: succeeding [beg,end] intervals, in ms, don't overlap
+        beg, end = o[0]*1000, o[1]*1000
+        if self.last_end is not None:
+            beg = max(beg, self.last_end)
+        self.last_end = end
+        return beg, end
+
+    def encode_output(self, o):
+        # bytes to send for the output o, in the protocol of the client
+        if o[0] is None:
+            return None
+        beg, end = self.output_interval(o)
+        print(f"[{self.session_id}] %1.0f %1.0f %s" % (beg, end, o[2]), flush=True, file=sys.stderr)
+        if self.protocol_version is None:
+            return ("%1.0f %1.0f %s\n" % (beg, end, o[2])).encode("utf-8")
+        event = TranscriptEvent(start=beg/1000, end=end/1000, text=o[2], committed=True)
+        return frame_packet.encode_frame(frame_packet.TRANSCRIPT, event.to_payload())
+
+    def encode_partial(self, p, committed=False):
+        # bytes to send for the uncommitted tail p, or None if the client doesn't get it (now)
+        if self.protocol_version is None:
+            return None
+        p = self.partials.update(p, time.time(), committed=committed)
+        if p is None:
+            return None
+        last_end = self.last_end or 0
+        beg, end = (max(p[0]*1000, last_end), p[1]*1000) if p[0] is not None else (last_end, last_end)
+        event = TranscriptEvent(start=beg/1000, end=end/1000, text=p[2], committed=False)
+        return frame_packet.encode_frame(frame_packet.TRANSCRIPT, event.to_payload())
+
+    def latency_report(self):
+        return {
+            "session": self.session_id,
+            "iterations": len(self.decode_times),
+            "mean_queue_wait": float(np.mean(self.queue_waits)) if self.queue_waits else None,
+            "mean_decode_time": float(np.mean(self.decode_times)) if self.decode_times else None,
+            "mean_latency": float(np.mean(self.latencies)) if self.latencies else None,
+            "p95_latency": percentile(self.latencies, 95),
+            "adaptive_chunk": self.chunk_controller.metrics() if self.chunk_controller is not None else None,
+            "commits": self.online_asr_proc.commit_stats.report(),
+            "latency_budget": self.latency_budget.report() if self.latency_budget is not None else None,
+            "cascade": self.online_asr_proc.report() if isinstance(self.online_asr_proc, CascadeOnlineASRProcessor) else None,
+        }
+
+
+class FairScheduler:
+    """Round-robin scheduler of decoding iterations over the sessions that share one model.
+
+    With a `batcher` (see batched_decoding.BatchedTranscriber), a worker takes up to
+    `batcher.batch_size` sessions that are due at the same time and decodes their
+    buffers in batched passes, one per prompt.
+    """
+
+    def __init__(self, min_chunk, transcribe_args, workers=1, batcher=None):
+        self.min_chunk = min_chunk
+        self.transcribe_args = transcribe_args
+        self.workers = workers
+        self.batcher = batcher
+        self.batch_size = batcher.batch_size if batcher is not None else 1
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="whisper")
+        self.ready = asyncio.Queue()
+        self.tasks = []
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.executor.shutdown(wait=False)
+
+    def notify(self, session):
+        # queues the session once it has enough new audio, or when the client has closed the stream
+        if session.queued:
+            return
+        min_chunk = session.chunk_controller.min_chunk if session.chunk_controller is not None else self.min_chunk
+        if session.closed or session.pending_samples >= min_chunk*SAMPLING_RATE:
+            session.queued = True
+            self.ready.put_nowait((session, time.time()))
+
+    async def worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            jobs = [await self.ready.get()]
+            while len(jobs) < self.batch_size and not self.ready.empty():
+                jobs.append(self.ready.get_nowait())
+
+            started = time.time()
+            batch = []
+            for session, queued_at in jobs:
+                audio, since = session.take_audio()
+                session.queue_waits.append(started - queued_at)
+                skipped = 0.0
+                budget = session.latency_budget
+                if budget is not None:
+                    # all pending audio is always decoded at once here, so coalescing needs nothing more
+                    budget.update(started - since if since is not None else 0.0)
+                    audio, skipped = budget.shed(audio, SAMPLING_RATE)
+                buffer_sec = (len(session.online_asr_proc.audio_buffer) + len(audio))/SAMPLING_RATE
+                batch.append((session, audio, since, session.closed, buffer_sec, skipped))
+            try:
+                outputs = await loop.run_in_executor(self.executor, self.iterate, batch)
+            except Exception as e:
+                print(f"Error processing sessions {[job[0].session_id for job in batch]}: {e}", file=sys.stderr)
+                outputs = [([], None) for _ in batch]
+
+            now = time.time()
+            for (session, audio, since, finish, buffer_sec, skipped), (session_outputs, partial) in zip(batch, outputs):
+                session.decode_times.append(now - started)
+                if since is not None:
+                    session.latencies.append(now - since)
+                if session.chunk_controller is not None:
+                    # the time spent waiting for a worker delays the output like decoding does
+                    session.chunk_controller.update(session.queue_waits[-1] + session.decode_times[-1], buffer_sec)
+                if finish and session.resumable:
+                    # the connection is gone, the outputs are sent when the client resumes
+                    await loop.run_in_executor(self.executor, session.checkpoint, session_outputs)
+                else:
+                    await self.send(session, session_outputs, partial, committed=finish)
+
+                session.queued = False
+                if finish:
+                    session.finished.set()
+                else:
+                    self.notify(session)
+
+    def iterate(self, batch):
+        # runs in the executor; each session is processed by at most one worker at a time
+        # returns [(committed outputs, uncommitted tail or None), ...] for the sessions of the batch
+        outputs = [[] for _ in batch]
+        iterated = set()
+        decoded = []
+        for i, (session, audio, since, finish, buffer_sec, skipped) in enumerate(batch):
+            proc = session.online_asr_proc
+            if skipped:
+                outputs[i].append(proc.skip(skipped))
+            if not len(audio):
+                continue
+            proc.insert_audio_chunk(audio)
+            if isinstance(getattr(proc, "draft", proc), VADOnlineASRProcessor):
+                # the VAD decides if there is anything to decode. The ended utterances are
+                # decoded and finished alone, the speech after them is batched with the other sessions.
+                o = proc.ready_output(self.transcribe_args)
+                if o is not None:
+                    outputs[i].append(o)
+                    iterated.add(i)
+                if not proc.has_new_speech:
+                    continue
+            decoded.append(i)
+            iterated.add(i)
+
+        # sessions over their latency budget decode alone, with the cheap configuration
+        degraded = [i for i in decoded if self.degraded(batch[i][0])]
+        decoded = [i for i in decoded if i not in degraded]
+        for i in degraded:
+            session = batch[i][0]
+            session.online_asr_proc.asr = session.latency_budget.asr(session.asr)
+            outputs[i].append(session.online_asr_proc.process_iter(session.latency_budget.transcribe_args(self.transcribe_args)))
+            session.online_asr_proc.asr = session.asr
+
+        if self.batcher is not None and len(decoded) > 1:
+            procs = [batch[i][0].online_asr_proc for i in decoded]
+            results = self.batcher.transcribe_batch(
+                [proc.audio_buffer.view() for proc in procs],
+                self.transcribe_args,
+                prompts=[proc.prompt()[0] for proc in procs],
+            )
+            for i, proc, res in zip(decoded, procs, results):
+                outputs[i].append(proc.commit_iter(res))
+        else:
+            for i in decoded:
+                outputs[i].append(batch[i][0].online_asr_proc.process_iter(self.transcribe_args))
+
+        partials = [None for _ in batch]
+        for i, (session, audio, since, finish, buffer_sec, skipped) in enumerate(batch):
+            if finish and not session.resumable:
+                outputs[i].append(session.online_asr_proc.finish())
+                partials[i] = (None, None, "") # clears the partial of the client
+            elif i in iterated:
+                partials[i] = session.online_asr_proc.partial()
+        return list(zip(outputs, partials))
+
+    @staticmethod
+    def degraded(session):
+        return session.latency_budget is not None and session.latency_budget.level >= LatencyBudget.CHEAP
+
+    @staticmethod
+    async def send(session, outputs, partial=None, committed=False):
+        data = [session.encode_output(o) for o in outputs]
+        if partial is not None:
+            data.append(session.encode_partial(partial, committed=committed or any(o[2] for o in outputs)))
+        for d in data:
+            if d is None or session.writer.is_closing():
+                continue
+            session.writer.write(d)
+        try:
+            await session.writer.drain()
+        except ConnectionError:
+            print(f"[{session.session_id}] connection closed while sending", file=sys.stderr)
+
+
+class AsyncStreamingServer:
+
+    def __init__(self, asr, min_chunk, transcribe_args, buffer_trimming_sec=15, workers=1, batch_size=1, vad_options=None, target_latency=None,
+                 buffer_trimming="segment", agreement=2, max_uncommitted_sec=None, latency_budget=None, cheap_asr=None,
+                 checkpoint_dir=None, final_asr=None):
+        self.asr = asr
+        self.min_chunk = min_chunk
+        self.target_latency = target_latency # adapts the chunk size of every session to it if set
+        self.buffer_trimming_sec = buffer_trimming_sec
+        self.buffer_trimming = buffer_trimming
+        self.agreement = agreement
+        self.max_uncommitted_sec = max_uncommitted_sec
+        self.latency_budget = latency_budget # seconds of backlog before a session is degraded, None to never degrade
+        self.cheap_asr = cheap_asr # model used by degraded sessions, the main one if None
+        # interrupted sessions are saved there for a reconnect, see session_store
+        self.checkpoints = SessionStore(checkpoint_dir) if checkpoint_dir is not None else None
+        # with final_asr, asr is the small model of the cascade mode and final_asr re-decodes the committed text,
+        # one utterance at a time for all the sessions
+        self.final_asr = final_asr
+        self.cascade_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cascade") if final_asr is not None else None
+        if final_asr is not None and checkpoint_dir is not None:
+            raise ValueError("Sessions of the cascade mode can't be checkpointed")
+        self.vad_options = vad_options
+        self.vad = None
+        if vad_options is not None:
+            from modules.vad.silero_vad import SileroVAD
+            self.vad = SileroVAD()
+            self.vad.update_model()
+        batcher = BatchedTranscriber(asr, batch_size=batch_size) if batch_size > 1 else None
+        self.scheduler = FairScheduler(min_chunk, transcribe_args, workers=workers, batcher=batcher)
+        self.session_ids = itertools.count(1)
+        self.sessions = {}
+        self.reports = []
+
+    def make_processor(self):
+        online = OnlineASRProcessor(
+            self.asr,
+            buffer_trimming_sec=self.buffer_trimming_sec,
+            buffer_trimming=self.buffer_trimming,
+            agreement=self.agreement,
+            max_uncommitted_sec=self.max_uncommitted_sec,
+        )
+        if self.vad is not None:
+            online = VADOnlineASRProcessor(online, self.vad.streaming(self.vad_options))
+        if self.final_asr is not None:
+            online = CascadeOnlineASRProcessor(online, self.final_asr, self.scheduler.transcribe_args, executor=self.cascade_executor)
+        return online
+
+    async def handle_client(self, reader, writer):
+        session = StreamSession(
+            session_id=next(self.session_ids),
+            online_asr_proc=self.make_processor(),
+            writer=writer,
+            chunk_controller=AdaptiveChunkController(self.min_chunk, self.target_latency) if self.target_latency else None,
+        )
+        if self.latency_budget is not None:
+            session.latency_budget = LatencyBudget(self.latency_budget, cheap_asr=self.cheap_asr, name=session.session_id)
+        self.sessions[session.session_id] = session
+        print(f"[{session.session_id}] connected: {writer.get_extra_info('peername')}", file=sys.stderr)
+
+        try:
+            await self.receive_audio(session, reader, writer)
+        except (ConnectionError, frame_packet.ProtocolError) as e:
+            print(f"[{session.session_id}] connection error: {e}", file=sys.stderr)
+        finally:
+            session.pending.flush()
+            session.closed = True
+            self.scheduler.notify(session)
+            await session.finished.wait()
+            if session.checkpoints is not None and session.ended:
+                self.checkpoints.delete(session.key)
+            report = session.latency_report()
+            self.reports.append(report)
+            del self.sessions[session.session_id]
+            print(f"[{session.session_id}] closed, latency: {report}", file=sys.stderr)
+            writer.close()
+
+    async def receive_audio(self, session, reader, writer):
+        # a framed client starts with the handshake, anything else is legacy raw audio
+        try:
+            head = await reader.readexactly(len(frame_packet.MAGIC) + 1)
+        except asyncio.IncompleteReadError as e:
+            head = e.partial
+        if head[:len(frame_packet.MAGIC)] == frame_packet.MAGIC and len(head) == len(frame_packet.MAGIC) + 1:
+            session.protocol_version = frame_packet.accept_version(head[-1])
+            writer.write(frame_packet.handshake(session.protocol_version))
+            await writer.drain()
+            if session.protocol_version >= 2:
+                await self.start_session(session, frame_packet.parse_hello(await frame_packet.read_frame(reader)))
+            await self.receive_audio_frames(session, reader)
+            return
+
+        session.add_audio(head)
+        self.scheduler.notify(session)
+        while True:
+            data = await reader.read(READ_SIZE)
+            if not data:
+                break
+            session.add_audio(data)
+            self.scheduler.notify(session)
+
+    async def start_session(self, session, hello):
+        # answers the hello of the client, and restores its session if it has a checkpoint
+        audio_format = frame_packet.audio_format(hello)
+        if audio_format != frame_packet.DEFAULT_FORMAT:
+            # downmixed and resampled to 16 kHz mono as it arrives
+            session.pending = PCM16Decoder(sampling_rate=audio_format["sample_rate"], channels=audio_format["channels"])
+        requested = hello.get("session")
+        if requested is not None and not valid_session_id(requested):
+            raise frame_packet.ProtocolError(f"Invalid session id {requested!r}")
+        if requested is not None and any(s.key == requested for s in self.sessions.values()):
+            raise frame_packet.ProtocolError(f"Session {requested} is already connected")
+        session.key = requested or uuid.uuid4().hex
+        session.checkpoints = self.checkpoints
+        checkpoint = None
+        if requested is not None and self.checkpoints is not None:
+            checkpoint = self.checkpoints.load(requested)
+        if checkpoint is not None:
+            checkpoint.restore(session.online_asr_proc)
+            session.stream_samples = int(round(checkpoint.stream_sec*SAMPLING_RATE))
+            session.last_end = checkpoint.last_end
+            print(f"[{session.session_id}] resumed session {session.key} at {checkpoint.stream_sec:.2f} s", file=sys.stderr)
+        session.writer.write(frame_packet.session_message(session.key, session.stream_samples/SAMPLING_RATE, audio_format))
+        await self.scheduler.send(session, checkpoint.unsent if checkpoint is not None else [])
+
+    async def receive_audio_frames(self, session, reader):
+        while True:
+            frame = await frame_packet.read_frame(reader)
+            if frame is None:
+                break
+            frame_type, payload = frame
+            if frame_type == frame_packet.AUDIO:
+                session.add_audio(payload)
+                self.scheduler.notify(session)
+            elif frame_type == frame_packet.END:
+                session.ended = True
+                break
+            elif frame_type == frame_packet.CONTROL:
+                print(f"[{session.session_id}] control message: {frame_packet.decode_control(payload)}", file=sys.stderr)
+
+    async def serve(self, host, port):
+        self.scheduler.start()
+        server = await asyncio.start_server(self.handle_client, host, port)
+        print(f"Listening on {host}:{port}", file=sys.stderr)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.scheduler.stop()
+
+
+def transcribe_args_from(args):
+    return {
+        "language": args.lang,
+        "task": args.task,
+        "beam_size": args.beam_size,
+        "word_timestamps": True,
+        "condition_on_previous_text": True,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default='localhost')
+    parser.add_argument('--port', type=int, default=43007)
+    parser.add_argument('--model', type=str, default='large-v3', help='faster-whisper model size or path')
+    parser.add_argument('--model_dir', type=str, default=None, help='Download root of the faster-whisper models')
+    parser.add_argument('--device', type=str, default='auto')
+    parser.add_argument('--compute_type', type=str, default='default')
+    parser.add_argument('--lang', type=str, default=None, help='Source language code, e.g. ja. Detected if not set')
+    parser.add_argument('--task', type=str, default='transcribe', choices=['transcribe', 'translate'])
+    parser.add_argument('--beam_size', type=int, default=5)
+    parser.add_argument('--min_chunk_size', type=float, default=default_args_instance.min_chunk_size)
+    parser.add_argument('--buffer_trimming_sec', type=float, default=default_args_instance.buffer_trimming_sec)
+    parser.add_argument('--buffer_trimming', type=str, default=default_args_instance.buffer_trimming, choices=['segment', 'sentence'],
+                        help='Trim the audio buffer at the end of completed segments or of committed sentences')
+    parser.add_argument('--workers', type=int, default=1, help='Number of decoding iterations that may run at the same time')
+    parser.add_argument('--batch_size', type=int, default=1, help='Maximum number of sessions decoded in one batched pass')
+    parser.add_argument('--agreement', type=int, default=default_args_instance.agreement,
+                        help='Number of consecutive hypotheses that must agree to commit a word (LocalAgreement-n)')
+    parser.add_argument('--max_uncommitted_sec', type=float, default=default_args_instance.max_uncommitted_sec,
+                        help='Commit words older than this without agreement. Disabled if not set')
+    parser.add_argument('--adaptive_chunk', action='store_true', help='Adapt the chunk size of every session to hold --target_latency')
+    parser.add_argument('--target_latency', type=float, default=default_args_instance.target_latency, help='Target latency of --adaptive_chunk, in seconds')
+    parser.add_argument('--latency_budget', type=float, default=None,
+                        help='Backlog in seconds after which a session is degraded: decoded greedily (and with --cheap_model), then shed')
+    parser.add_argument('--cheap_model', type=str, default=None, help='faster-whisper model for sessions over their latency budget')
+    parser.add_argument('--cascade_model', type=str, default=None,
+                        help='Small model (e.g. base) for the streaming iterations and partials, the committed text is re-decoded by --model')
+    parser.add_argument('--checkpoint_dir', type=str, default=None,
+                        help='Directory where interrupted sessions are saved, so that clients can resume them after a reconnect')
+    parser.add_argument('--vad', action='store_true', help='Decode only the speech detected by Silero VAD')
+    parser.add_argument('--vad_threshold', type=float, default=0.5, help='Speech probability threshold of the VAD')
+    parser.add_argument('--vad_min_silence_ms', type=int, default=500, help='Silence that ends an utterance, in milliseconds')
+    parser.add_argument('--vad_speech_pad_ms', type=int, default=100, help='Audio kept around the detected speech, in milliseconds')
+    args = parser.parse_args()
+
+    import faster_whisper
+    asr = faster_whisper.WhisperModel(
+        args.model,
+        device=args.device,
+        compute_type=args.compute_type,
+        download_root=args.model_dir,
+        num_workers=args.workers,
+    )
+    asr.sep = ""
+
+    final_asr = None
+    if args.cascade_model is not None:
+        final_asr = asr
+        asr = faster_whisper.WhisperModel(args.cascade_model, device=args.device, compute_type=args.compute_type, download_root=args.model_dir)
+        asr.sep = ""
+
+    cheap_asr = None
+    if args.cheap_model is not None:
+        cheap_asr = faster_whisper.WhisperModel(args.cheap_model, device=args.device, compute_type=args.compute_type, download_root=args.model_dir)
+        cheap_asr.sep = ""
+
+    vad_options = None
+    if args.vad:
+        from faster_whisper.vad import VadOptions
+        vad_options = VadOptions(
+            threshold=args.vad_threshold,
+            min_silence_duration_ms=args.vad_min_silence_ms,
+            speech_pad_ms=args.vad_speech_pad_ms,
+        )
+
+    server = AsyncStreamingServer(
+        asr=asr,
+        min_chunk=args.min_chunk_size,
+        transcribe_args=transcribe_args_from(args),
+        buffer_trimming_sec=args.buffer_trimming_sec,
+        buffer_trimming=args.buffer_trimming,
+        agreement=args.agreement,
+        max_uncommitted_sec=args.max_uncommitted_sec,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        vad_options=vad_options,
+        target_latency=args.target_latency if args.adaptive_chunk else None,
+        latency_budget=args.latency_budget,
+        cheap_asr=cheap_asr,
+        checkpoint_dir=args.checkpoint_dir,
+        final_asr=final_asr,
+    )
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""Local client simulator for the streaming servers.
+
+Streams an audio file as 16 kHz mono PCM16 at real-time speed (or faster, with
+--speed) and prints every transcript it gets back, prefixed with the time since
+the stream started. It speaks the legacy protocol (raw audio in, lines out) or,
+with --framed, the framed one of frame_packet. Several clients can be run at
+once to drive the asyncio server with concurrent sessions. With --reconnect_after,
+every client drops its connection after that many seconds of audio and
+reconnects with its session id, to exercise checkpoint/resume of the server.
+With --native, the file is sent at its own sample rate and number of channels,
+announced in the hello, like a browser or phone client would.
+
+    python -m modules.whisper.whisper_online_client --audio cs.wav --clients 3
+"""
+import argparse
+import asyncio
+import sys
+import time
+import uuid
+
+import librosa
+import numpy as np
+
+from modules.whisper import frame_packet
+from modules.whisper.frame_packet import TranscriptEvent
+
+SAMPLING_RATE = 16000
+
+
+def load_pcm16(fname, native=False):
+    """Returns (interleaved PCM16 bytes, audio format), 16 kHz mono unless native"""
+    if not native:
+        audio, _ = librosa.load(fname, sr=SAMPLING_RATE, dtype=np.float32)
+        return (np.clip(audio, -1.0, 1.0) * 32767).astype("<i2").tobytes(), dict(frame_packet.DEFAULT_FORMAT)
+    audio, sr = librosa.load(fname, sr=None, mono=False, dtype=np.float32)
+    audio = audio.reshape(-1, audio.shape[-1]).T # (samples, channels)
+    audio_format = {"sample_rate": int(sr), "channels": audio.shape[1]}
+    return (np.clip(audio, -1.0, 1.0) * 32767).astype("<i2").tobytes(), audio_format
+
+
+def parse_line(line):
+    # "beg end text" line of the legacy protocol, timestamps in milliseconds
+    beg, end, text = (line.split(" ", 2) + [""])[:3]
+    return TranscriptEvent(start=float(beg)/1000, end=float(end)/1000, text=text)
+
+
+async def read_lines(reader, client_id, started, events):
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        line = line.decode("utf-8", errors="replace").strip()
+        if not line:
+            continue
+        on_event(client_id, started, events, parse_line(line))
+
+
+async def read_frames(reader, client_id, started, events):
+    while True:
+        frame = await frame_packet.read_frame(reader)
+        if frame is None:
+            break
+        frame_type, payload = frame
+        if frame_type == frame_packet.TRANSCRIPT:
+            on_event(client_id, started, events, TranscriptEvent.from_payload(payload))
+
+
+def on_event(client_id, started, events, event):
+    now = time.time() - started
+    events.append((now, event))
+    kind = "final" if event.committed else "partial"
+    print(f"[client {client_id}] {now:8.3f} {kind:7s} {event.start*1000:1.0f} {event.end*1000:1.0f} {event.text}", flush=True)
+
+
+async def hello(reader, writer, session_id=None, audio_format=None):
+    # sends the hello of protocol version 2, returns the session message of the server
+    writer.write(frame_packet.hello(session_id, audio_format))
+    frame = await frame_packet.read_frame(reader)
+    if frame is None or frame[0] != frame_packet.CONTROL:
+        raise frame_packet.ProtocolError("Expected the session CONTROL frame")
+    return frame_packet.decode_control(frame[1])
+
+
+async def stream_audio(host, port, pcm, client_id=0, chunk_sec=0.1, speed=1.0, framed=False, session_id=None, drop_after=None,
+                       audio_format=None):
+    """Sends `pcm` in `chunk_sec` pieces, paced to `speed` x real time.
+    `pcm` is 16 kHz mono, or of audio_format (framed protocol only), see load_pcm16.
+    A framed client continues the session `session_id` if the server has it (a new one if None), from the
+    position the server tells. With drop_after, the connection is aborted without END after that many seconds
+    of audio, like when the network fails.
+    Returns the received transcripts as [(seconds since start, TranscriptEvent), ...]"""
+    reader, writer = await asyncio.open_connection(host, port)
+    audio_format = audio_format or frame_packet.DEFAULT_FORMAT
+    frame_bytes = 2*audio_format["channels"]
+    sampling_rate = audio_format["sample_rate"]
+    resume_from = 0
+    if framed:
+        writer.write(frame_packet.handshake())
+        head = await reader.readexactly(len(frame_packet.MAGIC) + 1)
+        if head[:len(frame_packet.MAGIC)] != frame_packet.MAGIC:
+            raise frame_packet.ProtocolError("Server doesn't speak the framed protocol")
+        if head[-1] >= 2:
+            session = await hello(reader, writer, session_id, audio_format)
+            resume_from = int(session["resume_from"]*sampling_rate)*frame_bytes
+            print(f"[client {client_id}] session {session['session']}, resuming at {session['resume_from']:.2f} s", flush=True)
+    started = time.time()
+    events = []
+    read = read_frames if framed else read_lines
+    receiver = asyncio.create_task(read(reader, client_id, started, events))
+
+    chunk_bytes = int(chunk_sec*sampling_rate)*frame_bytes
+    end = len(pcm) if drop_after is None else min(len(pcm), int(drop_after*sampling_rate)*frame_bytes)
+    for i, offset in enumerate(range(resume_from, end, chunk_bytes)):
+        packet = pcm[offset:min(offset+chunk_bytes, end)]
+        writer.write(frame_packet.encode_frame(frame_packet.AUDIO, packet) if framed else packet)
+        await writer.drain()
+        delay = started + (i+1)*chunk_sec/speed - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    if end < len(pcm):
+        writer.transport.abort()
+        await receiver
+        return events
+    if framed:
+        writer.write(frame_packet.encode_frame(frame_packet.END))
+        await writer.drain()
+    if writer.can_write_eof():
+        writer.write_eof()
+
+    await receiver
+    writer.close()
+    return events
+
+
+async def stream_with_reconnect(host, port, pcm, client_id=0, chunk_sec=0.1, speed=1.0, reconnect_after=10.0, pause=1.0,
+                                audio_format=None):
+    """Streams `pcm` in a framed session that is dropped after `reconnect_after` seconds of audio and
+    resumed `pause` seconds later. Returns the transcripts of both connections."""
+    session_id = uuid.uuid4().hex
+    events = await stream_audio(host, port, pcm, client_id, chunk_sec, speed, framed=True, session_id=session_id, drop_after=reconnect_after,
+                                audio_format=audio_format)
+    print(f"[client {client_id}] connection dropped, reconnecting", flush=True)
+    await asyncio.sleep(pause)
+    return events + await stream_audio(host, port, pcm, client_id, chunk_sec, speed, framed=True, session_id=session_id,
+                                       audio_format=audio_format)
+
+
+async def simulate(host, port, audio, clients, chunk_sec, speed, stagger, framed=False, reconnect_after=None, native=False):
+    pcm, audio_format = load_pcm16(audio, native)
+    tasks = []
+    for i in range(clients):
+        if reconnect_after is not None:
+            client = stream_with_reconnect(host, port, pcm, client_id=i, chunk_sec=chunk_sec, speed=speed, reconnect_after=reconnect_after,
+                                           audio_format=audio_format)
+        else:
+            client = stream_audio(host, port, pcm, client_id=i, chunk_sec=chunk_sec, speed=speed, framed=framed or native,
+                                  audio_format=audio_format)
+        tasks.append(asyncio.create_task(client))
+        await asyncio.sleep(stagger)
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    for i, r in enumerate(results):
+        if isinstance(r, Exception):
+            print(f"[client {i}] failed: {r}", file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default='localhost')
+    parser.add_argument('--port', type=int, default=43007)
+    parser.add_argument('--audio', type=str, required=True, help='Audio file to stream')
+    parser.add_argument('--clients', type=int, default=1, help='Number of concurrent clients')
+    parser.add_argument('--chunk_sec', type=float, default=0.1, help='Size of the sent audio packets in seconds')
+    parser.add_argument('--speed', type=float, default=1.0, help='Playback speed relative to real time')
+    parser.add_argument('--stagger', type=float, default=0.5, help='Delay between starting the clients in seconds')
+    parser.add_argument('--framed', action='store_true', help='Use the framed protocol instead of the legacy one')
+    parser.add_argument('--reconnect_after', type=float, default=None,
+                        help='Drop the connection after this many seconds of audio and resume the session (framed protocol)')
+    parser.add_argument('--native', action='store_true',
+                        help='Send the audio at its own sample rate and number of channels (framed protocol)')
+    args = parser.parse_args()
+    asyncio.run(simulate(args.host, args.port, args.audio, args.clients, args.chunk_sec, args.speed, args.stagger, args.framed,
+                         args.reconnect_after, args.native))
+
+
+if __name__ == "__main__":
+    main()
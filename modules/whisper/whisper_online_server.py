@@ -3,12 +3,16 @@ from modules.whisper.whisper_online import *
 
 import sys
 import os
+import time
 import numpy as np
 import socket
+import uuid
 from modules.whisper import line_packet
-
-import io
-import soundfile
+from modules.whisper import frame_packet
+from modules.whisper.frame_packet import FrameDecoder, TranscriptEvent
+from modules.whisper.audio_ingest import PCM16Decoder
+from modules.whisper.backpressure import LatencyBudget
+from modules.whisper.session_store import valid_session_id
 
 SAMPLING_RATE = 16000
 
@@ -23,6 +27,22 @@ class Connection:
 
         self.conn.setblocking(True)
 
+        # set by negotiate() for clients of the framed protocol, None for the legacy line protocol
+        self.protocol_version = None
+        self.frames = None
+        self.ended = False
+
+    @property
+    def framed(self):
+        return self.protocol_version is not None
+
+    def negotiate(self):
+        '''detects whether the client speaks the framed protocol (see frame_packet) or the legacy one'''
+        self.protocol_version = frame_packet.negotiate_server(self.conn)
+        if self.framed:
+            self.frames = FrameDecoder()
+        return self.protocol_version
+
     def send(self, line):
         '''it doesn't send the same line twice, because it was problematic in online-text-flow-events'''
         if line == self.last_line:
@@ -30,51 +50,128 @@ class Connection:
         line_packet.send_one_line(self.conn, line)
         self.last_line = line
 
+    def send_event(self, event):
+        frame_packet.send_event(self.conn, event)
+
+    def receive_hello(self):
+        '''the hello message that clients of protocol version 2 send first'''
+        return frame_packet.parse_hello(frame_packet.receive_frame(self.conn))
+
+    def send_session(self, session_id, resume_from, audio_format):
+        self.conn.sendall(frame_packet.session_message(session_id, resume_from, audio_format))
+
     def receive_lines(self):
         in_line = line_packet.receive_lines(self.conn)
         return in_line
 
     def non_blocking_receive_audio(self):
         try:
-            r = self.conn.recv(self.PACKET_SIZE)
-            return r
+            if not self.framed:
+                r = self.conn.recv(self.PACKET_SIZE)
+                return r
+            return self.receive_audio_frames()
+        except ConnectionResetError:
+            return None
+
+    def receive_available_audio(self):
+        # returns the audio that has already arrived without blocking, b"" if there is none, or None if the stream has ended
+        if self.ended:
+            return None
+        try:
+            r = self.conn.recv(self.PACKET_SIZE, socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            return b""
         except ConnectionResetError:
             return None
+        if not r:
+            return None
+        if not self.framed:
+            return r
+        return self.audio_of_frames(r)
+
+    def receive_audio_frames(self):
+        # returns the payload of the AUDIO frames that arrived with the next packet(s), or None at END
+        while not self.ended:
+            r = self.conn.recv(self.PACKET_SIZE)
+            if not r:
+                return None
+            audio = self.audio_of_frames(r)
+            if audio:
+                return audio
+        return None
+
+    def audio_of_frames(self, r):
+        audio = []
+        for frame_type, payload in self.frames.feed(r):
+            if frame_type == frame_packet.AUDIO:
+                audio.append(payload)
+            elif frame_type == frame_packet.END:
+                self.ended = True
+            elif frame_type == frame_packet.CONTROL:
+                print(f"control message: {frame_packet.decode_control(payload)}", file=sys.stderr)
+        return b"".join(audio)
 
 # wraps socket and ASR object, and serves one client connection. 
 # next client should be served by a new instance of this object
 class ServerProcessor:
 
-    def __init__(self, c, online_asr_proc, min_chunk):
+    def __init__(self, c, online_asr_proc, min_chunk, transcribe_args=None, chunk_controller=None, partial_interval=0.3,
+                 latency_budget=None, checkpoints=None):
         self.connection = c
         self.online_asr_proc = online_asr_proc
         self.min_chunk = min_chunk
+        self.transcribe_args = transcribe_args if transcribe_args is not None else {"word_timestamps": True}
+        # AdaptiveChunkController that sets self.min_chunk from the measured decoding time
+        self.chunk_controller = chunk_controller
+        if chunk_controller is not None:
+            chunk_controller.min_chunk = min_chunk
+
+        # LatencyBudget that degrades the decoding when it falls behind the client
+        self.latency_budget = latency_budget
+        self.asr = online_asr_proc.asr
+        self.started = None # arrival time of the first audio
+        self.decoded_seconds = 0.0 # audio given to the processor or shed
+
+        # SessionStore where the session is saved if the connection drops, for clients that send a hello
+        self.checkpoints = checkpoints
+        self.session_id = None
+        self.stream_offset = 0.0 # position of this connection's first audio in the session's stream, in seconds
+        self.unsent = [] # outputs that couldn't be sent before the connection dropped
 
         self.last_end = None
+        # partial hypotheses are sent to framed clients only, at most once per partial_interval seconds
+        self.partials = PartialEmitter(partial_interval)
 
         self.is_first = True
+        self.pcm = PCM16Decoder(capacity=int(min_chunk*SAMPLING_RATE*2))
 
-    def receive_audio_chunk(self):
+    def receive_audio_chunk(self, coalesce=False):
         # receive all audio that is available by this time
         # blocks operation if less than self.min_chunk seconds is available
         # unblocks if connection is closed or a chunk is available
-        out = []
+        # with coalesce, it also takes everything that has already arrived after the chunk
+        # the returned array is a view of self.pcm's buffer, valid until the next call
         minlimit = self.min_chunk*SAMPLING_RATE
-        while sum(len(x) for x in out) < minlimit:
+        while len(self.pcm) < minlimit:
             raw_bytes = self.connection.non_blocking_receive_audio()
             if not raw_bytes:
+                self.pcm.flush()
                 break
 #            print("received audio:",len(raw_bytes), "bytes", raw_bytes[:10])
-            sf = soundfile.SoundFile(io.BytesIO(raw_bytes), channels=1,endian="LITTLE",samplerate=SAMPLING_RATE, subtype="PCM_16",format="RAW")
-            audio, _ = librosa.load(sf,sr=SAMPLING_RATE,dtype=np.float32)
-            out.append(audio)
-        if not out:
+            if self.started is None:
+                self.started = time.time()
+            self.pcm.feed(raw_bytes)
+        while coalesce:
+            raw_bytes = self.connection.receive_available_audio()
+            if not raw_bytes:
+                break
+            self.pcm.feed(raw_bytes)
+        if not len(self.pcm):
             return None
-        conc = np.concatenate(out)
-        if self.is_first and len(conc) < minlimit:
+        if self.is_first and len(self.pcm) < minlimit:
             return None
         self.is_first = False
-        return np.concatenate(out)
+        return self.pcm.take()
 
     def format_output_transcript(self,o):
         # output format in stdout is like:
@@ -89,38 +186,146 @@ class ServerProcessor:
         # Usually it differs negligibly, by appx 20 ms.
 
         if o[0] is not None:
-            beg, end = o[0]*1000,o[1]*1000
-            if self.last_end is not None:
-                beg = max(beg, self.last_end)
-
-            self.last_end = end
+            beg, end = self.output_interval(o)
             print("%1.0f %1.0f %s" % (beg,end,o[2]),flush=True,file=sys.stderr)
             return "%1.0f %1.0f %s" % (beg,end,o[2])
         else:
             print("No text in this segment")
             return None
 
+    def output_interval(self, o):
+        # [beg,end] of the output in milliseconds, not overlapping the previous one
+        beg, end = o[0]*1000,o[1]*1000
+        if self.last_end is not None:
+            beg = max(beg, self.last_end)
+        self.last_end = end
+        return beg, end
+
     def send_result(self, o):
+        if self.connection.framed:
+            if o[0] is not None:
+                beg, end = self.output_interval(o)
+                self.connection.send_event(TranscriptEvent(start=beg/1000, end=end/1000, text=o[2], committed=True))
+            return
         msg = self.format_output_transcript(o)
         if msg is not None:
             self.connection.send(msg)
 
+    def deliver(self, o, partial=False):
+        # sends o, and the partial after it if partial. False if the connection is lost, o is kept in self.unsent then
+        last_end = self.last_end
+        try:
+            self.send_result(o)
+        except ConnectionError as e: # BrokenPipeError, ConnectionResetError, ...
+            print(f"connection lost: {e!r}", file=sys.stderr)
+            self.last_end = last_end
+            if o[2]:
+                self.unsent.append(o)
+            return False
+        if partial:
+            try:
+                self.send_partial(o)
+            except ConnectionError as e:
+                print(f"connection lost: {e!r}", file=sys.stderr)
+                return False
+        return True
+
+    def send_partial(self, o):
+        # the uncommitted tail after the iteration that returned o, as a partial event
+        if not self.connection.framed:
+            return
+        p = self.partials.update(self.online_asr_proc.partial(), time.time(), committed=bool(o[2]))
+        if p is None:
+            return
+        beg, end = (p[0]*1000, p[1]*1000) if p[0] is not None else (self.last_end or 0, self.last_end or 0)
+        if self.last_end is not None:
+            beg = max(beg, self.last_end)
+        self.connection.send_event(TranscriptEvent(start=beg/1000, end=end/1000, text=p[2], committed=False))
+
+    def backlog(self):
+        # seconds of the stream that have arrived (the client sends in real time) but haven't been decoded
+        if self.started is None:
+            return 0.0
+        return time.time() - self.started - self.decoded_seconds
+
+    def resume(self):
+        # starts the session of the client's hello, from its checkpoint if it has one
+        # returns False if the connection was lost while sending the outputs that the checkpoint kept
+        hello = self.connection.receive_hello()
+        audio_format = frame_packet.audio_format(hello)
+        if audio_format != frame_packet.DEFAULT_FORMAT:
+            # downmixed and resampled to 16 kHz mono as it arrives
+            self.pcm = PCM16Decoder(capacity=int(self.min_chunk*SAMPLING_RATE*2),
+                                    sampling_rate=audio_format["sample_rate"], channels=audio_format["channels"])
+        requested = hello.get("session")
+        if requested is not None and not valid_session_id(requested):
+            raise frame_packet.ProtocolError(f"Invalid session id {requested!r}")
+        self.session_id = requested or uuid.uuid4().hex
+        checkpoint = None
+        if requested is not None and self.checkpoints is not None:
+            checkpoint = self.checkpoints.load(requested)
+        if checkpoint is not None:
+            checkpoint.restore(self.online_asr_proc)
+            self.stream_offset = checkpoint.stream_sec
+            self.last_end = checkpoint.last_end
+            print(f"[{self.session_id}] resumed at {self.stream_offset:.2f} s", file=sys.stderr)
+        self.connection.send_session(self.session_id, self.stream_offset, audio_format)
+        if checkpoint is not None:
+            for i, o in enumerate(checkpoint.unsent):
+                if not self.deliver(o):
+                    self.unsent.extend(checkpoint.unsent[i+1:])
+                    return False
+        return True
+
+    def save_checkpoint(self):
+        self.checkpoints.save(self.session_id, self.online_asr_proc, self.stream_offset + self.decoded_seconds,
+                              last_end=self.last_end, unsent=self.unsent)
+
     def process(self):
         # handle one client connection
+        self.connection.negotiate()
         self.online_asr_proc.init()
-        while True:
-            a = self.receive_audio_chunk()
+        connected = True
+        if self.connection.framed and self.connection.protocol_version >= 2:
+            connected = self.resume()
+        budget = self.latency_budget
+        while connected:
+            if budget is not None:
+                budget.update(self.backlog())
+            a = self.receive_audio_chunk(coalesce=budget is not None and budget.coalesce)
             if a is None:
                 break
+            self.decoded_seconds += len(a)/SAMPLING_RATE
+            args = self.transcribe_args
+            if budget is not None:
+                a, skipped = budget.shed(a, SAMPLING_RATE)
+                if skipped:
+                    # the chunk is still decoded and checkpointed if the connection is lost here
+                    connected = self.deliver(self.online_asr_proc.skip(skipped))
+                self.online_asr_proc.asr = budget.asr(self.asr)
+                args = budget.transcribe_args(args)
             self.online_asr_proc.insert_audio_chunk(a)
-            o = self.online_asr_proc.process_iter()
-            try:
-                self.send_result(o)
-            except BrokenPipeError:
-                print("broken pipe -- connection closed?")
+            buffer_sec = len(self.online_asr_proc.audio_buffer)/SAMPLING_RATE
+            compute_start = time.perf_counter()
+            o = self.online_asr_proc.process_iter(args)
+            if self.chunk_controller is not None:
+                self.min_chunk = self.chunk_controller.update(time.perf_counter() - compute_start, buffer_sec)
+            if not connected:
+                if o[2]:
+                    self.unsent.append(o)
+                break
+            if not self.deliver(o, partial=True):
                 break
+        if self.session_id is not None and self.checkpoints is not None:
+            # a session that didn't end with END is saved for a reconnect
+            if self.connection.ended:
+                self.checkpoints.delete(self.session_id)
+            else:
+                self.save_checkpoint()
+        if self.chunk_controller is not None:
+            print(f"adaptive chunk size: {self.chunk_controller.metrics()}", file=sys.stderr)
+        if budget is not None:
+            print(f"latency budget: {budget.report()}", file=sys.stderr)
 
 #        o = online.finish()  # this should be working
 #        self.send_result(o)
-
-
@@ -0,0 +1,73 @@
+# Micro-benchmark of the audio buffer of OnlineASRProcessor.
+# Simulates a one-hour stream fed in `min_chunk` pieces with segment trimming at
+# `buffer_trimming_sec`, and prints the mean per-chunk cost for every 10 minutes
+# of audio, for the old np.append/slice buffer and for AudioRingBuffer.
+#
+#   python -m test.bench_audio_buffer --hours 1 --min-chunk 1.0
+import argparse
+import time
+
+import numpy as np
+
+from modules.whisper.online_buffers import AudioRingBuffer
+
+SAMPLING_RATE = 16000
+
+
+class NumpyAppendBuffer:
+    """the previous implementation: np.append on insert, slicing on trim"""
+
+    def __init__(self):
+        self.audio = np.array([], dtype=np.float32)
+
+    def __len__(self):
+        return len(self.audio)
+
+    def append(self, audio):
+        self.audio = np.append(self.audio, audio)
+
+    def trim_front(self, n):
+        self.audio = self.audio[n:]
+
+    def view(self):
+        return self.audio
+
+
+def run(buffer, hours, min_chunk, buffer_trimming_sec, keep_sec):
+    chunk = np.random.default_rng(0).standard_normal(int(min_chunk*SAMPLING_RATE)).astype(np.float32)
+    n_chunks = int(hours*3600/min_chunk)
+    bucket = int(600/min_chunk)
+    costs = []
+    for i in range(n_chunks):
+        t0 = time.perf_counter()
+        buffer.append(chunk)
+        audio = buffer.view()
+        # what the ASR would read; touches the whole buffer like the feature extractor does
+        audio[::4000].sum()
+        if len(buffer)/SAMPLING_RATE > buffer_trimming_sec:
+            buffer.trim_front(len(buffer) - int(keep_sec*SAMPLING_RATE))
+        costs.append(time.perf_counter() - t0)
+    return [np.mean(costs[i:i+bucket]) for i in range(0, n_chunks, bucket)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hours', type=float, default=1.0)
+    parser.add_argument('--min-chunk', type=float, default=1.0)
+    parser.add_argument('--buffer-trimming-sec', type=float, default=15.0)
+    parser.add_argument('--keep-sec', type=float, default=5.0, help='audio left in the buffer after trimming')
+    args = parser.parse_args()
+
+    buffers = {
+        "np.append": NumpyAppendBuffer(),
+        "AudioRingBuffer": AudioRingBuffer(capacity=int(SAMPLING_RATE*args.buffer_trimming_sec*2)),
+    }
+    for name, buffer in buffers.items():
+        costs = run(buffer, args.hours, args.min_chunk, args.buffer_trimming_sec, args.keep_sec)
+        print(f"{name}: mean cost per chunk for every 10 minutes of audio")
+        for i, c in enumerate(costs):
+            print(f"  {i*10:4d}-{(i+1)*10:4d} min  {c*1e6:8.1f} us")
+
+
+if __name__ == "__main__":
+    main()
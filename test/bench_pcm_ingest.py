@@ -0,0 +1,68 @@
+# Benchmark of the PCM16 ingestion of the streaming server.
+# Feeds one minute of random PCM16 audio in socket-sized packets (with an odd
+# packet size, so samples straddle packet boundaries) and prints the ingest cost
+# per second of audio for the previous soundfile+librosa path and PCM16Decoder.
+#
+#   python -m test.bench_pcm_ingest --packet-bytes 3201
+import argparse
+import io
+import time
+
+import numpy as np
+
+from modules.whisper.audio_ingest import PCM16Decoder
+
+SAMPLING_RATE = 16000
+
+
+def librosa_ingest(packets):
+    import librosa
+    import soundfile
+    out = []
+    for raw_bytes in packets:
+        sf = soundfile.SoundFile(io.BytesIO(raw_bytes), channels=1, endian="LITTLE", samplerate=SAMPLING_RATE, subtype="PCM_16", format="RAW")
+        audio, _ = librosa.load(sf, sr=SAMPLING_RATE, dtype=np.float32)
+        out.append(audio)
+    return np.concatenate(out)
+
+
+def decoder_ingest(packets):
+    decoder = PCM16Decoder()
+    for raw_bytes in packets:
+        decoder.feed(raw_bytes)
+    return decoder.take()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=60.0)
+    parser.add_argument('--packet-bytes', type=int, default=3201)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    pcm = np.random.default_rng(0).integers(-32768, 32767, int(args.seconds*SAMPLING_RATE), dtype=np.int16).astype("<i2").tobytes()
+    packets = [pcm[i:i+args.packet_bytes] for i in range(0, len(pcm), args.packet_bytes)]
+    expected = np.frombuffer(pcm, dtype="<i2") / 32768.0
+
+    paths = {"PCM16Decoder": decoder_ingest}
+    try:
+        import librosa, soundfile
+        # the old path can't decode samples split between packets, so give it even-sized packets
+        even = args.packet_bytes - args.packet_bytes % 2
+        even_packets = [pcm[i:i+even] for i in range(0, len(pcm), even)]
+        paths["soundfile+librosa"] = lambda _: librosa_ingest(even_packets)
+    except ImportError:
+        print("librosa/soundfile are not installed, skipping the old path")
+
+    for name, ingest in paths.items():
+        audio = ingest(packets)
+        assert np.allclose(audio, expected), name
+        t0 = time.perf_counter()
+        for _ in range(args.repeat):
+            ingest(packets)
+        cost = (time.perf_counter() - t0) / args.repeat / args.seconds
+        print(f"{name:20s} {cost*1e6:8.1f} us per second of audio")
+
+
+if __name__ == "__main__":
+    main()
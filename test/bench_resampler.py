@@ -0,0 +1,63 @@
+# Benchmark of the sample-rate conversion of client audio.
+# Resamples one minute of audio at --rate to 16 kHz in chunks of --chunk-ms,
+# like the packets of a browser client, and prints the cost per second of audio
+# and the error at the chunk boundaries (against resampling the whole signal)
+# for a librosa.resample of every chunk and for StreamingResampler.
+#
+#   python -m test.bench_resampler --rate 44100 --chunk-ms 20
+import argparse
+import time
+
+import numpy as np
+
+from modules.whisper.audio_ingest import StreamingResampler
+
+SAMPLING_RATE = 16000
+
+
+def librosa_chunks(chunks, rate):
+    import librosa
+    return np.concatenate([librosa.resample(c, orig_sr=rate, target_sr=SAMPLING_RATE) for c in chunks])
+
+
+def streaming_chunks(chunks, rate):
+    resampler = StreamingResampler(rate, SAMPLING_RATE)
+    return np.concatenate([resampler.process(c) for c in chunks] + [resampler.flush()])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=60.0)
+    parser.add_argument('--rate', type=int, default=44100)
+    parser.add_argument('--chunk-ms', type=float, default=20.0)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    t = np.arange(int(args.seconds*args.rate)) / args.rate
+    audio = (0.3*np.sin(2*np.pi*440*t) + 0.2*np.sin(2*np.pi*3000*t)).astype(np.float32)
+    chunk = int(args.chunk_ms/1000*args.rate)
+    chunks = [audio[i:i+chunk] for i in range(0, len(audio), chunk)]
+    t_out = np.arange(int(args.seconds*SAMPLING_RATE)) / SAMPLING_RATE
+    expected = 0.3*np.sin(2*np.pi*440*t_out) + 0.2*np.sin(2*np.pi*3000*t_out)
+
+    paths = {"StreamingResampler": streaming_chunks}
+    try:
+        import librosa
+        paths["librosa per chunk"] = librosa_chunks
+    except ImportError:
+        print("librosa is not installed, skipping the per-chunk path")
+
+    for name, resample in paths.items():
+        out = resample(chunks, args.rate)
+        n = min(len(out), len(expected))
+        error = out[100:n-100] - expected[100:n-100]
+        snr = 10*np.log10(np.sum(expected[100:n-100]**2) / np.sum(error**2))
+        t0 = time.perf_counter()
+        for _ in range(args.repeat):
+            resample(chunks, args.rate)
+        cost = (time.perf_counter() - t0) / args.repeat / args.seconds
+        print(f"{name:20s} {cost*1e6:8.1f} us per second of audio, SNR {snr:5.1f} dB, {len(out)} samples")
+
+
+if __name__ == "__main__":
+    main()
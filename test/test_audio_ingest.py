@@ -0,0 +1,96 @@
+# Tests of the streaming ingest of client audio against librosa.
+#
+#   python -m pytest test/test_audio_ingest.py
+import numpy as np
+import pytest
+
+librosa = pytest.importorskip("librosa")
+
+from modules.whisper.audio_ingest import PCM16Decoder, StreamingResampler
+
+SAMPLING_RATE = 16000
+
+
+def tones(rate, seconds=2.0, frequencies=(440.0, 3000.0)):
+    t = np.arange(int(seconds*rate)) / rate
+    return sum(0.3*np.sin(2*np.pi*f*t) for f in frequencies).astype(np.float32)
+
+
+def snr(reference, signal, margin=200):
+    # in dB, away from the edges where the filters of the two resamplers start differently
+    n = min(len(reference), len(signal))
+    error = signal[margin:n-margin] - reference[margin:n-margin]
+    return 10*np.log10(np.sum(reference[margin:n-margin]**2) / np.sum(error**2))
+
+
+def chunks(data, sizes):
+    i, k = 0, 0
+    while i < len(data):
+        yield data[i:i+sizes[k % len(sizes)]]
+        i += sizes[k % len(sizes)]
+        k += 1
+
+
+def to_pcm16(audio):
+    return (np.clip(audio, -1, 1)*32767).astype("<i2").tobytes()
+
+
+@pytest.mark.parametrize("rate", [8000, 22050, 44100, 48000])
+def test_resampler_matches_librosa(rate):
+    audio = tones(rate)
+    resampler = StreamingResampler(rate)
+
+    out = np.concatenate([resampler.process(c) for c in chunks(audio, [rate//50])] + [resampler.flush()])
+
+    expected = librosa.resample(audio, orig_sr=rate, target_sr=SAMPLING_RATE)
+    assert abs(len(out) - len(expected)) <= 1
+    assert snr(expected, out) > 40
+
+
+def test_resampler_output_does_not_depend_on_the_chunks():
+    audio = tones(44100)
+    whole = StreamingResampler(44100)
+    expected = np.concatenate([whole.process(audio), whole.flush()])
+
+    resampler = StreamingResampler(44100)
+    out = np.concatenate([resampler.process(c) for c in chunks(audio, [1, 441, 17, 1000, 3])] + [resampler.flush()])
+
+    assert len(out) == len(expected) == int(np.ceil(len(audio)*SAMPLING_RATE/44100))
+    np.testing.assert_allclose(out, expected, atol=1e-6)
+
+
+def test_resampler_passes_16khz_through():
+    audio = tones(SAMPLING_RATE)
+
+    np.testing.assert_array_equal(StreamingResampler(SAMPLING_RATE).process(audio), audio)
+
+
+def test_decoder_matches_librosa_on_packets_split_anywhere():
+    data = to_pcm16(tones(SAMPLING_RATE))
+    decoder = PCM16Decoder(capacity=100)
+
+    out = []
+    for packet in chunks(data, [1, 3, 640, 7, 2]):
+        decoder.feed(packet)
+        out.append(decoder.take().copy())
+
+    np.testing.assert_array_equal(np.concatenate(out), librosa.util.buf_to_float(data, n_bytes=2, dtype=np.float32))
+
+
+def test_decoder_downmixes_and_resamples_like_librosa():
+    left, right = tones(48000, frequencies=(440.0,)), tones(48000, frequencies=(3000.0,))
+    data = to_pcm16(np.stack([left, right], axis=1).reshape(-1))
+    decoder = PCM16Decoder(sampling_rate=48000, channels=2)
+
+    out = []
+    for packet in chunks(data, [1919, 5, 3840]):
+        decoder.feed(packet)
+        out.append(decoder.take().copy())
+    decoder.flush()
+    out.append(decoder.take().copy())
+
+    interleaved = librosa.util.buf_to_float(data, n_bytes=2, dtype=np.float32).reshape(-1, 2).T
+    expected = librosa.resample(librosa.to_mono(interleaved), orig_sr=48000, target_sr=SAMPLING_RATE)
+    out = np.concatenate(out)
+    assert abs(len(out) - len(expected)) <= 1
+    assert snr(expected, out) > 40
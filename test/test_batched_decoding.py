@@ -0,0 +1,96 @@
+# Tests of BatchedTranscriber with a stub model and a stub batched pipeline.
+#
+#   python -m pytest test/test_batched_decoding.py
+from types import SimpleNamespace
+
+import numpy as np
+
+from modules.whisper.batched_decoding import BatchedTranscriber, CHUNK_LENGTH, SAMPLING_RATE
+
+
+def word(start, end, text):
+    return SimpleNamespace(start=start, end=end, word=text, probability=1.0)
+
+
+def segment(start, end, text):
+    return SimpleNamespace(start=start, end=end, text=text, no_speech_prob=0.0, words=[word(start, end, text)])
+
+
+def label(audio):
+    """the text that the stubs transcribe an audio as: the value of its samples x 1000"""
+    return f"s{int(round(float(np.median(audio)) * 1000))}"
+
+
+class StubModel:
+    def __init__(self):
+        self.calls = []
+
+    def transcribe(self, audio, initial_prompt=None, **kwargs):
+        self.calls.append(initial_prompt)
+        return iter([segment(0.1, len(audio)/SAMPLING_RATE - 0.1, f"{initial_prompt}:{label(audio)}")]), None
+
+
+class StubPipeline:
+    """Transcribes every clip as one segment in the time of the whole input, and hallucinates
+    a segment in the padding after the last clip, like a model decoding silence can"""
+
+    def __init__(self):
+        self.calls = []
+
+    def transcribe(self, audio, vad_filter, clip_timestamps, batch_size, initial_prompt=None, **kwargs):
+        self.calls.append((len(audio), clip_timestamps, initial_prompt))
+        segments = []
+        for clip in clip_timestamps:
+            start, end = clip["start"]/SAMPLING_RATE, clip["end"]/SAMPLING_RATE
+            segments.append(segment(start + 0.1, end - 0.1, f"{initial_prompt}:{label(audio[clip['start']:clip['end']])}"))
+        end = clip_timestamps[-1]["end"]/SAMPLING_RATE
+        segments.append(segment(end + 0.5, end + 1.0, "padding"))
+        return iter(segments), None
+
+
+def transcriber():
+    t = BatchedTranscriber(StubModel(), batch_size=8)
+    t.pipeline = StubPipeline()
+    return t
+
+
+def audio(value, seconds):
+    return np.full(int(seconds*SAMPLING_RATE), value/1000, dtype=np.float32)
+
+
+def test_short_batch_is_padded_and_mapped_back_to_its_sessions():
+    t = transcriber()
+    audios = [audio(1, 2.0), audio(2, 3.5), audio(3, 1.0)]
+
+    results = t.transcribe_batch(audios, {})
+
+    (length, clips, prompt), = t.pipeline.calls
+    assert length > CHUNK_LENGTH*SAMPLING_RATE
+    assert [c["end"] - c["start"] for c in clips] == [len(a) for a in audios]
+    assert [[s.text for s in r] for r in results] == [["None:s1"], ["None:s2"], ["None:s3"]]
+    for a, r in zip(audios, results):
+        # in the time of the session's own buffer
+        assert abs(r[0].start - 0.1) < 1e-6 and abs(r[0].end - (len(a)/SAMPLING_RATE - 0.1)) < 1e-6
+        assert r[0].words[0].start == r[0].start
+
+
+def test_sessions_are_batched_by_prompt():
+    t = transcriber()
+    audios = [audio(1, 2.0), audio(2, 2.0), audio(3, 2.0), audio(4, 2.0), audio(5, 2.0)]
+    prompts = ["", "a", None, "a", "b"]
+
+    results = t.transcribe_batch(audios, {}, prompts=prompts)
+
+    assert sorted(str(prompt) for _, _, prompt in t.pipeline.calls) == ["None", "a"]
+    assert t.model.calls == ["b"]
+    assert [r[0].text for r in results] == ["None:s1", "a:s2", "None:s3", "a:s4", "b:s5"]
+
+
+def test_long_buffer_is_decoded_alone():
+    t = transcriber()
+    audios = [audio(1, CHUNK_LENGTH + 1.0), audio(2, 2.0), audio(3, 2.0)]
+
+    results = t.transcribe_batch(audios, {}, prompts=["p", None, None])
+
+    assert t.model.calls == ["p"]
+    assert [r[0].text for r in results] == ["p:s1", "None:s2", "None:s3"]
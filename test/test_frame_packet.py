@@ -0,0 +1,127 @@
+# Round trips of the framing protocol of the streaming servers.
+#
+#   python -m pytest test/test_frame_packet.py
+import asyncio
+import socket
+import struct
+import threading
+
+import pytest
+
+from modules.whisper import frame_packet
+from modules.whisper.frame_packet import (
+    AUDIO, CONTROL, END, TRANSCRIPT, FrameDecoder, ProtocolError, TranscriptEvent,
+)
+
+FRAMES = [
+    (AUDIO, struct.pack("<4h", 0, 1, -1, 32767)),
+    (TRANSCRIPT, TranscriptEvent(0.5, 1.25, " 혈압 정상, blood pressure normal", committed=False).to_payload()),
+    (CONTROL, frame_packet.hello("abc", {"sample_rate": 48000, "channels": 2})[frame_packet.HEADER.size:]),
+    (END, b""),
+]
+
+
+def stream():
+    return b"".join(frame_packet.encode_frame(t, p) for t, p in FRAMES)
+
+
+def test_transcript_event_round_trip():
+    event = TranscriptEvent(start=1.0, end=2.5, text=" Ärztin: 안녕하세요", speaker="SPEAKER_01", committed=False)
+
+    assert TranscriptEvent.from_payload(event.to_payload()) == event
+
+
+@pytest.mark.parametrize("split", [1, 2, 5, 7, 64])
+def test_decoder_reassembles_frames_split_anywhere(split):
+    data = stream()
+    decoder = FrameDecoder()
+
+    frames = []
+    for i in range(0, len(data), split):
+        frames += decoder.feed(data[i:i+split])
+
+    assert frames == FRAMES
+
+
+def test_decoder_compacts_its_buffer():
+    decoder = FrameDecoder()
+    frame = frame_packet.encode_frame(AUDIO, bytes(4000))
+
+    for _ in range(100):
+        assert decoder.feed(frame) == [(AUDIO, bytes(4000))]
+
+    assert len(decoder._data) < 65536 + len(frame)
+
+
+def test_oversized_frames_are_rejected():
+    with pytest.raises(ProtocolError):
+        frame_packet.encode_frame(AUDIO, bytes(frame_packet.MAX_PAYLOAD + 1))
+    with pytest.raises(ProtocolError):
+        FrameDecoder().feed(frame_packet.HEADER.pack(AUDIO, frame_packet.MAX_PAYLOAD + 1))
+
+
+def test_hello_and_session_messages():
+    message = frame_packet.parse_hello((CONTROL, frame_packet.hello(None)[frame_packet.HEADER.size:]))
+    assert message == {"type": "hello", "session": None}
+    assert frame_packet.audio_format(message) == frame_packet.DEFAULT_FORMAT
+
+    message = frame_packet.parse_hello(FRAMES[2])
+    assert frame_packet.audio_format(message) == {"sample_rate": 48000, "channels": 2}
+
+    payload = frame_packet.session_message("abc", 4.3)[frame_packet.HEADER.size:]
+    assert frame_packet.decode_control(payload) == {
+        "type": "session", "session": "abc", "resume_from": 4.3, "format": frame_packet.DEFAULT_FORMAT}
+
+
+@pytest.mark.parametrize("audio_format", [{"sample_rate": 100}, {"sample_rate": 44100.0}, {"channels": 0}])
+def test_unsupported_audio_formats_are_rejected(audio_format):
+    with pytest.raises(ProtocolError):
+        frame_packet.audio_format({"type": "hello", "format": audio_format})
+
+
+def test_hello_is_required():
+    with pytest.raises(ProtocolError):
+        frame_packet.parse_hello(FRAMES[0])
+    with pytest.raises(ProtocolError):
+        frame_packet.parse_hello((CONTROL, b'{"type": "session"}'))
+
+
+def test_frames_over_a_socket():
+    client, server = socket.socketpair()
+    with client, server:
+        for frame_type, payload in FRAMES:
+            frame_packet.send_frame(client, frame_type, payload)
+        client.shutdown(socket.SHUT_WR)
+
+        assert [frame_packet.receive_frame(server) for _ in FRAMES] == FRAMES
+        assert frame_packet.receive_frame(server) is None
+
+
+def test_handshake_negotiates_the_lower_version():
+    client, server = socket.socketpair()
+    with client, server:
+        accepted = {}
+        thread = threading.Thread(target=lambda: accepted.update(server=frame_packet.negotiate_server(server)))
+        thread.start()
+        assert frame_packet.negotiate_client(client, version=1) == 1
+        thread.join()
+        assert accepted["server"] == 1
+
+
+def test_legacy_audio_stays_in_the_socket():
+    client, server = socket.socketpair()
+    with client, server:
+        client.sendall(bytes(range(10)))
+
+        assert frame_packet.negotiate_server(server) is None
+        assert frame_packet.receive_exactly(server, 10) == bytes(range(10))
+
+
+def test_read_frame():
+    async def read_all():
+        reader = asyncio.StreamReader()
+        reader.feed_data(stream())
+        reader.feed_eof()
+        return [await frame_packet.read_frame(reader) for _ in range(len(FRAMES) + 1)]
+
+    assert asyncio.run(read_all()) == FRAMES + [None]
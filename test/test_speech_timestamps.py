@@ -0,0 +1,57 @@
+# Tests of SileroVAD.restore_speech_timestamps, the mapping of the timestamps of the speech
+# collected by the VAD filter back to the original audio.
+#
+#   python -m pytest test/test_speech_timestamps.py
+import pytest
+
+silero_vad = pytest.importorskip("modules.vad.silero_vad")
+restore_speech_timestamps = silero_vad.SileroVAD.restore_speech_timestamps
+
+SAMPLING_RATE = 16000
+# speech at 1-3 s, 5-6 s and 10-12 s: at 0-2 s, 2-3 s and 3-5 s of the collected audio
+CHUNKS = [
+    {"start": 1*SAMPLING_RATE, "end": 3*SAMPLING_RATE},
+    {"start": 5*SAMPLING_RATE, "end": 6*SAMPLING_RATE},
+    {"start": 10*SAMPLING_RATE, "end": 12*SAMPLING_RATE},
+]
+
+
+def times(segments):
+    return [(round(s["start"], 6), round(s["end"], 6)) for s in segments]
+
+
+def test_segments_inside_a_chunk_are_shifted():
+    segments = [{"start": 0.5, "end": 1.5, "text": "a"}, {"start": 3.25, "end": 4.5, "text": "b"}]
+
+    assert times(restore_speech_timestamps(segments, CHUNKS, SAMPLING_RATE)) == [(1.5, 2.5), (10.25, 11.5)]
+
+
+def test_boundary_is_the_start_of_the_later_chunk_and_the_end_of_the_earlier_one():
+    segments = [{"start": 0.0, "end": 2.0, "text": "a"}, {"start": 2.0, "end": 3.0, "text": "b"}]
+
+    assert times(restore_speech_timestamps(segments, CHUNKS, SAMPLING_RATE)) == [(1.0, 3.0), (5.0, 6.0)]
+
+
+def test_segment_across_chunks_and_its_words():
+    segment = {"start": 1.5, "end": 4.0, "text": "a b c", "words": [
+        {"start": 1.5, "end": 1.9, "word": "a"},
+        {"start": 2.2, "end": 2.8, "word": "b"},
+        {"start": 3.5, "end": 4.0, "word": "c"},
+    ]}
+
+    restore_speech_timestamps([segment], CHUNKS, SAMPLING_RATE)
+
+    assert times([segment]) == [(2.5, 11.0)]
+    assert times(segment["words"]) == [(2.5, 2.9), (5.2, 5.8), (10.5, 11.0)]
+
+
+def test_times_past_the_speech_are_clamped_to_its_end():
+    segments = [{"start": 4.5, "end": 5.3, "text": "a"}]
+
+    assert times(restore_speech_timestamps(segments, CHUNKS, SAMPLING_RATE)) == [(11.5, 12.0)]
+
+
+def test_without_chunks_the_segments_are_unchanged():
+    segments = [{"start": 0.5, "end": 1.5, "text": "a", "words": None}]
+
+    assert times(restore_speech_timestamps(segments, [], SAMPLING_RATE)) == [(0.5, 1.5)]
@@ -0,0 +1,77 @@
+# Tests of the on-disk transcription cache.
+#
+#   python -m pytest test/test_transcription_cache.py
+import os
+from dataclasses import dataclass
+
+from modules.whisper.transcription_cache import TranscriptionCache, cache_key
+
+SEGMENTS = [
+    {"start": 0.0, "end": 2.5, "text": " Blood pressure 120 over 80.", "words": [
+        {"start": 0.0, "end": 0.4, "word": " Blood", "probability": 0.91},
+        {"start": 0.4, "end": 0.9, "word": " pressure", "probability": 0.875},
+        {"start": 1.0, "end": 2.5, "word": " 120 over 80."},
+    ]},
+    {"start": 2.5, "end": 4.0, "text": " 患者は安定。"},
+]
+
+
+@dataclass
+class Params:
+    model_size: str = "large-v3"
+    beam_size: int = 5
+    is_diarize: bool = False
+    hf_token: str = ""
+
+
+def test_pack_and_unpack_round_trip():
+    packed = TranscriptionCache.pack(SEGMENTS)
+
+    assert TranscriptionCache.unpack(packed) == SEGMENTS
+
+
+def test_pack_and_unpack_without_segments():
+    assert TranscriptionCache.unpack(TranscriptionCache.pack([])) == []
+
+
+def test_put_and_get(tmp_path):
+    cache = TranscriptionCache(str(tmp_path))
+    key = cache_key("0" * 64, Params(), "FasterWhisperInference")
+
+    assert cache.get(key) is None
+    cache.put(key, SEGMENTS)
+
+    assert cache.get(key) == SEGMENTS
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert os.listdir(tmp_path) == [key + ".npz"]
+
+
+def test_unreadable_entry_is_a_miss(tmp_path):
+    cache = TranscriptionCache(str(tmp_path))
+    with open(cache.path("broken"), "wb") as f:
+        f.write(b"not an npz file")
+
+    assert cache.get("broken") is None
+
+
+def test_key_ignores_the_diarization_settings_only():
+    key = cache_key("0" * 64, Params(), "FasterWhisperInference")
+
+    assert cache_key("0" * 64, Params(is_diarize=True, hf_token="token"), "FasterWhisperInference") == key
+    assert cache_key("0" * 64, Params(beam_size=1), "FasterWhisperInference") != key
+    assert cache_key("1" * 64, Params(), "FasterWhisperInference") != key
+    assert cache_key("0" * 64, Params(), "WhisperInference") != key
+
+
+def test_least_recently_read_entries_are_evicted(tmp_path):
+    cache = TranscriptionCache(str(tmp_path))
+    for i, key in enumerate(["a", "b", "c"]):
+        cache.put(key, SEGMENTS)
+        os.utime(cache.path(key), (1000 + i, 1000 + i))
+    entry_size = os.path.getsize(cache.path("a"))
+    cache.get("a") # now the most recently used
+
+    cache.max_bytes = 2 * entry_size
+    cache.evict()
+
+    assert sorted(os.listdir(tmp_path)) == ["a.npz", "c.npz"]
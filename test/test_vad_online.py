@@ -0,0 +1,120 @@
+# Tests of VADOnlineASRProcessor with a stub ASR and a scripted VAD.
+#
+#   python -m pytest test/test_vad_online.py
+from types import SimpleNamespace
+
+import numpy as np
+
+from modules.whisper.vad_online import VADOnlineASRProcessor
+from modules.whisper.whisper_online import OnlineASRProcessor
+
+SAMPLING_RATE = 16000
+WORD = SAMPLING_RATE // 2 # every half second of speech is one word
+
+
+class StubASR:
+    """Transcribes every half second of the buffer as the word "w<k>", where k is the amplitude of
+    the samples x 1000, so the words tell which part of the stream was decoded. Silence has no word."""
+    sep = ""
+
+    def __init__(self):
+        self.calls = 0
+
+    def transcribe(self, audio, initial_prompt=None, **kwargs):
+        self.calls += 1
+        words = []
+        for i in range(len(audio) // WORD):
+            k = int(round(float(np.median(audio[i*WORD:(i+1)*WORD])) * 1000))
+            if k > 0:
+                words.append(SimpleNamespace(start=i*0.5 + 0.05, end=i*0.5 + 0.45, word=f" w{k}"))
+        segments = [SimpleNamespace(start=w.start, end=w.end, words=[w], no_speech_prob=0.0, text=w.word)
+                    for w in words]
+        return iter(segments), None
+
+
+class ScriptedVAD:
+    """Returns the events of `script`, [(sample at which it's reported, event)], once that sample is received"""
+
+    def __init__(self, script):
+        self.script = script
+        self.reset()
+
+    def reset(self):
+        self.received = 0
+
+    def __call__(self, audio):
+        before = self.received
+        self.received += len(audio)
+        return [event for at, event in self.script if before < at <= self.received]
+
+
+def speech(words, first=1):
+    """half a second per word, numbered from `first`"""
+    return np.repeat(np.arange(first, first + words, dtype=np.float32) / 1000, WORD)
+
+
+def silence(seconds):
+    return np.zeros(int(seconds*SAMPLING_RATE), dtype=np.float32)
+
+
+def words_of(outputs):
+    return "".join(o[2] for o in outputs).split()
+
+
+def run(proc, audio, chunk_sec):
+    chunk = int(chunk_sec*SAMPLING_RATE)
+    outputs = []
+    for i in range(0, len(audio), chunk):
+        proc.insert_audio_chunk(audio[i:i+chunk])
+        outputs.append(proc.process_iter({}))
+    outputs.append(proc.finish())
+    return outputs
+
+
+def test_utterance_tail_is_decoded_before_it_is_finished():
+    # 4 s of speech; the VAD reports its end in the chunk that carries its last 1.5 s
+    audio = np.concatenate([speech(8), silence(1.0)])
+    vad = ScriptedVAD([(1, {"start": 0}), (len(audio), {"end": 8*WORD})])
+    asr = StubASR()
+    proc = VADOnlineASRProcessor(OnlineASRProcessor(asr), vad)
+
+    outputs = run(proc, audio, chunk_sec=2.5)
+
+    assert words_of(outputs) == [f"w{k}" for k in range(1, 9)]
+    assert asr.calls == 2
+
+
+def test_short_utterance_within_one_chunk_is_decoded():
+    # the end of the first utterance, and the whole second one, arrive in the same chunk
+    audio = np.concatenate([speech(4), silence(1.0), speech(2, first=11), silence(1.0)])
+    second = 4*WORD + SAMPLING_RATE
+    vad = ScriptedVAD([
+        (1, {"start": 0}),
+        (second, {"end": 4*WORD}),
+        (second + 1, {"start": second}),
+        (len(audio), {"end": second + 2*WORD}),
+    ])
+    proc = VADOnlineASRProcessor(OnlineASRProcessor(StubASR()), vad)
+
+    outputs = run(proc, audio, chunk_sec=1.5)
+
+    assert words_of(outputs) == ["w1", "w2", "w3", "w4", "w11", "w12"]
+    second_words = [o for o in outputs if "w11" in o[2]]
+    assert second_words and second_words[0][0] >= second/SAMPLING_RATE
+
+
+def test_restored_utterance_is_decoded_before_it_is_finished():
+    audio = speech(6)
+    vad = ScriptedVAD([(1, {"start": 0})])
+    proc = VADOnlineASRProcessor(OnlineASRProcessor(StubASR()), vad)
+    proc.insert_audio_chunk(audio[:2*WORD])
+    committed = [proc.process_iter({})]
+    proc.insert_audio_chunk(audio[2*WORD:]) # the connection drops before this audio is decoded
+    state, state_audio = proc.state(), proc.state_audio()
+
+    restored = VADOnlineASRProcessor(OnlineASRProcessor(StubASR()), ScriptedVAD([]))
+    restored.load_state(state, state_audio)
+    outputs = committed + [restored.process_iter({}), restored.finish()]
+
+    assert words_of(outputs) == [f"w{k}" for k in range(1, 7)]
+    assert restored.asr.calls == 1